@@ -1,13 +1,33 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, make_response, stream_with_context, g
+from flask.logging import default_handler
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, joinedload, make_transient_to_detached
+from sqlalchemy.exc import SQLAlchemyError
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+import click
 import numpy as np
-import pandas as pd
-from datetime import datetime
+import sys
+import threading
+from dataclasses import replace
+from array import array
+from datetime import datetime, timezone
+from functools import wraps
+import hashlib
+import hmac
+import logging
 import os
+import time
 import requests
-from sklearn.metrics.pairwise import cosine_similarity
+from text_similarity import TextNeighborIndex, build_index as build_text_index
+from export import ThroughputMeter, gzip_chunks, ndjson_chunks
+from rating_store import RatingArrays, RatingStore
+from score_fusion import CatalogIndex, StageScores, fuse, load_profiles, profile_for, top_k
+from shared_state import SharedArtifact
+from trending import ALL_GROUP, MIN_SCORE, aggregate_ratings, decay_factor
+from user_context import ContextCache, UserContext
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY", "dev-secret-key")
@@ -15,8 +35,12 @@ app.config['SECRET_KEY'] = os.getenv("SECRET_KEY", "dev-secret-key")
 # Use an instance DB path so it works on Render/Gunicorn
 os.makedirs(app.instance_path, exist_ok=True)
 db_path = os.path.join(app.instance_path, "movie_recommendations.db")
-app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
+# MOVIE_DB_URL (not the platform's DATABASE_URL, which may be Postgres) points the app at another SQLite file;
+# the upserts below use the SQLite dialect
+app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("MOVIE_DB_URL", f"sqlite:///{db_path}")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Bearer token for the bulk export API (/api/export/*); unset disables the endpoints
+app.config['EXPORT_TOKEN'] = os.getenv("EXPORT_TOKEN")
 
 db = SQLAlchemy(app)
 login_manager = LoginManager()
@@ -67,12 +91,209 @@ class Preference(db.Model):
     genre = db.Column(db.String(100), nullable=False)
     weight = db.Column(db.Float, default=1.0)  # Preference weight
 
+class UserDataVersion(db.Model):
+    """Per-user counter bumped whenever the user's ratings or preferences change (used in ETags)"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class CatalogVersion(db.Model):
+    """Single-row counter bumped in the same transaction as any movie change (shared by all workers, used in ETags)"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class TrendingScore(db.Model):
+    """Materialized time-decayed popularity per age group (refreshed by refresh_trending)"""
+    age_group = db.Column(db.String(10), primary_key=True)  # kid, youth, adult or "all"
+    movie_id = db.Column(db.Integer, db.ForeignKey('movie.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False, default=0.0)  # Decayed to TrendingState.refreshed_at
+    
+    __table_args__ = (db.Index('ix_trending_score_group_score', 'age_group', 'score'),)
+
+class TrendingState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    last_rating_id = db.Column(db.Integer, nullable=False, default=0)  # Ratings up to this id are aggregated
+    refreshed_at = db.Column(db.DateTime, nullable=False)
+
 # External movie API (OMDb) setup
 OMDB_API_KEY = os.getenv("OMDB_API_KEY")
 
+# Precomputed TF-IDF description neighbors, published in generations that every worker
+# memory-maps read-only (one copy in RAM however many gunicorn workers run)
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", os.path.join(app.instance_path, "shared"))
+TEXT_INDEX_TOP_N = 20
+# A worker that finds the index built for an older catalog version keeps serving it while one
+# background thread rebuilds it (0 leaves rebuilds to startup and `flask build-text-index`)
+TEXT_INDEX_REBUILD_IN_BACKGROUND = os.getenv("TEXT_INDEX_REBUILD_IN_BACKGROUND", "1") != "0"
+_text_index_artifact = SharedArtifact(SHARED_STATE_DIR, "text_neighbors")
+_text_index = None
+_text_index_rebuilding = threading.Lock()
+
+# Trending refresh cadence (seconds) and decay half-life (days)
+TRENDING_REFRESH_SECONDS = int(os.getenv("TRENDING_REFRESH_SECONDS", "300"))
+TRENDING_HALF_LIFE_DAYS = float(os.getenv("TRENDING_HALF_LIFE_DAYS", "14"))
+# Requests never aggregate ratings themselves: a stale table is refreshed by one background thread per
+# worker (0 leaves it entirely to `flask refresh-trending`, e.g. from cron)
+TRENDING_REFRESH_IN_BACKGROUND = os.getenv("TRENDING_REFRESH_IN_BACKGROUND", "1") != "0"
+_trending_checked_at = None
+_trending_refresh_running = threading.Lock()
+
+# Compact array-backed rating store (memory-mapped snapshot + append log), used by the ML paths
+RATING_STORE_DIR = os.getenv("RATING_STORE_DIR", os.path.join(app.instance_path, "rating_store"))
+RATING_LOG_COMPACT_PAIRS = int(os.getenv("RATING_LOG_COMPACT_PAIRS", "50000"))
+_rating_store = None
+
+# Local catalog version (bumped on any Movie change made by this worker) and shared cold-start lists per age bracket
+# (validated against the shared CatalogVersion row, so other workers' movie changes invalidate them too)
+_catalog_version = 0
+_cold_start_cache = {}
+COLD_START_TTL_SECONDS = TRENDING_REFRESH_SECONDS  # Cold-start lists include trending fallbacks
+
+def bump_catalog_version(connection=None):
+    """
+    Record a catalog change: increments the shared CatalogVersion row as part of the caller's
+    transaction (the session's unless a connection is given) and drops this worker's caches
+    """
+    global _catalog_version
+    table = CatalogVersion.__table__
+    stmt = sqlite_insert(table).values(id=1, version=1)
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.id], set_={'version': table.c.version + 1})
+    (connection if connection is not None else db.session).execute(stmt)
+    _catalog_version += 1
+    _cold_start_cache.clear()
+
+@event.listens_for(Movie, 'after_insert')
+@event.listens_for(Movie, 'after_update')
+@event.listens_for(Movie, 'after_delete')
+def _movie_changed(mapper, connection, target):
+    bump_catalog_version(connection)
+
+# HTTP caching: how long recommendation/detail ETags stay valid when only other users' activity changed,
+# and how long browsers may reuse catalog pages without revalidating
+RECOMMENDATION_ETAG_SECONDS = int(os.getenv("RECOMMENDATION_ETAG_SECONDS", str(TRENDING_REFRESH_SECONDS)))
+CATALOG_MAX_AGE_SECONDS = int(os.getenv("CATALOG_MAX_AGE_SECONDS", "60"))
+
+# Per-worker LRU of user contexts, validated against UserDataVersion (0 disables it)
+USER_CONTEXT_CACHE_SIZE = int(os.getenv("USER_CONTEXT_CACHE_SIZE", "1024"))
+_user_context_cache = ContextCache(USER_CONTEXT_CACHE_SIZE)
+
+# Most recently watched movies used as similarity seeds (bounds that stage for power users)
+SIMILARITY_SEED_LIMIT = int(os.getenv("SIMILARITY_SEED_LIMIT", "100"))
+
+# Hybrid score fusion: stage weight profiles per age group (JSON overrides of the defaults)
+# and the catalog index with per-bracket age masks, rebuilt after catalog changes
+FUSION_WEIGHT_PROFILES = load_profiles(os.getenv("FUSION_WEIGHTS"))
+_fusion_catalog = None
+
+def get_catalog_token():
+    """Shared catalog version, read on every request (a primary-key lookup) so any worker's movie edits change ETags"""
+    return db.session.query(CatalogVersion.version).filter_by(id=1).scalar() or 0
+
+def get_user_data_version(user_id):
+    row = UserDataVersion.query.get(user_id)
+    return row.version if row else 0
+
+def bump_user_data_version(user_id):
+    """Increment the user's data version as part of the caller's transaction"""
+    table = UserDataVersion.__table__
+    stmt = sqlite_insert(table).values(user_id=user_id, version=1)
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.user_id], set_={'version': table.c.version + 1})
+    db.session.execute(stmt)
+
+def conditional(etag_parts, cache_control='private, no-cache'):
+    """
+    Serve 304 Not Modified when the client's If-None-Match matches the strong ETag built from
+    etag_parts(*view_args) -- checked before the view runs, so nothing is recomputed.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = hashlib.sha1('|'.join(str(p) for p in etag_parts(*args, **kwargs)).encode()).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = cache_control
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
+
+def _user_etag_parts(*args, **kwargs):
+    # Other users' ratings (collaborative, trending, averages) surface once per time bucket
+    return (current_user.id, current_user.data_version, get_catalog_token(),
+            int(time.time() // RECOMMENDATION_ETAG_SECONDS), *kwargs.values())
+
+def _catalog_etag_parts(*args, **kwargs):
+    # The rendered page carries the logged-in user's navigation, so the user id is part of it
+    return (current_user.id, get_catalog_token())
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # The data version rides along so ETags and the user-context cache validate without another query
+    row = db.session.query(User, UserDataVersion.version).outerjoin(
+        UserDataVersion, UserDataVersion.user_id == User.id
+    ).filter(User.id == int(user_id)).first()
+    if row is None:
+        return None
+    user, version = row
+    user.data_version = version or 0
+    return user
+
+def _user_data_rows(user_id):
+    """The user's ratings (oldest first, by created_at then id) and preferences in a single round-trip"""
+    ratings = db.session.query(
+        db.literal('rating').label('kind'), Rating.movie_id.label('movie_id'), Rating.rating.label('value'),
+        db.literal(None, db.String).label('genre'), Rating.created_at.label('created_at'), Rating.id.label('row_id')
+    ).filter(Rating.user_id == user_id)
+    preferences = db.session.query(
+        db.literal('preference').label('kind'), db.literal(None, db.Integer).label('movie_id'),
+        Preference.weight.label('value'), Preference.genre.label('genre'),
+        db.literal(None, db.DateTime).label('created_at'), Preference.id.label('row_id')
+    ).filter(Preference.user_id == user_id)
+    # Without an explicit order SQLite returns ratings in (user_id, movie_id) index order, not by recency
+    rows = ratings.union_all(preferences).subquery()
+    return db.session.query(rows.c.kind, rows.c.movie_id, rows.c.value, rows.c.genre).order_by(
+        rows.c.created_at, rows.c.row_id
+    ).all()
+
+def get_user_context(user_id):
+    """
+    Return the UserContext shared by all recommendation stages, built at most once per request.
+    
+    The user row comes from the session identity map (already loaded by load_user), ratings and
+    preferences from one UNION ALL query; the result is reused across requests until the user's
+    data version changes.
+    """
+    contexts = g.setdefault('user_contexts', {})
+    if user_id in contexts:
+        return contexts[user_id]
+    
+    user = User.query.get(user_id)
+    if user is None:
+        context = UserContext(user_id, None, None)
+    else:
+        version = getattr(user, 'data_version', None)
+        if version is None:
+            version = user.data_version = get_user_data_version(user_id)
+        context = _user_context_cache.get(user_id, version, user.created_at)
+        if context is None:
+            context = UserContext.from_rows(
+                user_id, user.age, get_age_group(user.age), _user_data_rows(user_id),
+                data_version=version, created_at=user.created_at
+            )
+            _user_context_cache.put(context)
+        context = replace(context, user=user)
+    
+    contexts[user_id] = context
+    return context
+
+def invalidate_user_context(user_id):
+    """Forget the user's context after writing their ratings or preferences"""
+    g.get('user_contexts', {}).pop(user_id, None)
+    _user_context_cache.discard(user_id)
 
 # Routes
 @app.route('/')
@@ -145,15 +366,16 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Get user's rated movies
-    user_ratings = Rating.query.filter_by(user_id=current_user.id).all()
-    rated_movie_ids = [r.movie_id for r in user_ratings]
+    context = get_user_context(current_user.id)
+    
+    # Get user's rated movies (with their movies, for display)
+    user_ratings = Rating.query.options(joinedload(Rating.movie)).filter_by(user_id=current_user.id).all()
     
     # Get recommendations
-    recommendations = get_recommendations(current_user.id)
+    recommendations = get_recommendations(current_user.id, context=context)
     
     # Get all movies (excluding already rated ones)
-    all_movies = Movie.query.filter(~Movie.id.in_(rated_movie_ids)).limit(20).all()
+    all_movies = Movie.query.filter(exclude_movies(rated_by=current_user.id)).limit(20).all()
     
     return render_template('dashboard.html', 
                          user_ratings=user_ratings,
@@ -162,6 +384,7 @@ def dashboard():
 
 @app.route('/movies')
 @login_required
+@conditional(_catalog_etag_parts, cache_control=f'private, max-age={CATALOG_MAX_AGE_SECONDS}')
 def movies():
     search = request.args.get('search', '')
     genre_filter = request.args.get('genre', '')
@@ -181,15 +404,18 @@ def movies():
 
 @app.route('/movie/<int:movie_id>')
 @login_required
+@conditional(_user_etag_parts)
 def movie_detail(movie_id):
     movie = Movie.query.get_or_404(movie_id)
     user_rating = Rating.query.filter_by(user_id=current_user.id, movie_id=movie_id).first()
     all_ratings = Rating.query.filter_by(movie_id=movie_id).all()
     avg_rating = np.mean([r.rating for r in all_ratings]) if all_ratings else 0
+    similar_movies = get_similar_movies(movie_id, num_movies=6, user_age=current_user.age)
     
     return render_template('movie_detail.html', movie=movie, 
                          user_rating=user_rating, avg_rating=avg_rating,
-                         total_ratings=len(all_ratings))
+                         total_ratings=len(all_ratings),
+                         similar_movies=similar_movies)
 
 @app.route('/rate_movie', methods=['POST'])
 @login_required
@@ -214,7 +440,10 @@ def rate_movie():
         db.session.add(new_rating)
         flash('Rating submitted successfully', 'success')
     
+    bump_user_data_version(current_user.id)
     db.session.commit()
+    invalidate_user_context(current_user.id)
+    record_rating(current_user.id, movie_id, rating)
     return redirect(url_for('movie_detail', movie_id=movie_id))
 
 @app.route('/preferences', methods=['GET', 'POST'])
@@ -238,7 +467,9 @@ def preferences():
             preference = Preference(user_id=current_user.id, genre=genre)
             db.session.add(preference)
         
+        bump_user_data_version(current_user.id)
         db.session.commit()
+        invalidate_user_context(current_user.id)
         flash('Preferences updated successfully', 'success')
         return redirect(url_for('dashboard'))
     
@@ -247,13 +478,13 @@ def preferences():
     genres = [g[0] for g in genres if g[0]]
     
     # Get user's current preferences
-    user_preferences = Preference.query.filter_by(user_id=current_user.id).all()
-    preferred_genres = [p.genre for p in user_preferences]
+    preferred_genres = list(get_user_context(current_user.id).preferred_genres)
     
     return render_template('preferences.html', genres=genres, preferred_genres=preferred_genres)
 
 @app.route('/api/recommendations')
 @login_required
+@conditional(_user_etag_parts)
 def api_recommendations():
     recommendations = get_recommendations(current_user.id)
     return jsonify([{
@@ -264,106 +495,244 @@ def api_recommendations():
         'score': score
     } for m, score in recommendations])
 
+@app.route('/api/movie/<int:movie_id>/similar')
+@login_required
+def api_similar_movies(movie_id):
+    Movie.query.get_or_404(movie_id)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), TEXT_INDEX_TOP_N)
+    similar_movies = get_similar_movies(movie_id, num_movies=limit, user_age=current_user.age)
+    return jsonify([{
+        'id': m.id,
+        'title': m.title,
+        'genre': m.genre,
+        'year': m.year,
+        'score': score
+    } for m, score in similar_movies])
+
+def export_token_required(view):
+    """
+    Bulk exports include every user's ratings and reviews, so a login is not enough: the request
+    must carry `Authorization: Bearer <EXPORT_TOKEN>`. Without a configured token the API is off.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = app.config.get('EXPORT_TOKEN')
+        auth = request.headers.get('Authorization', '')
+        scheme, _, presented = auth.partition(' ')
+        if not token or scheme.lower() != 'bearer' or not hmac.compare_digest(presented.strip().encode(), token.encode()):
+            return jsonify({'error': 'Export requires a valid export token'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/api/export/movies')
+@export_token_required
+def api_export_movies():
+    since_id = request.args.get('since_id', 0, type=int)
+    return _export_response(export_movie_rows(since_id), 'movies')
+
+@app.route('/api/export/ratings')
+@export_token_required
+def api_export_ratings():
+    since_id = request.args.get('since_id', 0, type=int)
+    since = request.args.get('since')
+    if since:
+        try:
+            since = datetime.fromisoformat(since)
+        except ValueError:
+            return jsonify({'error': 'since must be an ISO 8601 timestamp'}), 400
+    return _export_response(export_rating_rows(since_id, since), 'ratings')
+
+def _export_response(rows, label):
+    """Stream rows as NDJSON (gzip-compressed with ?gzip=1), logging throughput when done"""
+    use_gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    meter = ThroughputMeter()
+    
+    def generate():
+        chunks = ndjson_chunks(rows, meter)
+        if use_gzip:
+            chunks = gzip_chunks(chunks)
+        yield from chunks
+        export_logger.info(meter.summary(label))
+    
+    response = app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+# Data export (NDJSON, streamed in id order so the last id seen is the next watermark)
+EXPORT_BATCH_SIZE = 1000
+
+# Export throughput goes to its own INFO logger: app.logger only emits warnings unless configured
+export_logger = logging.getLogger('movie_app.export')
+export_logger.setLevel(logging.INFO)
+export_logger.addHandler(default_handler)
+export_logger.propagate = False
+
+def export_movie_rows(since_id=0):
+    query = db.session.query(
+        Movie.id, Movie.title, Movie.genre, Movie.year, Movie.director, Movie.cast,
+        Movie.description, Movie.poster_url, Movie.age_rating
+    ).filter(Movie.id > since_id).order_by(Movie.id)
+    for row in query.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE):
+        yield row._asdict()
+
+def export_rating_rows(since_id=0, since=None):
+    query = db.session.query(
+        Rating.id, Rating.user_id, Rating.movie_id, Rating.rating, Rating.review, Rating.created_at
+    ).filter(Rating.id > since_id)
+    if since:
+        query = query.filter(Rating.created_at > since)
+    for row in query.order_by(Rating.id).execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE):
+        yield row._asdict()
+
 # Recommendation Algorithm
-def get_recommendations(user_id, num_recommendations=10):
+def get_recommendations(user_id, num_recommendations=10, context=None):
     """
     Enhanced Hybrid recommendation system:
     1. Age-based filtering (age-appropriate content)
     2. Similarity-based (for watched movies: genre, cast, director, year)
     3. Collaborative filtering (user-based)
     4. Content-based filtering (genre preferences)
+    5. Description similarity (precomputed TF-IDF neighbors of liked movies)
+    
+    All stages read the user's data from `context` (loaded once per request when not given).
     """
-    user = User.query.get(user_id)
-    user_ratings = Rating.query.filter_by(user_id=user_id).all()
-    user_rated_movie_ids = [r.movie_id for r in user_ratings]
-    movie_scores = {}
+    context = context or get_user_context(user_id)
+    user_age = context.age
+    rated_by = user_id if context.has_ratings else None  # Rated movies are excluded in SQL (anti-join)
+    
+    # Cold start (no ratings, no preferences): the result only depends on the age bracket
+    cold_start_key = None
+    if context.is_cold_start:
+        cold_start_key = (get_cold_start_bracket(user_age), num_recommendations)
+        # Read before computing, so a list built while the catalog changes is stored under the old version
+        catalog_version = get_catalog_token()
+        cached = get_cached_cold_start(cold_start_key, catalog_version)
+        if cached is not None:
+            return cached
     
     # 1. Age-based recommendations (if age is provided) - HIGH PRIORITY
-    if user and user.age:
-        age_based_movies = get_age_based_recommendations(user.age, user_rated_movie_ids, num_recommendations * 2)
-        for movie in age_based_movies:
-            if movie.id not in user_rated_movie_ids:
-                # Higher priority for age-based (especially for children)
-                priority = 0.8 if user.age < 13 else 0.6
-                movie_scores[movie.id] = priority  # Age-based score
+    #    (higher weight for children, see FUSION_WEIGHT_PROFILES)
+    stage_outputs = []
+    if user_age:
+        age_based_movies = get_age_based_recommendations(user_age, [], num_recommendations * 2, rated_by=rated_by)
+        stage_outputs.append(("age", [(movie, 1.0) for movie in age_based_movies]))
     
     # 2. Similarity-based recommendations (if user has watched movies)
-    if user_ratings:
-        user_age_for_filter = user.age if user else None
-        similarity_movies = get_similarity_based_recommendations(user_id, user_rated_movie_ids, num_recommendations * 2, user_age_for_filter)
-        for movie, score in similarity_movies:
-            # FILTER BY AGE - Only add if age-appropriate
-            if movie.id not in user_rated_movie_ids:
-                if user and user.age:
-                    if not is_age_appropriate(movie, user.age):
-                        continue  # Skip age-inappropriate movies
-                if movie.id not in movie_scores:
-                    movie_scores[movie.id] = score
-                else:
-                    movie_scores[movie.id] += score * 0.5  # Boost similarity matches
+    if context.has_ratings:
+        stage_outputs.append(("similarity", get_similarity_based_recommendations(context, num_recommendations * 2)))
     
     # 3. Collaborative filtering (if enough ratings exist)
-    all_ratings = Rating.query.all()
-    if len(all_ratings) > 10 and user_ratings:
-        user_age_for_filter = user.age if user else None
-        collaborative_movies = get_collaborative_recommendations(user_id, user_rated_movie_ids, num_recommendations, user_age_for_filter)
-        for movie, score in collaborative_movies:
-            # FILTER BY AGE - Only add if age-appropriate
-            if movie.id not in user_rated_movie_ids:
-                if user and user.age:
-                    if not is_age_appropriate(movie, user.age):
-                        continue  # Skip age-inappropriate movies
-                if movie.id not in movie_scores:
-                    movie_scores[movie.id] = score * 0.4
-                else:
-                    movie_scores[movie.id] += score * 0.3
+    if context.has_ratings and len(get_rating_store()) > 10:
+        stage_outputs.append(("collaborative", get_collaborative_recommendations(context, num_recommendations)))
     
     # 4. Content-based (genre preferences)
-    user_age_for_filter = user.age if user else None
-    content_based = get_content_based_recommendations(
-        user_id,
-        num_recommendations * 2,
-        user_age=user_age_for_filter,
-        exclude_movie_ids=user_rated_movie_ids
-    )
-    for movie in content_based:
-        # FILTER BY AGE - Only add if age-appropriate
-        if movie.id not in user_rated_movie_ids:
-            if user and user.age:
-                if not is_age_appropriate(movie, user.age):
-                    continue  # Skip age-inappropriate movies
-            if movie.id not in movie_scores:
-                movie_scores[movie.id] = 0.5
-            else:
-                movie_scores[movie.id] += 0.2
+    content_based = get_content_based_recommendations(context, num_recommendations * 2)
+    stage_outputs.append(("content", [(movie, 1.0) for movie in content_based]))
     
-    # Sort by score and get top recommendations
-    sorted_movies = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)
+    # 5. Description similarity (O(1) neighbor lookups in the precomputed index)
+    if context.has_ratings:
+        stage_outputs.append(("text", get_text_similarity_recommendations(context, num_recommendations * 2)))
     
+    # Fuse the stage score vectors with NumPy; age filtering is a mask over the catalog
+    movies_by_id = {}
+    for _name, scored_movies in stage_outputs:
+        for movie, _score in scored_movies:
+            movies_by_id.setdefault(movie.id, movie)
+    catalog = get_fusion_catalog(movies_by_id)
+    allowed = catalog.age_mask(get_cold_start_bracket(user_age))
+    stages = [
+        # Age-based picks are only age-checked in the final filter below
+        _stage_scores(catalog, name, scored_movies, context.ratings, age_filtered=(name != "age"))
+        for name, scored_movies in stage_outputs
+    ]
+    fused = fuse(stages, profile_for(FUSION_WEIGHT_PROFILES, context.age_group), allowed)
+    
+    # Top scores (get more to filter), FINAL AGE FILTER, cap score at 1.0
     recommendations = []
-    for movie_id, score in sorted_movies[:num_recommendations * 2]:  # Get more to filter
-        movie = Movie.query.get(movie_id)
-        if movie:
-            # FINAL AGE FILTER - Double check before adding to recommendations
-            if user and user.age:
-                if not is_age_appropriate(movie, user.age):
-                    continue  # Skip age-inappropriate movies
-            recommendations.append((movie, min(score, 1.0)))  # Cap score at 1.0
-            if len(recommendations) >= num_recommendations:
-                break  # Stop when we have enough
-    
-    # If we don't have enough recommendations, fill with age-appropriate or popular movies
+    for i in top_k(fused, num_recommendations, window=num_recommendations * 2, allowed=allowed):
+        movie = movies_by_id[int(catalog.movie_ids[fused.positions[i]])]
+        recommendations.append((movie, min(float(fused.scores[i]), 1.0)))
+    
+    # If we don't have enough recommendations, fill with trending, then age-appropriate or popular movies
     if len(recommendations) < num_recommendations:
-        if user and user.age:
-            fallback_movies = get_age_based_recommendations(user.age, user_rated_movie_ids + [m[0].id for m in recommendations], num_recommendations - len(recommendations))
+        fallback_movies = get_trending_movies(user_age, [m[0].id for m in recommendations], num_recommendations - len(recommendations), rated_by=rated_by)
+        for movie in fallback_movies:
+            recommendations.append((movie, 0.3))
+    
+    if len(recommendations) < num_recommendations:
+        if user_age:
+            fallback_movies = get_age_based_recommendations(user_age, [m[0].id for m in recommendations], num_recommendations - len(recommendations), rated_by=rated_by)
         else:
-            fallback_movies = Movie.query.filter(~Movie.id.in_(user_rated_movie_ids + [m[0].id for m in recommendations])).limit(num_recommendations - len(recommendations)).all()
+            fallback_movies = Movie.query.filter(exclude_movies(rated_by, [m[0].id for m in recommendations])).limit(num_recommendations - len(recommendations)).all()
         
         for movie in fallback_movies:
             recommendations.append((movie, 0.3))
     
+    if cold_start_key is not None:
+        store_cold_start(cold_start_key, catalog_version, recommendations)
+    
     return recommendations
 
+# A representative age per get_cold_start_bracket bracket (is_age_appropriate answers alike within one)
+_BRACKET_AGES = {"g_only": 7, "kid": 12, "youth": 17, "adult": 18}
+
+def get_fusion_catalog(movie_ids=()):
+    """
+    Catalog index for score fusion, rebuilt when the shared catalog version moved (a movie changed in
+    any worker) or when `movie_ids` has ids it lacks. Its age masks are the final age check of every
+    recommendation, so they must never lag behind another worker's age_rating edits.
+    """
+    global _fusion_catalog
+    catalog = _fusion_catalog
+    version = get_catalog_token()
+    if catalog is None or catalog.version != version or (catalog.positions(movie_ids) < 0).any():
+        rows = db.session.query(Movie.id, Movie.age_rating).all()
+        masks = {bracket: [is_age_appropriate(row, age) for row in rows] for bracket, age in _BRACKET_AGES.items()}
+        catalog = _fusion_catalog = CatalogIndex([row.id for row in rows], masks, version=version)
+    return catalog
+
+def _stage_scores(catalog, name, scored_movies, exclude, age_filtered=True):
+    """One stage's (movie, score) output as a sparse score vector over catalog positions, skipping ids in `exclude`"""
+    ids, values = [], []
+    for movie, score in scored_movies:
+        if movie.id not in exclude:
+            ids.append(movie.id)
+            values.append(score)
+    return StageScores(name, catalog.positions(ids), np.array(values, dtype=np.float64), age_filtered)
+
+def get_cold_start_bracket(age):
+    """Age bracket that fully determines cold-start recommendations (G-only <=7, kid, youth, adult)"""
+    if not age:
+        return "unknown"
+    if age <= 7:
+        return "g_only"
+    return get_age_group(age)
+
+def get_cached_cold_start(key, catalog_version):
+    """Return the shared cold-start list for (bracket, size) bound to the current session, or None when missing or built for another catalog version"""
+    entry = _cold_start_cache.get(key)
+    if entry is None:
+        return None
+    version, expires_at, snapshot = entry
+    if version != catalog_version or time.monotonic() >= expires_at:
+        _cold_start_cache.pop(key, None)
+        return None
+    
+    recommendations = []
+    for values, score in snapshot:
+        movie = Movie(**values)
+        make_transient_to_detached(movie)
+        # load=False attaches a copy without touching the database
+        recommendations.append((db.session.merge(movie, load=False), score))
+    return recommendations
+
+def store_cold_start(key, catalog_version, recommendations):
+    """Snapshot cold-start recommendations as plain column values so any session can reuse them"""
+    columns = [c.key for c in Movie.__table__.columns]
+    snapshot = [({c: getattr(movie, c) for c in columns}, score) for movie, score in recommendations]
+    _cold_start_cache[key] = (catalog_version, time.monotonic() + COLD_START_TTL_SECONDS, snapshot)
+
 def is_age_appropriate(movie, age):
     """Check if a movie is appropriate for the given age"""
     if not age:
@@ -388,8 +757,8 @@ def is_age_appropriate(movie, age):
         # Adults: All ratings
         return True
 
-def get_age_based_recommendations(age, exclude_movie_ids, num_recommendations=10):
-    """Get age-appropriate movie recommendations with age-specific genre preferences"""
+def get_age_based_recommendations(age, exclude_movie_ids, num_recommendations=10, rated_by=None):
+    """Get age-appropriate movie recommendations with age-specific genre preferences (skipping movies `rated_by` rated)"""
     exclude_list = exclude_movie_ids if exclude_movie_ids else []
     movies = []
     
@@ -397,7 +766,7 @@ def get_age_based_recommendations(age, exclude_movie_ids, num_recommendations=10
     if age <= 12:
         # Priority 1: Animation and Family movies (most popular with kids)
         priority_movies = Movie.query.filter(
-            ~Movie.id.in_(exclude_list)
+            exclude_movies(rated_by, exclude_list)
         ).filter(
             (Movie.age_rating.in_(['G', 'PG'])) | (Movie.age_rating == None)
         ).filter(
@@ -409,7 +778,7 @@ def get_age_based_recommendations(age, exclude_movie_ids, num_recommendations=10
         # Priority 2: Adventure and Comedy (also popular with kids)
         if len(movies) < num_recommendations:
             additional = Movie.query.filter(
-                ~Movie.id.in_(exclude_list + [m.id for m in movies])
+                exclude_movies(rated_by, exclude_list + [m.id for m in movies])
             ).filter(
                 (Movie.age_rating.in_(['G', 'PG'])) | (Movie.age_rating == None)
             ).filter(
@@ -418,10 +787,14 @@ def get_age_based_recommendations(age, exclude_movie_ids, num_recommendations=10
             ).order_by(Movie.year.desc()).limit(num_recommendations * 2).all()
             movies.extend(additional)
         
-        # Priority 3: Any other G/PG rated movies
+        # Priority 3: Trending with kids
+        if len(movies) < num_recommendations:
+            movies.extend(get_trending_movies(age, exclude_list + [m.id for m in movies], num_recommendations - len(movies), rated_by=rated_by))
+        
+        # Priority 4: Any other G/PG rated movies
         if len(movies) < num_recommendations:
             fallback = Movie.query.filter(
-                ~Movie.id.in_(exclude_list + [m.id for m in movies])
+                exclude_movies(rated_by, exclude_list + [m.id for m in movies])
             ).filter(
                 (Movie.age_rating.in_(['G', 'PG'])) | (Movie.age_rating == None)
             ).order_by(Movie.year.desc()).limit(num_recommendations - len(movies)).all()
@@ -431,7 +804,7 @@ def get_age_based_recommendations(age, exclude_movie_ids, num_recommendations=10
     elif age < 18:
         # Priority 1: Action, Sci-Fi, Adventure (most popular with youth)
         priority_movies = Movie.query.filter(
-            ~Movie.id.in_(exclude_list)
+            exclude_movies(rated_by, exclude_list)
         ).filter(
             (Movie.age_rating.in_(['PG-13', 'PG'])) | (Movie.age_rating == None)
         ).filter(
@@ -444,7 +817,7 @@ def get_age_based_recommendations(age, exclude_movie_ids, num_recommendations=10
         # Priority 2: Comedy, Thriller, Drama (also popular with youth)
         if len(movies) < num_recommendations:
             additional = Movie.query.filter(
-                ~Movie.id.in_(exclude_list + [m.id for m in movies])
+                exclude_movies(rated_by, exclude_list + [m.id for m in movies])
             ).filter(
                 (Movie.age_rating.in_(['PG-13', 'PG', 'G'])) | (Movie.age_rating == None)
             ).filter(
@@ -454,10 +827,14 @@ def get_age_based_recommendations(age, exclude_movie_ids, num_recommendations=10
             ).order_by(Movie.year.desc()).limit(num_recommendations * 2).all()
             movies.extend(additional)
         
-        # Priority 3: Any other PG-13/PG/G rated movies (NO R rated)
+        # Priority 3: Trending with youth
+        if len(movies) < num_recommendations:
+            movies.extend(get_trending_movies(age, exclude_list + [m.id for m in movies], num_recommendations - len(movies), rated_by=rated_by))
+        
+        # Priority 4: Any other PG-13/PG/G rated movies (NO R rated)
         if len(movies) < num_recommendations:
             fallback = Movie.query.filter(
-                ~Movie.id.in_(exclude_list + [m.id for m in movies])
+                exclude_movies(rated_by, exclude_list + [m.id for m in movies])
             ).filter(
                 (Movie.age_rating.in_(['PG-13', 'PG', 'G'])) | (Movie.age_rating == None)
             ).order_by(Movie.year.desc()).limit(num_recommendations - len(movies)).all()
@@ -467,7 +844,7 @@ def get_age_based_recommendations(age, exclude_movie_ids, num_recommendations=10
     else:
         # Priority 1: Action, Drama, Thriller, Crime (popular with adults)
         priority_movies = Movie.query.filter(
-            ~Movie.id.in_(exclude_list)
+            exclude_movies(rated_by, exclude_list)
         ).filter(
             (Movie.genre.contains('Action') | 
              Movie.genre.contains('Drama') | 
@@ -476,10 +853,14 @@ def get_age_based_recommendations(age, exclude_movie_ids, num_recommendations=10
         ).order_by(Movie.year.desc()).limit(num_recommendations * 2).all()
         movies.extend(priority_movies)
         
-        # Priority 2: All other movies
+        # Priority 2: Trending with adults
+        if len(movies) < num_recommendations:
+            movies.extend(get_trending_movies(age, exclude_list + [m.id for m in movies], num_recommendations - len(movies), rated_by=rated_by))
+        
+        # Priority 3: All other movies
         if len(movies) < num_recommendations:
             fallback = Movie.query.filter(
-                ~Movie.id.in_(exclude_list + [m.id for m in movies])
+                exclude_movies(rated_by, exclude_list + [m.id for m in movies])
             ).order_by(Movie.year.desc()).limit(num_recommendations - len(movies)).all()
             movies.extend(fallback)
     
@@ -505,70 +886,83 @@ def get_age_group(age):
         return "youth"
     return "adult"
 
-def get_similarity_based_recommendations(user_id, exclude_movie_ids, num_recommendations=10, user_age=None):
+def get_seed_movie_ids(context):
+    """The user's SIMILARITY_SEED_LIMIT most recently rated movies, oldest first (seeds of the similarity and description stages)"""
+    return context.rated_movie_ids[-SIMILARITY_SEED_LIMIT:]
+
+def _similarity_features(movie):
+    """(genre set, lowercased director, lowercased cast set, year) of a movie; None where missing"""
+    genres = set([g.strip() for g in movie.genre.split(',')]) if movie.genre else None
+    director = movie.director.lower() if movie.director else None
+    cast = set([c.strip().lower() for c in movie.cast.split(',')]) if movie.cast else None
+    return genres, director, cast, movie.year
+
+def get_similarity_based_recommendations(context, num_recommendations=10):
     """Recommend movies similar to ones the user has watched (based on genre, cast, director, year)"""
-    user_ratings = Rating.query.filter_by(user_id=user_id).all()
-    if not user_ratings:
+    if not context.has_ratings:
         return []
+    user_age = context.age
+    
+    # Get the most recently watched movies (one query, kept in rating order)
+    seed_movie_ids = get_seed_movie_ids(context)
+    watched_by_id = {m.id: m for m in Movie.query.filter(Movie.id.in_(seed_movie_ids)).all()}
+    watched_movies = [watched_by_id[movie_id] for movie_id in seed_movie_ids if movie_id in watched_by_id]
     
-    # Get all watched movies
-    watched_movies = [Movie.query.get(r.movie_id) for r in user_ratings if Movie.query.get(r.movie_id)]
+    # Candidates: every unwatched movie, fetched once as plain columns (rated movies dropped by an indexed anti-join)
+    # Apply age filtering at query level for better performance
+    query = db.session.query(
+        Movie.id, Movie.genre, Movie.director, Movie.cast, Movie.year, Movie.age_rating
+    ).filter(exclude_movies(rated_by=context.user_id))
+    
+    # Add age rating filter if age is provided
+    if user_age:
+        if user_age <= 7:
+            query = query.filter((Movie.age_rating == 'G') | (Movie.age_rating == None))
+        elif user_age <= 12:
+            query = query.filter((Movie.age_rating.in_(['G', 'PG'])) | (Movie.age_rating == None))
+        elif user_age < 18:
+            query = query.filter((Movie.age_rating.in_(['G', 'PG', 'PG-13'])) | (Movie.age_rating == None))
+        # For adults (18+), no filter needed
+    
+    # Parse each candidate's genres/director/cast once instead of once per watched movie
+    similar_movies = []
+    for movie in query:
+        # Double-check age appropriateness (safety check)
+        if user_age and not is_age_appropriate(movie, user_age):
+            continue  # Skip age-inappropriate movies
+        similar_movies.append((movie.id, _similarity_features(movie)))
     
     movie_scores = {}
     
     for watched_movie in watched_movies:
         if not watched_movie:
             continue
+        watched_genres, watched_director, watched_cast, watched_year = _similarity_features(watched_movie)
             
         # Find similar movies based on multiple factors
-        # Apply age filtering at query level for better performance
-        query = Movie.query.filter(
-            ~Movie.id.in_(exclude_movie_ids + [watched_movie.id])
-        )
-        
-        # Add age rating filter if age is provided
-        if user_age:
-            if user_age <= 7:
-                query = query.filter((Movie.age_rating == 'G') | (Movie.age_rating == None))
-            elif user_age <= 12:
-                query = query.filter((Movie.age_rating.in_(['G', 'PG'])) | (Movie.age_rating == None))
-            elif user_age < 18:
-                query = query.filter((Movie.age_rating.in_(['G', 'PG', 'PG-13'])) | (Movie.age_rating == None))
-            # For adults (18+), no filter needed
-        
-        similar_movies = query.all()
-        
-        for movie in similar_movies:
-            # Double-check age appropriateness (safety check)
-            if user_age and not is_age_appropriate(movie, user_age):
-                continue  # Skip age-inappropriate movies
-            
+        for movie_id, (movie_genres, movie_director, movie_cast, movie_year) in similar_movies:
             similarity_score = 0.0
             
             # Genre similarity (40% weight)
-            if watched_movie.genre and movie.genre:
-                watched_genres = set([g.strip() for g in watched_movie.genre.split(',')])
-                movie_genres = set([g.strip() for g in movie.genre.split(',')])
+            if watched_genres and movie_genres:
                 common_genres = watched_genres.intersection(movie_genres)
                 if common_genres:
                     similarity_score += 0.4 * (len(common_genres) / max(len(watched_genres), len(movie_genres)))
             
             # Director similarity (20% weight)
-            if watched_movie.director and movie.director:
-                if watched_movie.director.lower() == movie.director.lower():
+            if watched_director and movie_director:
+                if watched_director == movie_director:
                     similarity_score += 0.2
             
             # Cast similarity (20% weight)
-            if watched_movie.cast and movie.cast:
-                watched_cast = set([c.strip().lower() for c in watched_movie.cast.split(',')])
-                movie_cast = set([c.strip().lower() for c in movie.cast.split(',')])
+            if watched_cast and movie_cast:
                 common_cast = watched_cast.intersection(movie_cast)
                 if common_cast:
                     similarity_score += 0.2 * (len(common_cast) / max(len(watched_cast), len(movie_cast), 1))
             
             # Year similarity (20% weight) - prefer movies from similar era
-            if watched_movie.year and movie.year:
-                year_diff = abs(watched_movie.year - movie.year)
+            if watched_year and movie_year:
+                year_diff = abs(watched_year - movie_year)
                 if year_diff <= 5:
                     similarity_score += 0.2
                 elif year_diff <= 10:
@@ -577,10 +971,10 @@ def get_similarity_based_recommendations(user_id, exclude_movie_ids, num_recomme
                     similarity_score += 0.05
             
             if similarity_score > 0:
-                if movie.id not in movie_scores:
-                    movie_scores[movie.id] = similarity_score
+                if movie_id not in movie_scores:
+                    movie_scores[movie_id] = similarity_score
                 else:
-                    movie_scores[movie.id] = max(movie_scores[movie.id], similarity_score)
+                    movie_scores[movie_id] = max(movie_scores[movie_id], similarity_score)
     
     # Sort and return top recommendations
     sorted_movies = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)
@@ -592,58 +986,47 @@ def get_similarity_based_recommendations(user_id, exclude_movie_ids, num_recomme
     
     return recommendations
 
-def get_collaborative_recommendations(user_id, exclude_movie_ids, num_recommendations=10, user_age=None):
+def get_collaborative_recommendations(context, num_recommendations=10):
     """Collaborative filtering: find similar users and recommend their liked movies"""
-    all_ratings = Rating.query.all()
-    if not all_ratings:
-        return []
+    user_id = context.user_id
+    exclude_movie_ids = context.ratings
+    user_age = context.age
     
-    # Build user-item matrix
-    ratings_data = []
-    for rating in all_ratings:
-        ratings_data.append({
-            'user_id': rating.user_id,
-            'movie_id': rating.movie_id,
-            'rating': rating.rating
-        })
-    
-    df_ratings = pd.DataFrame(ratings_data)
+    # Similarities straight from the shared, memory-mapped rating store (no ORM objects)
+    store = get_rating_store()
+    if not len(store):
+        return []
     
     try:
-        user_movie_matrix = df_ratings.pivot_table(index='user_id', columns='movie_id', values='rating')
-        user_movie_matrix = user_movie_matrix.fillna(0)
-        
-        # Calculate cosine similarity between users
-        user_similarities = cosine_similarity(user_movie_matrix)
+        # Cosine similarity of this user against every user (one sparse product, not all pairs)
+        user_ids, user_similarities = store.user_similarities(user_id)
         
         # Get current user's index
-        user_ids = user_movie_matrix.index.tolist()
-        if user_id not in user_ids:
+        own = np.flatnonzero(user_ids == user_id)
+        if not len(own):
             return []
-        
-        user_idx = user_ids.index(user_id)
+        user_similarities[own] = -np.inf
         
         # Get top similar users
-        similar_users = np.argsort(user_similarities[user_idx])[::-1][1:6]  # Top 5 similar users
+        similar_users = np.argsort(-user_similarities, kind='stable')[:5]  # Top 5 similar users
         
         # Get movies rated by similar users
         recommended_movies = {}
         for similar_user_idx in similar_users:
-            similar_user_id = user_ids[similar_user_idx]
-            similarity_score = user_similarities[user_idx][similar_user_idx]
+            similar_user_id = int(user_ids[similar_user_idx])
+            similarity_score = user_similarities[similar_user_idx]
             
             if similarity_score > 0:
-                similar_user_ratings = Rating.query.filter_by(user_id=similar_user_id).all()
-                for rating in similar_user_ratings:
-                    if rating.movie_id not in exclude_movie_ids:
+                for movie_id, rating in sorted(store.user_ratings(similar_user_id).items()):
+                    if movie_id not in exclude_movie_ids:
                         # Check age appropriateness before adding
-                        movie = Movie.query.get(rating.movie_id)
+                        movie = Movie.query.get(movie_id)
                         if movie and user_age:
                             if not is_age_appropriate(movie, user_age):
                                 continue  # Skip age-inappropriate movies
-                        if rating.movie_id not in recommended_movies:
-                            recommended_movies[rating.movie_id] = []
-                        recommended_movies[rating.movie_id].append(rating.rating * similarity_score)
+                        if movie_id not in recommended_movies:
+                            recommended_movies[movie_id] = []
+                        recommended_movies[movie_id].append(rating * similarity_score)
         
         # Calculate weighted scores
         movie_scores = {}
@@ -666,10 +1049,11 @@ def get_collaborative_recommendations(user_id, exclude_movie_ids, num_recommenda
         # If collaborative filtering fails, return empty
         return []
 
-def get_content_based_recommendations(user_id, num_recommendations=10, user_age=None, exclude_movie_ids=None):
+def get_content_based_recommendations(context, num_recommendations=10):
     """Content-based filtering using genre preferences (with age-aware fallback)."""
-    user_preferences = Preference.query.filter_by(user_id=user_id).all()
-    preferred_genres = [p.genre for p in user_preferences]
+    preferred_genres = context.preferred_genres
+    user_age = context.age
+    rated_by = context.user_id if context.has_ratings else None
     
     # Base query
     base_query = Movie.query
@@ -688,8 +1072,11 @@ def get_content_based_recommendations(user_id, num_recommendations=10, user_age=
         # If no preferences, DON'T return "first N" (it often looks identical across ages).
         # Instead, use explicit age-group recommendations.
         if user_age:
-            return get_age_based_recommendations(user_age, exclude_movie_ids or [], num_recommendations)
-        return base_query.order_by(Movie.year.desc()).limit(num_recommendations).all()
+            return get_age_based_recommendations(user_age, [], num_recommendations, rated_by=rated_by)
+        movies = get_trending_movies(None, [], num_recommendations, rated_by=rated_by)
+        if len(movies) < num_recommendations:
+            movies.extend(base_query.filter(~Movie.id.in_([m.id for m in movies])).order_by(Movie.year.desc()).limit(num_recommendations - len(movies)).all())
+        return movies
     
     # Get movies matching preferred genres
     recommended_movies = []
@@ -707,6 +1094,322 @@ def get_content_based_recommendations(user_id, num_recommendations=10, user_age=
     
     return unique_movies[:num_recommendations]
 
+def get_rating_store():
+    """Return this worker's rating store, up to date with every write logged so far"""
+    global _rating_store
+    if _rating_store is None:
+        store = RatingStore(RATING_STORE_DIR)
+        try:
+            store.refresh()
+        except ValueError as e:
+            print(f"Rating snapshot could not be loaded, rebuilding it: {e}")
+        if not store.has_snapshot or not rating_store_matches_db(store):
+            rebuild_rating_store(store)
+        _rating_store = store
+    else:
+        _rating_store.refresh()
+    return _rating_store
+
+def rating_store_matches_db(store):
+    """
+    Cheap startup check that the snapshot plus log still describe the Rating table: same database,
+    same number of ratings, and no rating ids beyond what it has seen. Catches a reset or replaced
+    database, ratings written outside /rate_movie, and writes lost between commit and record_rating.
+    Rating ids are only known for snapshots rebuilt from the database, so once records were
+    logged or compacted the newest id may legitimately be higher than the recorded one. Edits of
+    existing ratings, and replacing the newest row (SQLite reuses its id), are not detected.
+    """
+    meta = store.meta
+    if meta.get('source') != app.config['SQLALCHEMY_DATABASE_URI'] or meta.get('max_rating_id') is None:
+        return False
+    count, max_id = db.session.query(db.func.count(Rating.id), db.func.coalesce(db.func.max(Rating.id), 0)).one()
+    if len(store) != count:
+        return False
+    if store.pending or meta.get('compacted'):
+        return max_id >= meta['max_rating_id']
+    return max_id == meta['max_rating_id']
+
+def rebuild_rating_store(store=None):
+    """
+    Write a fresh rating snapshot from the Rating table in one streaming pass. Appends wait while
+    the table is read, so ratings committed meanwhile land in the new log instead of being dropped.
+    """
+    if store is None:
+        store = _rating_store or RatingStore(RATING_STORE_DIR)
+    
+    def load():
+        users, movies, values, timestamps = array('i'), array('i'), array('f'), array('I')
+        max_rating_id = 0
+        rows = db.session.query(Rating.id, Rating.user_id, Rating.movie_id, Rating.rating, Rating.created_at).order_by(Rating.id)
+        for rating_id, user_id, movie_id, rating, created_at in rows.yield_per(10000):
+            max_rating_id = rating_id
+            users.append(user_id)
+            movies.append(movie_id)
+            values.append(rating)
+            timestamps.append(_unix_time(created_at))
+        return RatingArrays.from_records(
+            np.frombuffer(users, dtype=np.int32), np.frombuffer(movies, dtype=np.int32),
+            np.frombuffer(values, dtype=np.float32), np.frombuffer(timestamps, dtype=np.uint32),
+            meta={'source': app.config['SQLALCHEMY_DATABASE_URI'], 'rating_count': len(users), 'max_rating_id': max_rating_id}
+        )
+    
+    store.rebuild(load)
+    return store
+
+def record_rating(user_id, movie_id, rating):
+    """Append a committed rating to the store's log, compacting it once it grows large"""
+    store = get_rating_store()
+    store.append(user_id, movie_id, rating, _unix_time(datetime.utcnow()))
+    store.refresh()
+    store.compact_if_needed(RATING_LOG_COMPACT_PAIRS)
+
+def _unix_time(value):
+    return int(value.replace(tzinfo=timezone.utc).timestamp()) if value else 0
+
+def exclude_movies(rated_by=None, movie_ids=()):
+    """
+    SQL condition dropping the movies user `rated_by` has rated plus the given movie ids.
+    
+    Rated movies are excluded with a correlated NOT EXISTS answered from the unique
+    (user_id, movie_id) index, so the statement is the same size however many movies the
+    user rated; `movie_ids` is only for the handful of movies already picked in a request.
+    """
+    conditions = []
+    if rated_by is not None:
+        rated = db.session.query(Rating.id).filter(Rating.user_id == rated_by, Rating.movie_id == Movie.id)
+        conditions.append(~rated.exists())
+    if movie_ids:
+        conditions.append(~Movie.id.in_(list(movie_ids)))
+    return db.and_(db.true(), *conditions)
+
+def age_rating_filter(age):
+    """SQL condition equivalent to is_age_appropriate for the given age (None when unrestricted)"""
+    if not age or age >= 18:
+        return None
+    if age <= 7:
+        return Movie.age_rating == 'G'
+    if age <= 12:
+        return Movie.age_rating.in_(['G', 'PG'])
+    return (Movie.age_rating.in_(['G', 'PG', 'PG-13'])) | (Movie.age_rating == None)
+
+def refresh_trending(now=None):
+    """
+    Incrementally refresh the trending table.
+    
+    Only ratings newer than the last processed rating id are aggregated (one read-only pass),
+    then a short write transaction claims that range, decays the stored scores to `now` with a
+    single UPDATE and adds the new ones, so rating writes are only blocked for the upsert.
+    The claim is a compare-and-swap on (last_rating_id, refreshed_at): a refresh another worker
+    committed meanwhile, including one that found no new ratings but still applied decay, makes
+    this one skip instead of decaying the scores twice.
+    Runs in its own session, so it never commits, rolls back or expires a caller's objects.
+    Returns the number of (age group, movie) scores that received new ratings.
+    """
+    now = now or datetime.utcnow()
+    with Session(db.engine) as session:
+        state = session.get(TrendingState, 1)
+        if state is None:
+            table = TrendingState.__table__
+            session.execute(sqlite_insert(table).values(id=1, last_rating_id=0, refreshed_at=now).on_conflict_do_nothing())
+            session.commit()
+            state = session.get(TrendingState, 1)
+        last_rating_id = state.last_rating_id
+        refreshed_at = state.refreshed_at
+        max_rating_id = session.query(db.func.max(Rating.id)).scalar() or 0
+        
+        new_ratings = session.query(Rating.movie_id, Rating.rating, Rating.created_at, User.age).join(
+            User, User.id == Rating.user_id
+        ).filter(Rating.id > last_rating_id, Rating.id <= max_rating_id).yield_per(1000)
+        increments = aggregate_ratings(new_ratings, now, get_age_group, TRENDING_HALF_LIFE_DAYS)
+        
+        # Claim the (last_rating_id, max_rating_id] range; fails if another worker refreshed since we read the state
+        claimed = session.query(TrendingState).filter_by(
+            id=1, last_rating_id=last_rating_id, refreshed_at=refreshed_at
+        ).update(
+            {'last_rating_id': max(max_rating_id, last_rating_id), 'refreshed_at': now},
+            synchronize_session=False
+        )
+        if not claimed:
+            session.rollback()
+            return 0
+        
+        factor = decay_factor((now - refreshed_at).total_seconds(), TRENDING_HALF_LIFE_DAYS)
+        if factor < 1.0:
+            session.query(TrendingScore).update(
+                {TrendingScore.score: TrendingScore.score * factor}, synchronize_session=False
+            )
+        
+        if increments:
+            table = TrendingScore.__table__
+            stmt = sqlite_insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.age_group, table.c.movie_id],
+                set_={'score': table.c.score + stmt.excluded.score}
+            )
+            session.execute(stmt, [
+                {'age_group': group, 'movie_id': movie_id, 'score': score}
+                for (group, movie_id), score in increments.items()
+            ])
+        session.query(TrendingScore).filter(TrendingScore.score < MIN_SCORE).delete(synchronize_session=False)
+        
+        session.commit()
+    return len(increments)
+
+def refresh_trending_if_stale():
+    """
+    Start a background refresh when trending is older than TRENDING_REFRESH_SECONDS (checked at
+    most once per interval per worker). The caller carries on with the current scores.
+    """
+    global _trending_checked_at
+    if not TRENDING_REFRESH_IN_BACKGROUND:
+        return
+    now = time.monotonic()
+    if _trending_checked_at is not None and now - _trending_checked_at < TRENDING_REFRESH_SECONDS:
+        return
+    _trending_checked_at = now
+    
+    state = TrendingState.query.get(1)
+    if state and (datetime.utcnow() - state.refreshed_at).total_seconds() < TRENDING_REFRESH_SECONDS:
+        return
+    if not _trending_refresh_running.acquire(blocking=False):
+        return  # This worker is already refreshing
+    threading.Thread(target=_refresh_trending_in_background, name='trending-refresh', daemon=True).start()
+
+def _refresh_trending_in_background():
+    try:
+        with app.app_context():
+            refresh_trending()
+    except SQLAlchemyError as e:
+        # Another worker holds the write lock
+        print(f"Trending refresh skipped: {e}")
+    finally:
+        _trending_refresh_running.release()
+
+def get_trending_movies(age, exclude_movie_ids, num_recommendations=10, rated_by=None):
+    """Trending movies for the viewer's age group (all raters when unknown), age-appropriate, most popular first"""
+    refresh_trending_if_stale()
+    
+    groups = [get_age_group(age) or ALL_GROUP]
+    if groups[0] != ALL_GROUP:
+        groups.append(ALL_GROUP)  # Small groups are topped up from overall popularity
+    
+    age_filter = age_rating_filter(age)
+    movies = []
+    for group in groups:
+        query = Movie.query.join(TrendingScore, TrendingScore.movie_id == Movie.id).filter(
+            TrendingScore.age_group == group
+        ).filter(
+            exclude_movies(rated_by, list(exclude_movie_ids or []) + [m.id for m in movies])
+        )
+        if age_filter is not None:
+            query = query.filter(age_filter)
+        movies.extend(query.order_by(TrendingScore.score.desc()).limit(num_recommendations - len(movies)).all())
+        if len(movies) >= num_recommendations:
+            break
+    
+    return movies
+
+def get_text_index():
+    """
+    Return the current generation of the TF-IDF neighbor index, or None if none was published.
+    When it was built for another catalog version a background rebuild is started; the stale
+    index is served until the new generation is published.
+    """
+    index = _load_text_index()
+    if TEXT_INDEX_REBUILD_IN_BACKGROUND and (index is None or index.fingerprint != get_catalog_fingerprint()):
+        if _text_index_rebuilding.acquire(blocking=False):
+            threading.Thread(target=_rebuild_text_index_in_background, name='text-index-rebuild', daemon=True).start()
+    return index
+
+def _rebuild_text_index_in_background():
+    try:
+        with app.app_context():
+            ensure_text_index()  # Another worker may have published it meanwhile
+    except (SQLAlchemyError, OSError, ValueError) as e:
+        print(f"Text similarity index rebuild failed: {e}")
+    finally:
+        _text_index_rebuilding.release()
+
+def ensure_text_index():
+    """Rebuild the index now unless the published generation matches the catalog version"""
+    index = _load_text_index()
+    if index is None or index.fingerprint != get_catalog_fingerprint():
+        index = rebuild_text_index()
+    return index
+
+def _load_text_index():
+    """The current published generation, mapped once per generation number"""
+    global _text_index
+    try:
+        generation = _text_index_artifact.current()
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Text similarity index could not be loaded: {e}")
+        return _text_index[1] if _text_index else None
+    if generation is None:
+        return None
+    if _text_index is None or _text_index[0] != generation.number:
+        _text_index = (generation.number, TextNeighborIndex.from_generation(generation))
+    return _text_index[1]
+
+def get_catalog_fingerprint():
+    """Catalog identity stamped on the text index: the shared catalog version, which every movie insert, edit or delete moves."""
+    return str(get_catalog_token())
+
+def rebuild_text_index(top_n=TEXT_INDEX_TOP_N):
+    """Build the description TF-IDF neighbor index and publish it as a new shared generation."""
+    rows = db.session.query(Movie.id, Movie.title, Movie.description).order_by(Movie.id).all()
+    index = build_text_index(rows, top_n=top_n, fingerprint=get_catalog_fingerprint())
+    index.publish(_text_index_artifact)
+    return index
+
+def _load_movies_in_order(scored_ids):
+    """Fetch Movie rows for [(movie_id, score), ...] in one query, keeping the given order."""
+    if not scored_ids:
+        return []
+    movies = Movie.query.filter(Movie.id.in_([movie_id for movie_id, _ in scored_ids])).all()
+    movies_by_id = {m.id: m for m in movies}
+    return [(movies_by_id[movie_id], score) for movie_id, score in scored_ids if movie_id in movies_by_id]
+
+def get_similar_movies(movie_id, num_movies=10, user_age=None):
+    """Movies whose descriptions are most similar to the given movie ("more like this")."""
+    index = get_text_index()
+    if index is None:
+        return []
+    similar = _load_movies_in_order(index.neighbors(movie_id))
+    if user_age:
+        similar = [(m, score) for m, score in similar if is_age_appropriate(m, user_age)]
+    return similar[:num_movies]
+
+def get_text_similarity_recommendations(context, num_recommendations=10):
+    """Recommend description neighbors of movies the user rated well (3+ stars)"""
+    index = get_text_index()
+    if index is None:
+        return []
+    
+    user_age = context.age
+    movie_scores = {}
+    for rated_movie_id in get_seed_movie_ids(context):
+        rating = context.ratings[rated_movie_id]
+        if rating < 3:
+            continue
+        for movie_id, similarity in index.neighbors(rated_movie_id):
+            if movie_id in context.ratings:
+                continue
+            score = similarity * (rating / 5.0)
+            if score > movie_scores.get(movie_id, 0.0):
+                movie_scores[movie_id] = score
+    
+    sorted_movies = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)
+    recommendations = []
+    for movie, score in _load_movies_in_order(sorted_movies[:num_recommendations * 2]):
+        if user_age and not is_age_appropriate(movie, user_age):
+            continue
+        recommendations.append((movie, score))
+        if len(recommendations) >= num_recommendations:
+            break
+    
+    return recommendations
+
 # Initialize database and seed data
 def init_db():
     with app.app_context():
@@ -723,8 +1426,59 @@ def init_db():
                 print("Updating existing movies with cast and age rating information...")
                 # Re-seed to update movies
                 Movie.query.delete()
+                bump_catalog_version()  # Bulk deletes bypass the Movie mapper events
                 db.session.commit()
                 seed_movies()
+        
+        # (Re)build the description similarity index when the catalog changed
+        ensure_text_index()
+
+@app.cli.command('export')
+@click.argument('table', type=click.Choice(['movies', 'ratings']))
+@click.option('--since-id', default=0, show_default=True, help='Only export rows with a larger id.')
+@click.option('--since', type=click.DateTime(), default=None, help='Only export ratings created after this time.')
+@click.option('--gzip', 'use_gzip', is_flag=True, help='Gzip-compress the output.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True), default='-', help='Output file (default: stdout).')
+def export_command(table, since_id, since, use_gzip, output):
+    """Stream the movies or ratings table as NDJSON."""
+    rows = export_movie_rows(since_id) if table == 'movies' else export_rating_rows(since_id, since)
+    meter = ThroughputMeter()
+    chunks = ndjson_chunks(rows, meter)
+    if use_gzip:
+        chunks = gzip_chunks(chunks)
+    
+    out = sys.stdout.buffer if output == '-' else open(output, 'wb')
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    click.echo(meter.summary(table), err=True)
+
+@app.cli.command('rebuild-rating-store')
+def rebuild_rating_store_command():
+    """Rebuild the compact rating snapshot from the database."""
+    store = rebuild_rating_store()
+    print(f"Wrote {len(store)} ratings to {store.snapshot_path}")
+
+@app.cli.command('compact-ratings')
+def compact_ratings_command():
+    """Fold the rating append log into a new snapshot."""
+    store = get_rating_store()
+    print(f"Folded {store.compact()} ratings into {store.snapshot_path}")
+
+@app.cli.command('refresh-trending')
+def refresh_trending_command():
+    """Fold ratings created since the last run into the trending table."""
+    updated = refresh_trending()
+    print(f"Refreshed trending scores ({updated} age-group/movie scores updated)")
+
+@app.cli.command('build-text-index')
+def build_text_index_command():
+    """Rebuild the TF-IDF description neighbor index; running workers switch to it on their next lookup."""
+    index = rebuild_text_index()
+    print(f"Indexed {len(index)} movies ({index.top_n} neighbors each) into {_text_index_artifact.pointer_path}")
 
 def seed_movies():
     """Seed database with sample movies"""
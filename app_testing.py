@@ -0,0 +1,39 @@
+"""
+Shared setup for the tests that exercise the Flask app.
+
+Points the app at an in-memory SQLite database and throwaway artifact directories before
+`app` is first imported, so whichever test module loads first, none of them touches the
+instance database. Test modules import the app module as `m` from here.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+_TMP = tempfile.mkdtemp(prefix="movie-app-tests-")
+atexit.register(shutil.rmtree, _TMP, ignore_errors=True)
+os.environ["MOVIE_DB_URL"] = "sqlite://"
+os.environ["RATING_STORE_DIR"] = os.path.join(_TMP, "rating_store")
+os.environ["SHARED_STATE_DIR"] = os.path.join(_TMP, "shared")
+# The in-memory database is one connection: no background thread may use it behind a test's back
+os.environ["TRENDING_REFRESH_IN_BACKGROUND"] = "0"
+os.environ["TEXT_INDEX_REBUILD_IN_BACKGROUND"] = "0"
+
+import app as m  # noqa: E402
+
+
+def make_user(username, age=None, **fields):
+    """Insert and commit a user (call inside an app context)."""
+    user = m.User(username=username, email=f"{username}@example.com", password_hash="x", age=age, **fields)
+    m.db.session.add(user)
+    m.db.session.commit()
+    return user
+
+
+def client_for(user_id):
+    """Test client whose session is logged in as `user_id`."""
+    client = m.app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+        session["_fresh"] = True
+    return client
@@ -0,0 +1,153 @@
+"""
+Per-worker memory of model artifacts: private copies vs shared memory-mapped generations.
+
+Forks N workers the way gunicorn does and has each one load the rating matrix and the
+text neighbor index, either as private in-memory copies (what every worker did when it
+built its own arrays) or by attaching to the shared snapshot / published generation.
+Reports RSS, anonymous RSS and PSS per worker before and after loading, and checks that a
+generation published mid-run is picked up without torn reads.
+
+    python bench_shared_state.py --workers 4 --users 50000 --movies 20000 --ratings 3000000
+"""
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from rating_store import RatingArrays, RatingStore
+from shared_state import SharedArtifact, memory_usage
+from text_similarity import TextNeighborIndex
+
+
+def build_artifacts(directory, users, movies, ratings, top_n, seed=0):
+    rng = np.random.default_rng(seed)
+    arrays = RatingArrays.from_records(
+        rng.integers(1, users + 1, ratings),
+        rng.integers(1, movies + 1, ratings),
+        rng.integers(1, 11, ratings) / 2.0,
+        np.full(ratings, int(time.time())),
+        meta={"source": "benchmark"},
+    )
+    store = RatingStore(os.path.join(directory, "rating_store"))
+    store.write_snapshot(arrays)
+    publish_text_index(SharedArtifact(directory, "text_neighbors"), movies, top_n, rng)
+    return len(arrays)
+
+
+def publish_text_index(artifact, movies, top_n, rng):
+    neighbor_ids = rng.integers(1, movies + 1, (movies, top_n))
+    scores = np.sort(rng.random((movies, top_n), dtype=np.float32), axis=1)[:, ::-1]
+    # The checksum lets readers detect a torn (mixed-generation) read
+    index = TextNeighborIndex(np.arange(1, movies + 1), neighbor_ids, scores, fingerprint=str(int(neighbor_ids.sum())))
+    return index.publish(artifact)
+
+
+def load_models(directory, mode):
+    store = RatingStore(os.path.join(directory, "rating_store"))
+    store.refresh()
+    generation = SharedArtifact(directory, "text_neighbors").current()
+    ratings = store.snapshot
+    index = TextNeighborIndex.from_generation(generation)
+    if mode == "private":
+        ratings = RatingArrays({name: np.array(getattr(ratings, name)) for name in (
+            "users", "movies", "ratings", "timestamps", "user_ids", "user_offsets",
+            "movie_perm", "movie_ids", "movie_offsets", "columns", "user_norms",
+        )}, ratings.meta)
+        index = TextNeighborIndex(np.array(index.movie_ids), np.array(index.neighbor_ids),
+                                  np.array(index.neighbor_scores), index.fingerprint)
+    return ratings, index
+
+
+def run_queries(ratings, index, queries, rng):
+    matrix, user_ids, movie_ids = ratings.to_csr()
+    # Touch every page, as a long-running worker eventually does
+    for array in (ratings.users, ratings.movies, ratings.ratings, ratings.timestamps, ratings.movie_perm,
+                  ratings.columns, index.neighbor_ids, index.neighbor_scores):
+        array.sum()
+    for user_id in rng.choice(user_ids, min(queries, len(user_ids)), replace=False):
+        movies, values = ratings.user_ratings(int(user_id))
+        vector = np.zeros(len(movie_ids), dtype=np.float32)
+        vector[np.searchsorted(movie_ids, movies)] = values
+        matrix @ vector
+        for movie_id in movies[:5]:
+            index.neighbors(int(movie_id))
+
+
+def worker(directory, mode, queries, loaded, swapped, results):
+    before = memory_usage()
+    ratings, index = load_models(directory, mode)
+    run_queries(ratings, index, queries, np.random.default_rng(os.getpid()))
+    loaded.wait()  # Every worker holds its models while memory is measured
+    after = memory_usage()
+
+    swapped.wait()  # The parent published a new text index generation
+    generation = SharedArtifact(directory, "text_neighbors").current()
+    consistent = str(int(generation["neighbor_ids"].sum())) == generation.meta["fingerprint"]
+    results.put((os.getpid(), before, after, generation.number, consistent))
+    loaded.wait()
+
+
+def bench(directory, mode, workers, queries, movies, top_n):
+    ctx = mp.get_context("fork")
+    loaded, swapped = ctx.Barrier(workers + 1), ctx.Barrier(workers + 1)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(directory, mode, queries, loaded, swapped, results))
+             for _ in range(workers)]
+    for proc in procs:
+        proc.start()
+    loaded.wait()
+    generation = publish_text_index(SharedArtifact(directory, "text_neighbors"), movies, top_n,
+                                    np.random.default_rng(len(mode)))
+    swapped.wait()
+    rows = [results.get() for _ in procs]
+    loaded.wait()
+    for proc in procs:
+        proc.join()
+    return rows, generation
+
+
+def report(mode, rows, generation):
+    print(f"\n{mode} (MiB; RSS counts shared file pages in every worker, PSS splits them)")
+    print(f"{'worker':>8} {'rss before':>11} {'rss after':>10} {'anon before':>12} {'anon after':>11} "
+          f"{'pss after':>10} {'generation':>11}")
+    for pid, before, after, seen, consistent in rows:
+        print(f"{pid:>8} {before.get('rss', 0) / 1024:>11.1f} {after.get('rss', 0) / 1024:>10.1f} "
+              f"{before.get('anon', 0) / 1024:>12.1f} {after.get('anon', 0) / 1024:>11.1f} "
+              f"{after.get('pss', 0) / 1024:>10.1f} {seen:>6} {'ok' if consistent else 'torn':>4}")
+    rss_growth = np.mean([after.get("rss", 0) - before.get("rss", 0) for _pid, before, after, _g, _c in rows])
+    anon_growth = np.mean([after.get("anon", 0) - before.get("anon", 0) for _pid, before, after, _g, _c in rows])
+    total_pss = sum(after.get("pss", 0) for _pid, _before, after, _g, _c in rows)
+    swapped = all(seen == generation and consistent for _pid, _b, _a, seen, consistent in rows)
+    print(f"per worker: RSS +{rss_growth / 1024:.1f} MiB, private (anon) +{anon_growth / 1024:.1f} MiB; "
+          f"total PSS {total_pss / 1024:.1f} MiB; generation {generation} picked up by all workers: {swapped}")
+    return total_pss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--movies", type=int, default=20000)
+    parser.add_argument("--ratings", type=int, default=3000000)
+    parser.add_argument("--top-n", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        count = build_artifacts(directory, args.users, args.movies, args.ratings, args.top_n)
+        print(f"Built {count} ratings and a {args.movies}x{args.top_n} neighbor index "
+              f"in {time.perf_counter() - started:.1f}s; {args.workers} workers")
+        totals = {}
+        for mode in ("private", "shared"):
+            rows, generation = bench(directory, mode, args.workers, args.queries, args.movies, args.top_n)
+            totals[mode] = report(mode, rows, generation)
+        if totals["shared"]:
+            print(f"\nTotal PSS private/shared: {totals['private'] / totals['shared']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
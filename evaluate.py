@@ -0,0 +1,280 @@
+"""
+Offline evaluation of recommendation quality versus cost.
+
+Splits the Rating table at a point in time (the newest ratings are held out), rebuilds the
+models from the older ratings on a copy of the database, and runs get_recommendations (or a
+single stage) for every evaluation user across a process pool. Reports precision@k,
+recall@k, NDCG@k and catalog coverage next to per-user latency and throughput.
+
+    python evaluate.py --k 10 --workers 8
+    python evaluate.py --stage similarity --test-fraction 0.1 --max-users 2000 --output eval.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+STAGES = ("hybrid", "age", "similarity", "collaborative", "content", "text")
+
+# Stages never re-read trending state during a run (the split fixes "now" at the cutoff)
+_NO_REFRESH_SECONDS = str(10 ** 9)
+
+
+def precision_at_k(recommended, relevant, k):
+    if k <= 0:
+        return 0.0
+    return len(set(recommended[:k]) & relevant) / k
+
+
+def recall_at_k(recommended, relevant, k):
+    if not relevant:
+        return 0.0
+    return len(set(recommended[:k]) & relevant) / len(relevant)
+
+
+def ndcg_at_k(recommended, relevant, k):
+    """Binary-relevance NDCG: hits discounted by log2(rank + 1), normalized by the ideal ranking."""
+    dcg = sum(1.0 / math.log2(rank + 2) for rank, movie_id in enumerate(recommended[:k]) if movie_id in relevant)
+    ideal = sum(1.0 / math.log2(rank + 2) for rank in range(min(k, len(relevant))))
+    return dcg / ideal if ideal else 0.0
+
+
+def catalog_coverage(recommendation_lists, catalog_size, k):
+    """Share of the catalog that appears in at least one top-k list."""
+    if not catalog_size:
+        return 0.0
+    shown = set()
+    for recommended in recommendation_lists:
+        shown.update(recommended[:k])
+    return len(shown) / catalog_size
+
+
+def latency_summary(latencies):
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000.0
+    if not len(latencies):
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"mean_ms": float(latencies.mean()), "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+def score(results, relevant_by_user, catalog_size, k, elapsed):
+    """Aggregate per-user (user_id, recommended_ids, latency) results into the report."""
+    precisions, recalls, ndcgs, latencies = [], [], [], []
+    for user_id, recommended, latency in results:
+        relevant = relevant_by_user[user_id]
+        precisions.append(precision_at_k(recommended, relevant, k))
+        recalls.append(recall_at_k(recommended, relevant, k))
+        ndcgs.append(ndcg_at_k(recommended, relevant, k))
+        latencies.append(latency)
+    users = len(results)
+    return {
+        "users": users,
+        f"precision@{k}": float(np.mean(precisions)) if users else 0.0,
+        f"recall@{k}": float(np.mean(recalls)) if users else 0.0,
+        f"ndcg@{k}": float(np.mean(ndcgs)) if users else 0.0,
+        "coverage": catalog_coverage((recommended for _u, recommended, _l in results), catalog_size, k),
+        "latency": latency_summary(latencies),
+        "elapsed_s": elapsed,
+        "users_per_sec": users / elapsed if elapsed else 0.0,
+    }
+
+
+# Holdout split
+
+def time_split(path, test_fraction, relevant_threshold):
+    """
+    Remove the newest `test_fraction` of ratings from the SQLite database at `path`.
+
+    Returns (cutoff, {user_id: set of held-out movie ids rated >= relevant_threshold}).
+    Materialized trending scores are dropped so they are rebuilt from training ratings only.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        total = conn.execute("SELECT COUNT(*) FROM rating").fetchone()[0]
+        n_test = int(round(total * test_fraction))
+        if not total or not n_test:
+            raise ValueError(f"Nothing to hold out ({total} ratings, test fraction {test_fraction})")
+        cutoff = conn.execute(
+            "SELECT created_at FROM rating ORDER BY created_at, id LIMIT 1 OFFSET ?", (total - n_test,)
+        ).fetchone()[0]
+        if cutoff is None:
+            raise ValueError("Ratings have no creation time to split on")
+
+        relevant_by_user = {}
+        for user_id, movie_id in conn.execute(
+            "SELECT user_id, movie_id FROM rating WHERE created_at >= ? AND rating >= ?",
+            (cutoff, relevant_threshold),
+        ):
+            relevant_by_user.setdefault(user_id, set()).add(movie_id)
+
+        conn.execute("DELETE FROM rating WHERE created_at >= ?", (cutoff,))
+        for table in ("trending_score", "trending_state", "user_data_version"):
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone():
+                conn.execute(f"DELETE FROM {table}")
+        conn.commit()
+        return cutoff, relevant_by_user
+    finally:
+        conn.close()
+
+
+def train_rating_counts(path):
+    conn = sqlite3.connect(path)
+    try:
+        return dict(conn.execute("SELECT user_id, COUNT(*) FROM rating GROUP BY user_id"))
+    finally:
+        conn.close()
+
+
+def copy_database(source, target):
+    """Consistent copy of a live SQLite database (online backup API)."""
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+def evaluation_environment(directory, database_path):
+    return {
+        "MOVIE_DB_URL": f"sqlite:///{database_path}",
+        "RATING_STORE_DIR": os.path.join(directory, "rating_store"),
+        "SHARED_STATE_DIR": os.path.join(directory, "shared"),
+        "TRENDING_REFRESH_SECONDS": _NO_REFRESH_SECONDS,
+        "USER_CONTEXT_CACHE_SIZE": "0",
+    }
+
+
+def prepare_models(cutoff):
+    """Build the rating store, text index and trending scores from the training ratings (once)."""
+    import app as m
+    from datetime import datetime
+
+    with m.app.app_context():
+        m.rebuild_rating_store()
+        m.ensure_text_index()
+        m.refresh_trending(now=datetime.fromisoformat(str(cutoff)))
+        catalog_size = m.Movie.query.count()
+        m.db.session.remove()
+        m.db.engine.dispose()  # Forked workers open their own connections
+    return catalog_size
+
+
+# Workers
+
+_app = None
+
+
+def _init_worker(env):
+    global _app
+    os.environ.update(env)
+    import app as m
+    _app = m
+
+
+def _recommend(m, user_id, stage, k):
+    if stage == "hybrid":
+        return [movie.id for movie, _score in m.get_recommendations(user_id, num_recommendations=k)]
+    context = m.get_user_context(user_id)
+    if stage == "age":
+        if not context.age:
+            return []
+        movies = m.get_age_based_recommendations(context.age, [], k, rated_by=user_id)
+        return [movie.id for movie in movies]
+    if stage == "content":
+        return [movie.id for movie in m.get_content_based_recommendations(context, k)]
+    stage_function = {
+        "similarity": m.get_similarity_based_recommendations,
+        "collaborative": m.get_collaborative_recommendations,
+        "text": m.get_text_similarity_recommendations,
+    }[stage]
+    return [movie.id for movie, _score in stage_function(context, k)]
+
+
+def evaluate_chunk(user_ids, stage, k):
+    """Recommend for a chunk of users in this worker; returns [(user_id, movie_ids, seconds)]."""
+    m = _app
+    results = []
+    for user_id in user_ids:
+        # A fresh app context per user keeps request-scoped caches and the session small
+        with m.app.app_context():
+            started = time.perf_counter()
+            recommended = _recommend(m, user_id, stage, k)
+            results.append((user_id, recommended, time.perf_counter() - started))
+            m.db.session.remove()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database", default=os.path.join("instance", "movie_recommendations.db"),
+                        help="SQLite database to evaluate (it is copied, never modified)")
+    parser.add_argument("--stage", choices=STAGES, default="hybrid")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--test-fraction", type=float, default=0.2, help="Newest share of ratings held out")
+    parser.add_argument("--relevant-threshold", type=float, default=4.0, help="Held-out ratings that count as hits")
+    parser.add_argument("--min-train-ratings", type=int, default=1,
+                        help="Skip users with fewer training ratings (0 includes cold-start users)")
+    parser.add_argument("--max-users", type=int, default=0, help="Evaluate a random sample of users (0 = all)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=50, help="Users per task sent to a worker")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the report as JSON")
+    options = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="evaluate-")
+    try:
+        started = time.perf_counter()
+        train_path = os.path.join(directory, "train.db")
+        copy_database(options.database, train_path)
+        cutoff, relevant_by_user = time_split(train_path, options.test_fraction, options.relevant_threshold)
+        train_counts = train_rating_counts(train_path)
+        users = sorted(u for u in relevant_by_user if train_counts.get(u, 0) >= options.min_train_ratings)
+        if options.max_users and len(users) > options.max_users:
+            users = sorted(random.Random(options.seed).sample(users, options.max_users))
+        if not users:
+            raise SystemExit("No users with held-out relevant ratings to evaluate")
+
+        env = evaluation_environment(directory, train_path)
+        os.environ.update(env)
+        catalog_size = prepare_models(cutoff)
+        print(f"Split at {cutoff}: {sum(train_counts.values())} training ratings, "
+              f"{len(users)} evaluation users; models built in {time.perf_counter() - started:.1f}s")
+
+        chunks = [users[i:i + options.chunk_size] for i in range(0, len(users), options.chunk_size)]
+        results = []
+        started = time.perf_counter()
+        with ProcessPoolExecutor(options.workers, initializer=_init_worker, initargs=(env,)) as pool:
+            for chunk_results in pool.map(evaluate_chunk, chunks, [options.stage] * len(chunks),
+                                          [options.k] * len(chunks)):
+                results.extend(chunk_results)
+        elapsed = time.perf_counter() - started
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = score(results, relevant_by_user, catalog_size, options.k, elapsed)
+    report.update({"stage": options.stage, "k": options.k, "cutoff": str(cutoff), "workers": options.workers})
+    k = options.k
+    latency = report["latency"]
+    print(f"{options.stage} over {report['users']} users with {options.workers} workers:")
+    print(f"  precision@{k} {report[f'precision@{k}']:.4f}  recall@{k} {report[f'recall@{k}']:.4f}  "
+          f"ndcg@{k} {report[f'ndcg@{k}']:.4f}  coverage {report['coverage']:.2%}")
+    print(f"  latency per user: mean {latency['mean_ms']:.1f} ms, p50 {latency['p50_ms']:.1f} ms, "
+          f"p95 {latency['p95_ms']:.1f} ms, p99 {latency['p99_ms']:.1f} ms")
+    print(f"  throughput {report['users_per_sec']:.1f} users/s ({elapsed:.1f}s)")
+    if options.output:
+        with open(options.output, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import json
+import time
+import zlib
+from datetime import date, datetime
+from typing import Any, Iterable, Iterator, Mapping
+
+
+# Rows serialized per emitted chunk; keeps per-chunk overhead low while memory stays bounded
+DEFAULT_CHUNK_ROWS = 500
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class ThroughputMeter:
+    """Counts exported rows and reports rows/sec since the first row was requested."""
+
+    def __init__(self) -> None:
+        self.rows = 0
+        self.started = time.perf_counter()
+        self.finished: float | None = None
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return max(end - self.started, 1e-9)
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.elapsed
+
+    def summary(self, label: str) -> str:
+        return f"Exported {self.rows} {label} in {self.elapsed:.2f}s ({self.rows_per_sec:,.0f} rows/sec)"
+
+
+def ndjson_chunks(
+    rows: Iterable[Mapping[str, Any]],
+    meter: ThroughputMeter | None = None,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> Iterator[bytes]:
+    """Serialize rows as newline-delimited JSON, yielding one bytes chunk per `chunk_rows` rows."""
+    buffer: list[str] = []
+    for row in rows:
+        buffer.append(json.dumps(dict(row), default=_json_default, separators=(",", ":")))
+        if meter is not None:
+            meter.rows += 1
+        if len(buffer) >= chunk_rows:
+            yield ("\n".join(buffer) + "\n").encode("utf-8")
+            buffer = []
+    if buffer:
+        yield ("\n".join(buffer) + "\n").encode("utf-8")
+    if meter is not None:
+        meter.finished = time.perf_counter()
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compress a stream of chunks into a single gzip member without buffering the whole body."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,467 @@
+"""
+End-to-end load test: seed a synthetic database, serve the app and drive virtual users through it.
+
+Virtual users (threads with their own cookie session) register or log in, then browse with a
+weighted route mix (dashboard, movie search, movie details, rating, recommendations API),
+replaying ETags like a browser. The run reports throughput, p50/p95/p99 latency and error
+rates per route plus server-side exceptions (e.g. SQLite "database is locked"), and saves the
+results as JSON so runs can be compared.
+
+    python loadtest.py --vus 20 --duration 30
+    python loadtest.py --server gunicorn --workers 4 --compare loadtest_results/previous.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+import requests
+
+
+DEFAULT_ROUTES = ("dashboard", "movies", "movie_detail", "rate_movie", "api_recommendations")
+DEFAULT_MIX = "dashboard=15,movies=20,movie_detail=30,rate_movie=10,api_recommendations=25"
+RESULTS_DIR = "loadtest_results"
+SEED_PASSWORD = "loadtest"
+
+GENRES = ["Action", "Adventure", "Animation", "Comedy", "Crime", "Drama", "Family", "Fantasy",
+          "Horror", "Romance", "Sci-Fi", "Thriller"]
+AGE_RATINGS = ["G", "PG", "PG-13", "R"]
+WORDS = ["space", "heist", "family", "ocean", "robot", "love", "war", "city", "ghost", "island",
+         "detective", "dragon", "journey", "secret", "storm", "king", "school", "planet", "river", "night"]
+
+
+def parse_mix(text):
+    """Parse "route=weight,..." into {route: weight}; unknown routes raise ValueError."""
+    mix = {}
+    for part in text.split(","):
+        route, _, weight = part.partition("=")
+        route = route.strip()
+        if route not in DEFAULT_ROUTES:
+            raise ValueError(f"Unknown route {route!r} (choose from {', '.join(DEFAULT_ROUTES)})")
+        mix[route] = float(weight or 1)
+    if not any(mix.values()):
+        raise ValueError("The route mix needs at least one positive weight")
+    return mix
+
+
+def classify_exception(line):
+    """Bucket a server exception line ("module.Type: message") for the error report."""
+    if "database is locked" in line:
+        return "sqlite: database is locked"
+    name = line.split(":", 1)[0].strip()
+    return name or "unknown"
+
+
+def summarize_server_log(text):
+    """Count exceptions in a gunicorn/Flask log by their final "Type: message" traceback line."""
+    counts = Counter()
+    for chunk in text.split("Exception on ")[1:]:
+        final = [line for line in chunk.splitlines() if re.match(r"^[A-Za-z_][\w.]*(: |$)", line)]
+        if final:
+            counts[classify_exception(final[-1])] += 1
+    return counts
+
+
+def summarize(samples, elapsed):
+    """Per-route and overall latency percentiles (ms), throughput and error rates."""
+    routes = {}
+    by_route = defaultdict(list)
+    for sample in samples:
+        by_route[sample["route"]].append(sample)
+    for route, route_samples in sorted(by_route.items()):
+        latencies = np.array([s["latency"] for s in route_samples]) * 1000.0
+        errors = Counter(s["error"] for s in route_samples if s["error"])
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        routes[route] = {
+            "requests": len(route_samples),
+            "throughput": len(route_samples) / elapsed,
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "mean_ms": float(latencies.mean()),
+            "errors": sum(errors.values()),
+            "error_rate": sum(errors.values()) / len(route_samples),
+            "error_kinds": dict(errors),
+        }
+    total = len(samples)
+    total_errors = sum(r["errors"] for r in routes.values())
+    return {
+        "requests": total,
+        "elapsed_s": elapsed,
+        "throughput": total / elapsed if elapsed else 0.0,
+        "errors": total_errors,
+        "error_rate": total_errors / total if total else 0.0,
+        "routes": routes,
+    }
+
+
+def format_report(summary, server_exceptions):
+    lines = [f"{summary['requests']} requests in {summary['elapsed_s']:.1f}s: "
+             f"{summary['throughput']:.1f} req/s, error rate {summary['error_rate']:.2%}",
+             f"{'route':<22} {'reqs':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"]
+    for route, stats in summary["routes"].items():
+        lines.append(f"{route:<22} {stats['requests']:>6} {stats['throughput']:>7.1f} {stats['p50_ms']:>8.1f} "
+                     f"{stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {stats['error_rate']:>7.1%}")
+        for kind, count in sorted(stats["error_kinds"].items()):
+            lines.append(f"{'':<22}   {kind}: {count}")
+    if server_exceptions:
+        lines.append("server exceptions:")
+        for kind, count in server_exceptions.most_common():
+            lines.append(f"  {kind}: {count}")
+    return "\n".join(lines)
+
+
+def format_comparison(previous, current):
+    """p95 and throughput of this run against a saved one, per route."""
+    lines = [f"{'route':<22} {'p95 before':>11} {'p95 now':>8} {'change':>8} {'req/s before':>13} {'req/s now':>10}"]
+    for route, stats in current["routes"].items():
+        before = previous["routes"].get(route)
+        if not before:
+            continue
+        change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0.0
+        lines.append(f"{route:<22} {before['p95_ms']:>11.1f} {stats['p95_ms']:>8.1f} {change:>+8.1%} "
+                     f"{before['throughput']:>13.1f} {stats['throughput']:>10.1f}")
+    lines.append(f"{'overall req/s':<22} {previous['throughput']:>11.1f} {current['throughput']:>8.1f}")
+    return "\n".join(lines)
+
+
+# Synthetic data
+
+def seed_database(m, movies, users, ratings_per_user, seed):
+    """Add synthetic movies, users and ratings to the app's (empty, freshly seeded) database."""
+    rng = random.Random(seed)
+    db = m.db
+    first_id = (db.session.query(db.func.max(m.Movie.id)).scalar() or 0) + 1
+    movie_rows = []
+    for movie_id in range(first_id, first_id + movies):
+        words = rng.sample(WORDS, 3)
+        movie_rows.append({
+            "id": movie_id,
+            "title": f"{words[0].title()} {words[1].title()} {movie_id}",
+            "genre": ", ".join(rng.sample(GENRES, rng.randint(1, 3))),
+            "year": rng.randint(1960, 2024),
+            "director": f"Director {rng.randint(1, movies // 10 + 1)}",
+            "cast": ", ".join(f"Actor {rng.randint(1, movies // 2 + 1)}" for _ in range(3)),
+            "description": " ".join(rng.choice(WORDS) for _ in range(12)),
+            "age_rating": rng.choice(AGE_RATINGS),
+        })
+    db.session.execute(m.Movie.__table__.insert(), movie_rows)
+    m.bump_catalog_version()  # Core inserts bypass the Movie mapper events
+
+    password_hash = m.generate_password_hash(SEED_PASSWORD)
+    db.session.execute(m.User.__table__.insert(), [
+        {"username": f"seed{i}", "email": f"seed{i}@loadtest.local", "password_hash": password_hash,
+         "age": rng.randint(6, 70), "created_at": datetime.utcnow()}
+        for i in range(users)
+    ])
+    user_ids = [user_id for (user_id,) in db.session.query(m.User.id)]
+    movie_ids = [movie_id for (movie_id,) in db.session.query(m.Movie.id)]
+    # Popularity follows a power law, like real catalogs
+    weights = [1.0 / (rank + 1) ** 0.8 for rank in range(len(movie_ids))]
+    now = datetime.utcnow()
+    rating_rows = []
+    for user_id in user_ids:
+        count = min(len(movie_ids), max(1, int(rng.expovariate(1.0 / ratings_per_user))))
+        rated = set()
+        while len(rated) < count:
+            rated.update(rng.choices(movie_ids, weights, k=count - len(rated)))
+        for movie_id in rated:
+            rating_rows.append({"user_id": user_id, "movie_id": movie_id, "rating": float(rng.randint(1, 5)),
+                                "created_at": now - timedelta(seconds=rng.randint(0, 60 * 86400))})
+    db.session.execute(m.Rating.__table__.insert(), rating_rows)
+    db.session.commit()
+
+    m.rebuild_text_index()
+    m.rebuild_rating_store()
+    m.refresh_trending()
+    return len(movie_ids), len(user_ids), len(rating_rows)
+
+
+def prepare_environment(directory):
+    """Point the app at a throwaway database and artifact directories (before importing it)."""
+    env = {
+        "MOVIE_DB_URL": f"sqlite:///{os.path.join(directory, 'loadtest.db')}",
+        "RATING_STORE_DIR": os.path.join(directory, "rating_store"),
+        "SHARED_STATE_DIR": os.path.join(directory, "shared"),
+    }
+    os.environ.update(env)
+    return env
+
+
+# Servers
+
+class ExceptionCollector(logging.Handler):
+    """Counts exceptions the in-process app logs (Flask logs every unhandled one)."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        if record.exc_info and record.exc_info[1] is not None:
+            exc = record.exc_info[1]
+            line = f"{type(exc).__module__}.{type(exc).__name__}: {exc}"
+        else:
+            line = record.getMessage()
+        with self._lock:
+            self.counts[classify_exception(line)] += 1
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start listening on port {port}")
+
+
+class WerkzeugServer:
+    """Threaded werkzeug server running the app in this process."""
+
+    def __init__(self, flask_app, port):
+        from werkzeug.serving import make_server
+        self.collector = ExceptionCollector()
+        flask_app.logger.addHandler(self.collector)
+        self.flask_app = flask_app
+        self.server = make_server("127.0.0.1", port, flask_app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        from flask.logging import default_handler
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)  # No per-request access log
+        self.flask_app.logger.removeHandler(default_handler)  # Counted instead of printed
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        from flask.logging import default_handler
+        self.server.shutdown()
+        self.thread.join()
+        self.flask_app.logger.removeHandler(self.collector)
+        self.flask_app.logger.addHandler(default_handler)
+
+    def exceptions(self):
+        return self.collector.counts
+
+
+class GunicornServer:
+    """Local gunicorn (like the Procfile) with the load-test environment; errors come from its log."""
+
+    def __init__(self, port, workers, threads, env, log_path):
+        self.command = [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads),
+                        "-b", f"127.0.0.1:{port}", "app:app"]
+        self.port = port
+        self.env = {**os.environ, **env}
+        self.log_path = log_path
+        self.process = None
+
+    def __enter__(self):
+        self.log = open(self.log_path, "w")
+        self.process = subprocess.Popen(self.command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                        env=self.env, stdout=self.log, stderr=subprocess.STDOUT)
+        wait_for_port(self.port)
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait(timeout=30)
+        self.log.close()
+
+    def exceptions(self):
+        with open(self.log_path) as fh:
+            return summarize_server_log(fh.read())
+
+
+# Virtual users
+
+
+class VirtualUser(threading.Thread):
+    """One browsing user: a cookie session per login, ETags replayed like a browser cache."""
+
+    def __init__(self, index, base_url, mix, deadline, catalog, seeded_users, options, samples, lock):
+        super().__init__(daemon=True)
+        self.index = index
+        self.base_url = base_url
+        self.routes = list(mix)
+        self.weights = [mix[r] for r in self.routes]
+        self.deadline = deadline
+        self.movie_ids, self.search_terms = catalog
+        self.seeded_users = seeded_users
+        self.options = options
+        self.samples = samples
+        self.lock = lock
+        self.rng = random.Random(options.seed * 1000 + index)
+        self.registered = 0
+
+    def request(self, route, method, path, **kwargs):
+        headers = kwargs.pop("headers", {})
+        etag_key = (route, path)
+        if method == "GET" and etag_key in self.etags:
+            headers["If-None-Match"] = self.etags[etag_key]
+        started = time.perf_counter()
+        error = None
+        try:
+            response = self.session.request(method, self.base_url + path, headers=headers,
+                                            allow_redirects=False, timeout=self.options.timeout, **kwargs)
+            status = response.status_code
+            if status >= 400:
+                error = f"http_{status}"
+            elif response.headers.get("ETag"):
+                self.etags[etag_key] = response.headers["ETag"]
+        except requests.RequestException as e:
+            status = 0
+            error = type(e).__name__
+        latency = time.perf_counter() - started
+        with self.lock:
+            self.samples.append({"route": route, "latency": latency, "status": status, "error": error})
+        return status
+
+    def start_session(self):
+        self.session = requests.Session()
+        self.etags = {}
+        if not self.seeded_users or self.rng.random() < self.options.new_user_ratio:
+            self.registered += 1
+            username = f"vu{self.index}_{self.registered}_{os.getpid()}"
+            self.request("register", "POST", "/register", data={
+                "username": username, "email": f"{username}@loadtest.local",
+                "password": SEED_PASSWORD, "age": str(self.rng.randint(6, 70)),
+            })
+        else:
+            username = self.rng.choice(self.seeded_users)
+        self.request("login", "POST", "/login", data={"username": username, "password": SEED_PASSWORD})
+
+    def run(self):
+        while time.monotonic() < self.deadline:
+            self.start_session()
+            for _ in range(self.options.session_length):
+                if time.monotonic() >= self.deadline:
+                    break
+                self.browse(self.rng.choices(self.routes, self.weights)[0])
+                if self.options.think_ms:
+                    time.sleep(self.rng.uniform(0, 2 * self.options.think_ms) / 1000.0)
+
+    def browse(self, route):
+        if route == "dashboard":
+            self.request(route, "GET", "/dashboard")
+        elif route == "movies":
+            self.request(route, "GET", "/movies", params={"search": self.rng.choice(self.search_terms)})
+        elif route == "movie_detail":
+            self.request(route, "GET", f"/movie/{self.rng.choice(self.movie_ids)}")
+        elif route == "rate_movie":
+            self.request(route, "POST", "/rate_movie", data={
+                "movie_id": self.rng.choice(self.movie_ids), "rating": self.rng.randint(1, 5),
+            })
+        elif route == "api_recommendations":
+            self.request(route, "GET", "/api/recommendations")
+
+
+def run_load(base_url, mix, catalog, seeded_users, options):
+    samples, lock = [], threading.Lock()
+    started = time.monotonic()
+    deadline = started + options.duration
+    vus = [VirtualUser(i, base_url, mix, deadline, catalog, seeded_users, options, samples, lock)
+           for i in range(options.vus)]
+    for vu in vus:
+        vu.start()
+        if options.ramp_up:
+            time.sleep(options.ramp_up / options.vus)
+    for vu in vus:
+        vu.join()
+    return samples, time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vus", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="Seconds over which virtual users start")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Route weights, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--session-length", type=int, default=25, help="Requests per login session")
+    parser.add_argument("--new-user-ratio", type=float, default=0.2, help="Share of sessions that register a new user")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Mean pause between requests")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument("--server", choices=["werkzeug", "gunicorn"], default="werkzeug")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=1, help="gunicorn threads per worker")
+    parser.add_argument("--movies", type=int, default=2000, help="Synthetic movies to seed")
+    parser.add_argument("--users", type=int, default=500, help="Synthetic users to seed")
+    parser.add_argument("--ratings-per-user", type=int, default=30, help="Mean ratings per seeded user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help=f"Results JSON (default: {RESULTS_DIR}/<timestamp>.json)")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--label", default="", help="Free-form label stored with the results")
+    options = parser.parse_args()
+    mix = parse_mix(options.mix)
+
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as directory:
+        env = prepare_environment(directory)
+        import app as m  # noqa: E402  (reads the environment above at import)
+
+        started = time.perf_counter()
+        with m.app.app_context():
+            counts = seed_database(m, options.movies, options.users, options.ratings_per_user, options.seed)
+            movies = m.db.session.query(m.Movie.id, m.Movie.title).all()
+            seeded_users = [name for (name,) in m.db.session.query(m.User.username)]
+            m.db.session.remove()
+        print(f"Seeded {counts[0]} movies, {counts[1]} users and {counts[2]} ratings "
+              f"in {time.perf_counter() - started:.1f}s")
+        search_terms = sorted({word.lower() for _id, title in movies for word in title.split() if word.isalpha()})
+        catalog = ([movie_id for movie_id, _title in movies], search_terms)
+
+        port = free_port()
+        if options.server == "werkzeug":
+            server = WerkzeugServer(m.app, port)
+        else:
+            server = GunicornServer(port, options.workers, options.threads, env,
+                                    os.path.join(directory, "gunicorn.log"))
+        with server:
+            print(f"Running {options.vus} virtual users for {options.duration:.0f}s against {options.server}...")
+            samples, elapsed = run_load(f"http://127.0.0.1:{port}", mix, catalog, seeded_users, options)
+        server_exceptions = server.exceptions()
+
+    summary = summarize(samples, elapsed)
+    print(format_report(summary, server_exceptions))
+
+    results = {
+        "label": options.label,
+        "started_at": datetime.utcnow().isoformat(),
+        "config": {k: v for k, v in vars(options).items() if k not in ("output", "compare")},
+        "mix": mix,
+        "seeded": {"movies": counts[0], "users": counts[1], "ratings": counts[2]},
+        "server_exceptions": dict(server_exceptions),
+        **summary,
+    }
+    output = options.output or os.path.join(RESULTS_DIR, datetime.utcnow().strftime("%Y%m%dT%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as fh:
+        json.dump(results, fh, indent=2)
+    print(f"Saved results to {output}")
+
+    if options.compare:
+        with open(options.compare) as fh:
+            print(format_comparison(json.load(fh), results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+from __future__ import annotations
+
+import os
+import struct
+import threading
+from typing import Any, Callable, Iterable
+
+import numpy as np
+from scipy import sparse
+
+from shared_state import map_arrays, write_arrays
+
+try:
+    import fcntl
+except ImportError:  # Windows (development server, one process): no cross-process locks
+    fcntl = None
+
+
+# One append-log record: user_id, movie_id, rating, unix timestamp (16 bytes)
+RECORD = struct.Struct("<iifI")
+
+SNAPSHOT_FILE = "snapshot.bin"
+LOG_FILE = "append.log"
+COMPACTING_LOG_FILE = "append.log.compacting"
+# flock'd files: appenders share LOG_LOCK_FILE while writing and compaction takes it exclusively to
+# swap the log out; COMPACT_LOCK_FILE is held by the one process compacting
+LOG_LOCK_FILE = "append.lock"
+COMPACT_LOCK_FILE = "compact.lock"
+
+SNAPSHOT_FORMAT = 2
+
+_ARRAY_DTYPES = {
+    "users": np.int32,
+    "movies": np.int32,
+    "ratings": np.float32,
+    "timestamps": np.uint32,
+    "user_ids": np.int32,
+    "user_offsets": np.int64,
+    "movie_perm": np.int64,
+    "movie_ids": np.int32,
+    "movie_offsets": np.int64,
+    "columns": np.int32,
+    "user_norms": np.float64,
+}
+
+
+def _lock(path: str, exclusive: bool = True, blocking: bool = True) -> int | None:
+    """
+    Open and flock `path`; closing the returned descriptor releases the lock, and so does the
+    process dying. Returns None when `blocking` is False and another descriptor holds it.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is not None:
+        operation = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB)
+        try:
+            fcntl.flock(fd, operation)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+    return fd
+
+
+def _remove_if_exists(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _group_offsets(sorted_keys: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Unique keys of a sorted array and the offsets where each key's run starts (plus the end)."""
+    keys, starts = np.unique(sorted_keys, return_index=True)
+    offsets = np.append(starts, len(sorted_keys)).astype(np.int64)
+    return keys.astype(np.int32), offsets
+
+
+class RatingArrays:
+    """
+    Ratings as parallel arrays sorted by (user, movie), with per-user offsets and a
+    by-movie permutation (movie_perm) plus per-movie offsets into that permutation.
+    `columns` (each rating's index into movie_ids) and `user_norms` are precomputed so the
+    CSR matrix is a zero-copy view of the snapshot.
+
+    Arrays may be ordinary in-memory arrays or read-only views of a memory-mapped snapshot.
+    """
+
+    def __init__(self, arrays: dict[str, np.ndarray], meta: dict[str, Any] | None = None):
+        self.users = arrays["users"]
+        self.movies = arrays["movies"]
+        self.ratings = arrays["ratings"]
+        self.timestamps = arrays["timestamps"]
+        self.user_ids = arrays["user_ids"]
+        self.user_offsets = arrays["user_offsets"]
+        self.movie_perm = arrays["movie_perm"]
+        self.movie_ids = arrays["movie_ids"]
+        self.movie_offsets = arrays["movie_offsets"]
+        self.columns = arrays["columns"]
+        self.user_norms = arrays["user_norms"]
+        self.meta = meta or {}
+        self._csr: tuple[sparse.csr_matrix, np.ndarray, np.ndarray] | None = None
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    @classmethod
+    def from_records(
+        cls,
+        users: Iterable[int],
+        movies: Iterable[int],
+        ratings: Iterable[float],
+        timestamps: Iterable[int],
+        meta: dict[str, Any] | None = None,
+    ) -> "RatingArrays":
+        """Build sorted arrays; for duplicate (user, movie) pairs the last record wins."""
+        users = np.asarray(users, dtype=np.int32)
+        movies = np.asarray(movies, dtype=np.int32)
+        ratings = np.asarray(ratings, dtype=np.float32)
+        timestamps = np.asarray(timestamps, dtype=np.uint32)
+        n = len(users)
+        if n:
+            order = np.lexsort((np.arange(n), movies, users))
+            sorted_users, sorted_movies = users[order], movies[order]
+            last = np.ones(n, dtype=bool)
+            last[:-1] = (sorted_users[1:] != sorted_users[:-1]) | (sorted_movies[1:] != sorted_movies[:-1])
+            keep = order[last]
+            users, movies, ratings, timestamps = users[keep], movies[keep], ratings[keep], timestamps[keep]
+
+        user_ids, user_offsets = _group_offsets(users)
+        movie_perm = np.argsort(movies, kind="stable").astype(np.int64)
+        movie_ids, movie_offsets = _group_offsets(movies[movie_perm])
+        squares = np.square(ratings, dtype=np.float64)
+        user_norms = np.sqrt(np.add.reduceat(squares, user_offsets[:-1])) if n else np.zeros(0)
+        return cls({
+            "users": users,
+            "movies": movies,
+            "ratings": ratings,
+            "timestamps": timestamps,
+            "user_ids": user_ids,
+            "user_offsets": user_offsets,
+            "movie_perm": movie_perm,
+            "movie_ids": movie_ids,
+            "movie_offsets": movie_offsets,
+            "columns": np.searchsorted(movie_ids, movies).astype(np.int32),
+            "user_norms": user_norms,
+        }, meta)
+
+    @classmethod
+    def empty(cls, meta: dict[str, Any] | None = None) -> "RatingArrays":
+        return cls.from_records([], [], [], [], meta)
+
+    def _user_slice(self, user_id: int) -> slice:
+        i = int(np.searchsorted(self.user_ids, user_id))
+        if i >= len(self.user_ids) or self.user_ids[i] != user_id:
+            return slice(0, 0)
+        return slice(int(self.user_offsets[i]), int(self.user_offsets[i + 1]))
+
+    def user_ratings(self, user_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """(movie_ids, ratings) of one user, sorted by movie id"""
+        s = self._user_slice(user_id)
+        return self.movies[s], self.ratings[s]
+
+    def has_rating(self, user_id: int, movie_id: int) -> bool:
+        movies = self.movies[self._user_slice(user_id)]
+        i = int(np.searchsorted(movies, movie_id))
+        return i < len(movies) and movies[i] == movie_id
+
+    def movie_ratings(self, movie_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """(user_ids, ratings) of one movie, sorted by user id"""
+        i = int(np.searchsorted(self.movie_ids, movie_id))
+        if i >= len(self.movie_ids) or self.movie_ids[i] != movie_id:
+            return self.users[:0], self.ratings[:0]
+        rows = self.movie_perm[self.movie_offsets[i]:self.movie_offsets[i + 1]]
+        return self.users[rows], self.ratings[rows]
+
+    def to_csr(self) -> tuple[sparse.csr_matrix, np.ndarray, np.ndarray]:
+        """
+        User x movie rating matrix over rated users/movies, with the row and column ids (cached).
+
+        Data and column indices are views of the (possibly memory-mapped) arrays, so every
+        worker shares them instead of holding a private float64 copy.
+        """
+        if self._csr is None:
+            matrix = sparse.csr_matrix(
+                (self.ratings, self.columns, self.user_offsets),
+                shape=(len(self.user_ids), len(self.movie_ids)),
+            )
+            self._csr = (matrix, self.user_ids, self.movie_ids)
+        return self._csr
+
+    def save(self, path: str) -> None:
+        """Write a single-file snapshot atomically, so readers either see the old or the new file."""
+        write_arrays(
+            path,
+            {name: np.asarray(getattr(self, name), dtype=dtype) for name, dtype in _ARRAY_DTYPES.items()},
+            {"format": SNAPSHOT_FORMAT, **self.meta},
+        )
+
+    @classmethod
+    def open(cls, path: str) -> "RatingArrays":
+        """Memory-map a snapshot read-only; pages are shared with every other process mapping it."""
+        arrays, meta = map_arrays(path)
+        if meta.pop("format", None) != SNAPSHOT_FORMAT or set(arrays) != set(_ARRAY_DTYPES):
+            raise ValueError(f"{path} is not a rating snapshot in format {SNAPSHOT_FORMAT}")
+        return cls(arrays, meta)
+
+
+class RatingStore:
+    """
+    Compact rating store: a memory-mapped snapshot plus an append log of newer writes.
+
+    Writers call append() (one 16-byte O_APPEND write, safe across processes); readers call
+    refresh() to pick up log records and a newer snapshot. compact() folds the log into a
+    new snapshot.
+
+    The snapshot is replaced with os.replace and reopened when its inode changes, so every
+    process maps the same file (one copy in the page cache) and switches generations
+    atomically; a reader keeps its old mapping until its next refresh().
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self.log_path = os.path.join(directory, LOG_FILE)
+        self.compacting_log_path = os.path.join(directory, COMPACTING_LOG_FILE)
+        self.log_lock_path = os.path.join(directory, LOG_LOCK_FILE)
+        self.compact_lock_path = os.path.join(directory, COMPACT_LOCK_FILE)
+        self.snapshot = RatingArrays.empty()
+        self._snapshot_stat: tuple[int, int] | None = None
+        self._log_positions: dict[tuple[int, int], int] = {}  # (device, inode) -> bytes consumed
+        self._overlay: dict[tuple[int, int], tuple[float, int]] = {}  # (user, movie) -> (rating, ts)
+        self._overlay_by_user: dict[int, dict[int, float]] = {}
+        self._merged: RatingArrays | None = None
+        self._length: int | None = None
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def meta(self) -> dict[str, Any]:
+        return self.snapshot.meta
+
+    @property
+    def has_snapshot(self) -> bool:
+        return self._snapshot_stat is not None
+
+    @property
+    def pending(self) -> int:
+        """Number of (user, movie) pairs only present in the append log"""
+        return len(self._overlay)
+
+    def __len__(self) -> int:
+        with self._lock:
+            if self._length is None:
+                snapshot = self.snapshot
+                new_pairs = sum(1 for user_id, movie_id in self._overlay if not snapshot.has_rating(user_id, movie_id))
+                self._length = len(snapshot) + new_pairs
+            return self._length
+
+    def write_snapshot(self, arrays: RatingArrays) -> None:
+        """Replace the snapshot and drop the logs."""
+        self.rebuild(lambda: arrays)
+
+    def rebuild(self, load: Callable[[], RatingArrays]) -> None:
+        """
+        Replace the snapshot with load() (e.g. a full read of the database) and drop the logs.
+
+        load() runs with compaction and appends held off, so every record logged before the
+        logs are dropped was already committed when load() read its source: nothing written
+        meanwhile is lost, it is appended to the new log once the locks are released.
+        """
+        compact_fd = _lock(self.compact_lock_path)
+        try:
+            log_fd = _lock(self.log_lock_path)
+            try:
+                load().save(self.snapshot_path)
+                for path in (self.log_path, self.compacting_log_path):
+                    _remove_if_exists(path)
+            finally:
+                os.close(log_fd)
+        finally:
+            os.close(compact_fd)
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Reopen the snapshot if it was replaced, then apply unread append-log records."""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self) -> None:
+        try:
+            st = os.stat(self.snapshot_path)
+            snapshot_stat = (st.st_ino, st.st_mtime_ns)
+        except FileNotFoundError:
+            snapshot_stat = None
+        if snapshot_stat != self._snapshot_stat:
+            self.snapshot = RatingArrays.open(self.snapshot_path) if snapshot_stat else RatingArrays.empty()
+            self._snapshot_stat = snapshot_stat
+            self._log_positions.clear()
+            self._overlay.clear()
+            self._overlay_by_user.clear()
+            self._merged = None
+            self._length = None
+
+        # A log being compacted is still read until its records show up in the new snapshot
+        for path in (self.compacting_log_path, self.log_path):
+            self._read_log(path)
+
+    def _read_log(self, path: str) -> None:
+        try:
+            fh = open(path, "rb")
+        except FileNotFoundError:
+            return
+        with fh:
+            st = os.fstat(fh.fileno())
+            key = (st.st_dev, st.st_ino)
+            position = self._log_positions.get(key, 0)
+            complete = (st.st_size - position) // RECORD.size * RECORD.size
+            if complete <= 0:
+                return
+            fh.seek(position)
+            data = fh.read(complete)
+        self._log_positions[key] = position + len(data)
+        for user_id, movie_id, rating, timestamp in RECORD.iter_unpack(data):
+            self._overlay[(user_id, movie_id)] = (rating, timestamp)
+            self._overlay_by_user.setdefault(user_id, {})[movie_id] = rating
+        self._merged = None
+        self._length = None
+
+    def append(self, user_id: int, movie_id: int, rating: float, timestamp: int) -> None:
+        """Record a new or updated rating; visible to readers after their next refresh()."""
+        # The shared lock keeps compaction from renaming the log between our open() and write(),
+        # which would put this record into a log that was already read and is about to be deleted
+        lock_fd = _lock(self.log_lock_path, exclusive=False)
+        try:
+            fd = os.open(self.log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, RECORD.pack(user_id, movie_id, rating, timestamp))
+            finally:
+                os.close(fd)
+        finally:
+            os.close(lock_fd)
+
+    def arrays(self) -> RatingArrays:
+        """Snapshot merged with the append log (the snapshot itself when the log is empty)."""
+        with self._lock:
+            return self._merged_arrays()
+
+    def _merged_arrays(self) -> RatingArrays:
+        if not self._overlay:
+            return self.snapshot
+        if self._merged is None:
+            keys = np.array(list(self._overlay), dtype=np.int64).reshape(-1, 2)
+            values = np.array(list(self._overlay.values()), dtype=np.float64).reshape(-1, 2)
+            base = self.snapshot
+            self._merged = RatingArrays.from_records(
+                np.concatenate([base.users, keys[:, 0]]),
+                np.concatenate([base.movies, keys[:, 1]]),
+                np.concatenate([base.ratings, values[:, 0]]),
+                np.concatenate([base.timestamps, values[:, 1]]),
+                meta=base.meta,
+            )
+        return self._merged
+
+    def user_ratings(self, user_id: int) -> dict[int, float]:
+        """{movie_id: rating} for one user, without materializing the merged arrays"""
+        movies, ratings = self.snapshot.user_ratings(user_id)
+        result = dict(zip(movies.tolist(), ratings.tolist()))
+        result.update(self._overlay_by_user.get(user_id, {}))
+        return result
+
+    def user_similarities(self, user_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Cosine similarity between one user's ratings and every user's, as (user_ids, similarities).
+
+        Computed as one product against the shared snapshot matrix; only users with logged
+        writes are recomputed from their merged ratings, so nothing is materialized per worker.
+        """
+        with self._lock:
+            snapshot = self.snapshot
+            logged_users = list(self._overlay_by_user)
+            target = self.user_ratings(user_id)
+        if not target:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+
+        matrix, user_ids, movie_ids = snapshot.to_csr()
+        target_movies = np.fromiter(target.keys(), dtype=np.int64, count=len(target))
+        target_values = np.fromiter(target.values(), dtype=np.float32, count=len(target))
+        target_norm = float(np.sqrt(np.square(target_values, dtype=np.float64).sum()))
+
+        vector = np.zeros(len(movie_ids), dtype=np.float32)
+        positions = np.searchsorted(movie_ids, target_movies)
+        known = positions < len(movie_ids)
+        known[known] = movie_ids[positions[known]] == target_movies[known]
+        vector[positions[known]] = target_values[known]
+
+        dots = np.asarray(matrix @ vector, dtype=np.float64)
+        denominators = snapshot.user_norms * target_norm
+        similarities = np.divide(dots, denominators, out=np.zeros(len(dots)), where=denominators > 0)
+
+        extra_ids, extra_similarities = [], []
+        for other_id in logged_users:
+            ratings = self.user_ratings(other_id)
+            norm = float(np.sqrt(sum(r * r for r in ratings.values())))
+            dot = sum(r * target[m] for m, r in ratings.items() if m in target)
+            similarity = dot / (norm * target_norm) if norm and target_norm else 0.0
+            i = int(np.searchsorted(user_ids, other_id))
+            if i < len(user_ids) and user_ids[i] == other_id:
+                similarities[i] = similarity
+            else:
+                extra_ids.append(other_id)
+                extra_similarities.append(similarity)
+        if extra_ids:
+            user_ids = np.concatenate([user_ids, np.asarray(extra_ids, dtype=user_ids.dtype)])
+            similarities = np.concatenate([similarities, extra_similarities])
+        return user_ids, similarities
+
+    def movie_ratings(self, movie_id: int) -> tuple[np.ndarray, np.ndarray]:
+        return self.arrays().movie_ratings(movie_id)
+
+    def compact(self) -> int:
+        """
+        Fold the append log into a new snapshot, waiting for any compaction already running.
+        Appends made while compacting go to a fresh log. Returns records folded.
+        """
+        lock_fd = _lock(self.compact_lock_path)
+        try:
+            return self._compact()
+        finally:
+            os.close(lock_fd)
+
+    def _compact(self) -> int:
+        # A leftover compacting log (a compaction died) is folded before the current log is swapped out
+        if not os.path.exists(self.compacting_log_path):
+            if not os.path.exists(self.log_path):
+                return 0
+            lock_fd = _lock(self.log_lock_path)  # Waits for appends that already opened the log
+            try:
+                os.replace(self.log_path, self.compacting_log_path)
+            finally:
+                os.close(lock_fd)
+        self.refresh()
+        folded = self.pending
+        merged = self.arrays()
+        # Marks a snapshot that holds log records besides whatever it was originally built from
+        merged.meta = {**merged.meta, "compacted": True}
+        merged.save(self.snapshot_path)
+        _remove_if_exists(self.compacting_log_path)
+        self.refresh()
+        return folded
+
+    def compact_if_needed(self, max_pending: int) -> int:
+        """Compact once the log holds `max_pending` pairs, unless another process already is."""
+        if self.pending < max_pending:
+            return 0
+        lock_fd = _lock(self.compact_lock_path, blocking=False)
+        if lock_fd is None:
+            return 0
+        try:
+            return self._compact()
+        finally:
+            os.close(lock_fd)
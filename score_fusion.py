@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from typing import Iterable, NamedTuple, Sequence
+
+import numpy as np
+
+
+# Stages in the order get_recommendations merges them; a movie's first hit decides its weight
+STAGES = ("age", "similarity", "collaborative", "content", "text")
+
+# Profile used for viewers whose age group has no profile of its own (including unknown age)
+DEFAULT_GROUP = "default"
+
+
+@dataclass(frozen=True)
+class StageWeights:
+    """Multiplier for a stage's score when it is the first stage to produce a movie, and when an earlier one already did."""
+
+    first: float
+    boost: float
+
+
+DEFAULT_PROFILE = {
+    "age": StageWeights(0.6, 0.6),
+    "similarity": StageWeights(1.0, 0.5),
+    "collaborative": StageWeights(0.4, 0.3),
+    "content": StageWeights(0.5, 0.2),
+    "text": StageWeights(0.4, 0.2),
+}
+
+# Per-group changes to the default profile: age-appropriate picks rank higher for children
+_GROUP_WEIGHTS = {
+    "kid": {"age": StageWeights(0.8, 0.8)},
+}
+
+DEFAULT_PROFILES = {
+    DEFAULT_GROUP: DEFAULT_PROFILE,
+    **{group: {**DEFAULT_PROFILE, **weights} for group, weights in _GROUP_WEIGHTS.items()},
+}
+
+
+def _parse_weights(stages: dict) -> dict[str, StageWeights]:
+    weights = {}
+    for stage, (first, boost) in stages.items():
+        if stage not in STAGES:
+            raise ValueError(f"Unknown recommendation stage {stage!r} (expected one of {', '.join(STAGES)})")
+        weights[stage] = StageWeights(float(first), float(boost))
+    return weights
+
+
+def load_profiles(text: str | None) -> dict[str, dict[str, StageWeights]]:
+    """
+    Weight profiles per age group: the defaults, overridden by a JSON object such as
+    {"kid": {"similarity": [1.2, 0.5]}, "default": {"text": [0.6, 0.3]}} (stage -> [first, boost]).
+    "default" overrides apply to every group; a group's own entries take precedence.
+    """
+    overrides = json.loads(text) if text else {}
+    if not isinstance(overrides, dict):
+        raise ValueError("Fusion weights must be a JSON object of age group -> stage weights")
+    default = {**DEFAULT_PROFILE, **_parse_weights(overrides.get(DEFAULT_GROUP, {}))}
+    profiles = {DEFAULT_GROUP: default}
+    for group in (set(_GROUP_WEIGHTS) | set(overrides)) - {DEFAULT_GROUP}:
+        profiles[group] = {**default, **_GROUP_WEIGHTS.get(group, {}), **_parse_weights(overrides.get(group, {}))}
+    return profiles
+
+
+def profile_for(profiles: dict[str, dict[str, StageWeights]], age_group: str | None) -> dict[str, StageWeights]:
+    return profiles.get(age_group) or profiles[DEFAULT_GROUP]
+
+
+class CatalogIndex:
+    """
+    Dense positions 0..n-1 for the movie catalog (sorted by id) plus one boolean
+    age-appropriateness mask per age bracket, so stage outputs become score vectors over
+    catalog positions and age filtering is a mask lookup.
+    """
+
+    def __init__(self, movie_ids: Iterable[int], age_masks: dict[str, Sequence[bool]] | None = None, version: int = 0):
+        movie_ids = np.asarray(list(movie_ids), dtype=np.int64)
+        order = np.argsort(movie_ids, kind="stable")
+        self.movie_ids = movie_ids[order]
+        self.age_masks = {bracket: np.asarray(mask, dtype=bool)[order] for bracket, mask in (age_masks or {}).items()}
+        self.version = version
+
+    def __len__(self) -> int:
+        return len(self.movie_ids)
+
+    def positions(self, movie_ids: Iterable[int]) -> np.ndarray:
+        """Catalog position of each id, -1 for ids not in the catalog."""
+        movie_ids = np.asarray(list(movie_ids), dtype=np.int64)
+        if not len(self.movie_ids):
+            return np.full(len(movie_ids), -1, dtype=np.int64)
+        positions = np.searchsorted(self.movie_ids, movie_ids)
+        positions[positions >= len(self.movie_ids)] = 0
+        return np.where(self.movie_ids[positions] == movie_ids, positions, -1)
+
+    def age_mask(self, bracket: str | None) -> np.ndarray | None:
+        """Mask of movies appropriate for the bracket (None when every movie is)."""
+        return self.age_masks.get(bracket)
+
+
+class StageScores(NamedTuple):
+    """One stage's output as a sparse vector: catalog positions and their scores, best first."""
+
+    name: str
+    positions: np.ndarray
+    values: np.ndarray
+    age_filtered: bool = True  # Hits outside the age mask are dropped before fusion
+
+
+class FusedScores(NamedTuple):
+    positions: np.ndarray  # Catalog positions of every movie any stage produced
+    scores: np.ndarray  # Uncapped fused score of each
+    order: np.ndarray  # When each was first produced (stage order, then rank within the stage)
+
+
+def fuse(stages: Sequence[StageScores], profile: dict[str, StageWeights], allowed: np.ndarray | None = None) -> FusedScores:
+    """
+    Weighted sum of the stage vectors, scattered into dense arrays over catalog positions.
+
+    A hit contributes value * first weight when no earlier stage produced the movie and
+    value * boost weight otherwise. Only the first occurrence of a movie within a stage
+    counts, and unknown positions (-1) are ignored.
+    """
+    kept = []
+    for stage in stages:
+        positions = np.asarray(stage.positions, dtype=np.int64)
+        values = np.asarray(stage.values, dtype=np.float64)
+        keep = positions >= 0
+        if stage.age_filtered and allowed is not None:
+            keep &= allowed[np.where(keep, positions, 0)]
+        kept.append((profile[stage.name], positions[keep], values[keep]))
+
+    size = max((int(positions.max()) + 1 for _w, positions, _v in kept if len(positions)), default=0)
+    scores = np.zeros(size, dtype=np.float64)
+    seen = np.zeros(size, dtype=bool)
+    order = np.zeros(size, dtype=np.int64)
+    next_order = 0
+    for weights, positions, values in kept:
+        ordered = np.sort(positions)
+        if (ordered[1:] == ordered[:-1]).any():
+            _unique, first = np.unique(positions, return_index=True)
+            first.sort()
+            positions, values = positions[first], values[first]
+        hit_before = seen[positions]
+        # Stages are added one after another, matching the sequential dict updates this replaces
+        scores[positions] += values * np.where(hit_before, weights.boost, weights.first)
+        new = positions[~hit_before]
+        order[new] = np.arange(next_order, next_order + len(new))
+        next_order += len(new)
+        seen[positions] = True
+
+    union = np.flatnonzero(seen)
+    return FusedScores(union, scores[union], order[union])
+
+
+def top_k(fused: FusedScores, k: int, window: int | None = None, allowed: np.ndarray | None = None) -> np.ndarray:
+    """
+    Indexes into `fused` of the best k movies, highest score first with ties in insertion order.
+
+    The best `window` (default k) are selected first and only then filtered by the `allowed`
+    catalog mask, so filtered movies still take their place in the window.
+    """
+    count = len(fused.scores)
+    window = min(k if window is None else window, count)
+    if window <= 0:
+        return np.empty(0, dtype=np.int64)
+    if window < count:
+        # Keep every score tied with the window-th best so the tie-break below sees all of them
+        partition = np.argpartition(-fused.scores, window - 1)
+        threshold = fused.scores[partition[window - 1]]
+        candidates = np.flatnonzero(fused.scores >= threshold)
+    else:
+        candidates = np.arange(count)
+    ranked = candidates[np.lexsort((fused.order[candidates], -fused.scores[candidates]))][:window]
+    if allowed is not None:
+        ranked = ranked[allowed[fused.positions[ranked]]]
+    return ranked[:k]
@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Any
+
+import numpy as np
+
+
+_MAGIC = b"SHARR001"
+_HEADER_LEN = struct.Struct("<Q")
+_ALIGN = 64
+
+
+def _aligned(size: int) -> int:
+    return -(-size // _ALIGN) * _ALIGN
+
+
+def write_arrays(path: str, arrays: dict[str, np.ndarray], meta: dict[str, Any] | None = None) -> None:
+    """
+    Write named 1-D/2-D arrays into one file (JSON header + 64-byte aligned raw data).
+
+    The file is written next to `path` and moved into place with os.replace, so readers
+    either map the complete old file or the complete new one.
+    """
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += _aligned(array.nbytes)
+    header = json.dumps({"arrays": layout, "meta": meta or {}}).encode("utf-8")
+    data_start = _aligned(len(_MAGIC) + _HEADER_LEN.size + len(header))
+
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "wb") as fh:
+        fh.write(_MAGIC + _HEADER_LEN.pack(len(header)) + header)
+        for name, array in arrays.items():
+            fh.seek(data_start + layout[name]["offset"])
+            fh.write(np.ascontiguousarray(array).tobytes())
+        fh.truncate(data_start + offset)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+
+
+def map_arrays(path: str) -> tuple[dict[str, np.ndarray], dict[str, Any]]:
+    """
+    Memory-map a file written by write_arrays read-only.
+
+    The returned arrays are views of one shared mapping: every process mapping the same file
+    shares the same physical pages, and the mapping stays valid after the file is replaced
+    or deleted.
+    """
+    with open(path, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            raise ValueError(f"{path} is empty")
+        buffer = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(_MAGIC)] != _MAGIC:
+        raise ValueError(f"{path} is not a shared array file")
+    (header_len,) = _HEADER_LEN.unpack_from(buffer, len(_MAGIC))
+    header_start = len(_MAGIC) + _HEADER_LEN.size
+    header = json.loads(bytes(buffer[header_start:header_start + header_len]))
+    data_start = _aligned(header_start + header_len)
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        shape = tuple(spec["shape"])
+        count = int(np.prod(shape)) if shape else 1
+        arrays[name] = np.frombuffer(
+            buffer, dtype=dtype, count=count, offset=data_start + spec["offset"]
+        ).reshape(shape)
+    return arrays, header.get("meta", {})
+
+
+class Generation:
+    """One published, immutable version of an artifact. Hold on to it for a consistent read."""
+
+    def __init__(self, number: int, arrays: dict[str, np.ndarray], meta: dict[str, Any]):
+        self.number = number
+        self.arrays = arrays
+        self.meta = meta
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+
+class SharedArtifact:
+    """
+    A named set of arrays published in generations under `directory`.
+
+    publish() writes `<name>.<generation>.bin` and then atomically swaps the `<name>.current`
+    pointer; current() re-reads the pointer (one stat call) and maps the new generation when
+    it changed. Workers attached to an older generation keep reading it until they ask again,
+    so a background rebuild never causes torn reads and never requires a restart.
+    """
+
+    # Generations kept on disk besides the current one, for readers that are about to open them
+    KEEP_PREVIOUS = 1
+
+    def __init__(self, directory: str, name: str):
+        self.directory = directory
+        self.name = name
+        self.pointer_path = os.path.join(directory, f"{name}.current")
+        self._generation: Generation | None = None
+        self._pointer_stat: tuple[int, int] | None = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _read_pointer(self) -> dict[str, Any] | None:
+        try:
+            with open(self.pointer_path, "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return None
+
+    def publish(self, arrays: dict[str, np.ndarray], meta: dict[str, Any] | None = None) -> int:
+        """Write a new generation and make it current; returns its generation number."""
+        pointer = self._read_pointer()
+        number = (pointer["generation"] + 1) if pointer else 1
+        file_name = f"{self.name}.{number}.{os.getpid()}.bin"
+        write_arrays(os.path.join(self.directory, file_name), arrays, meta)
+
+        tmp_pointer = f"{self.pointer_path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_pointer, "w", encoding="utf-8") as fh:
+            json.dump({"generation": number, "file": file_name}, fh)
+        os.replace(tmp_pointer, self.pointer_path)
+        self._remove_old_generations(number)
+        return number
+
+    def _remove_old_generations(self, current: int) -> None:
+        files = []
+        for path in glob.glob(os.path.join(self.directory, f"{self.name}.*.bin")):
+            try:
+                files.append((int(os.path.basename(path).split(".")[-3]), path))
+            except ValueError:
+                continue
+        keep_from = current - self.KEEP_PREVIOUS
+        for number, path in files:
+            if number < keep_from:
+                try:
+                    os.remove(path)  # Existing mappings stay valid (POSIX unlink semantics)
+                except OSError:
+                    pass  # Still mapped on a platform that forbids removing it; retried next time
+
+    def current(self) -> Generation | None:
+        """The current generation (None before the first publish)."""
+        with self._lock:
+            for _attempt in range(3):
+                try:
+                    st = os.stat(self.pointer_path)
+                except FileNotFoundError:
+                    return self._generation
+                pointer_stat = (st.st_ino, st.st_mtime_ns)
+                if pointer_stat == self._pointer_stat:
+                    return self._generation
+                pointer = self._read_pointer()
+                if pointer is None:
+                    return self._generation
+                try:
+                    arrays, meta = map_arrays(os.path.join(self.directory, pointer["file"]))
+                except FileNotFoundError:
+                    continue  # Superseded while we were opening it; read the pointer again
+                self._generation = Generation(pointer["generation"], arrays, meta)
+                self._pointer_stat = pointer_stat
+            return self._generation
+
+
+def memory_usage() -> dict[str, int]:
+    """Resident memory of this process in kB (Linux): rss, anonymous, file-backed and PSS."""
+    usage: dict[str, int] = {}
+    fields = {"VmRSS": "rss", "RssAnon": "anon", "RssFile": "file", "RssShmem": "shmem"}
+    try:
+        with open("/proc/self/status", encoding="ascii") as fh:
+            for line in fh:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    usage[fields[key]] = int(value.split()[0])
+        with open("/proc/self/smaps_rollup", encoding="ascii") as fh:
+            for line in fh:
+                if line.startswith("Pss:"):
+                    usage["pss"] = int(line.split()[1])
+    except OSError:
+        pass
+    return usage
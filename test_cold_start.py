@@ -0,0 +1,108 @@
+import unittest
+
+from sqlalchemy import event, text
+
+from app_testing import m, make_user
+
+
+class TestColdStartCache(unittest.TestCase):
+    def setUp(self):
+        self.ctx = m.app.app_context()
+        self.ctx.push()
+        m._cold_start_cache.clear()
+        self.users = {name: make_user(f"cold-{name}", age=age).id for name, age in (
+            ("adult", 30), ("adult2", 45), ("g_only", 5), ("g_only2", 3), ("kid", 10), ("kid2", 12))}
+        self.movie_id = None
+
+    def tearDown(self):
+        db = m.db
+        db.session.rollback()
+        if self.movie_id is not None:
+            db.session.delete(db.session.get(m.Movie, self.movie_id))
+        m.User.query.filter(m.User.id.in_(self.users.values())).delete()
+        db.session.commit()
+        for user_id in self.users.values():
+            m.invalidate_user_context(user_id)
+        m._cold_start_cache.clear()
+        db.session.remove()
+        self.ctx.pop()
+
+    def capture_statements(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(m.db.engine, "before_cursor_execute", before_cursor_execute)
+        self.addCleanup(event.remove, m.db.engine, "before_cursor_execute", before_cursor_execute)
+        return statements
+
+    def recommend(self, name):
+        return [(movie.id, score) for movie, score in m.get_recommendations(self.users[name], num_recommendations=8)]
+
+    def test_second_user_in_bracket_is_served_from_cache(self):
+        first = self.recommend("adult")
+        self.assertEqual(len(first), 8)
+        context = m.get_user_context(self.users["adult2"])
+        statements = self.capture_statements()
+        cached = m.get_recommendations(self.users["adult2"], num_recommendations=8, context=context)
+        # Only the shared catalog version is read
+        self.assertEqual(len(statements), 1)
+        self.assertIn("catalog_version", statements[0])
+        self.assertEqual([(movie.id, score) for movie, score in cached], first)
+        # The cached movies are usable in this session without another query
+        self.assertTrue(all(movie in m.db.session for movie, _score in cached))
+        self.assertTrue(all(movie.title for movie, _score in cached))
+        self.assertEqual(len(statements), 1)
+
+    def test_brackets_are_cached_separately(self):
+        g_only = self.recommend("g_only")
+        kid = self.recommend("kid")
+        self.assertNotEqual(g_only, kid)
+        self.assertEqual({key[0] for key in m._cold_start_cache}, {"g_only", "kid"})
+        # Each bracket's next user gets that bracket's list
+        self.assertEqual(self.recommend("kid2"), kid)
+        self.assertEqual(self.recommend("g_only2"), g_only)
+        # The best-scored picks are filtered by the bracket's own age mask (G only up to 7)
+        age_ratings = dict(m.db.session.query(m.Movie.id, m.Movie.age_rating))
+        self.assertEqual({age_ratings[movie_id] for movie_id, score in g_only if score == 1.0}, {"G"})
+        self.assertIn("PG", {age_ratings[movie_id] for movie_id, score in kid if score == 1.0})
+
+    def assert_recomputed(self):
+        statements = self.capture_statements()
+        self.recommend("adult2")
+        self.assertTrue(statements)
+
+    def test_movie_insert_invalidates(self):
+        self.recommend("adult")
+        movie = m.Movie(title="Cold Start Newcomer", genre="Drama", year=2024, age_rating="PG")
+        m.db.session.add(movie)
+        m.db.session.commit()
+        self.movie_id = movie.id
+        self.assertEqual(m._cold_start_cache, {})
+        self.assert_recomputed()
+
+    def test_change_from_another_worker_invalidates(self):
+        self.recommend("adult")
+        # Another worker's movie change only reaches this one through the shared catalog version
+        m.db.session.execute(text("UPDATE catalog_version SET version = version + 1"))
+        m.db.session.commit()
+        self.assertTrue(m._cold_start_cache)
+        self.assert_recomputed()
+
+    def test_movie_update_invalidates(self):
+        movie_id = self.recommend("adult")[0][0]
+        movie = m.db.session.get(m.Movie, movie_id)
+        year = movie.year
+        movie.year = year + 1
+        m.db.session.commit()
+        try:
+            self.assertEqual(m._cold_start_cache, {})
+            self.assert_recomputed()
+        finally:
+            m.db.session.get(m.Movie, movie_id).year = year
+            m.db.session.commit()
+
+
+if __name__ == "__main__":
+    unittest.main()
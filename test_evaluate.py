@@ -0,0 +1,79 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from evaluate import catalog_coverage, ndcg_at_k, precision_at_k, recall_at_k, score, time_split
+
+
+class TestMetrics(unittest.TestCase):
+    def test_precision_and_recall(self):
+        recommended = [1, 2, 3, 4]
+        relevant = {2, 4, 9}
+        self.assertAlmostEqual(precision_at_k(recommended, relevant, 4), 0.5)
+        self.assertAlmostEqual(precision_at_k(recommended, relevant, 2), 0.5)
+        self.assertAlmostEqual(recall_at_k(recommended, relevant, 4), 2 / 3)
+        self.assertEqual(recall_at_k(recommended, set(), 4), 0.0)
+
+    def test_ndcg(self):
+        self.assertAlmostEqual(ndcg_at_k([1, 2], {1, 2}, 2), 1.0)
+        self.assertAlmostEqual(ndcg_at_k([5, 1], {1}, 2), 1 / 1.584962500721156)
+        self.assertEqual(ndcg_at_k([5, 6], {1}, 2), 0.0)
+
+    def test_coverage(self):
+        self.assertAlmostEqual(catalog_coverage([[1, 2, 3], [2, 4]], 10, 2), 0.3)
+        self.assertEqual(catalog_coverage([[1]], 0, 2), 0.0)
+
+    def test_score(self):
+        results = [(1, [10, 11], 0.01), (2, [12, 13], 0.03)]
+        report = score(results, {1: {10}, 2: {99}}, catalog_size=8, k=2, elapsed=2.0)
+        self.assertEqual(report["users"], 2)
+        self.assertAlmostEqual(report["precision@2"], 0.25)
+        self.assertAlmostEqual(report["recall@2"], 0.5)
+        self.assertAlmostEqual(report["coverage"], 0.5)
+        self.assertAlmostEqual(report["latency"]["p50_ms"], 20.0)
+        self.assertAlmostEqual(report["users_per_sec"], 1.0)
+
+
+class TestTimeSplit(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "db.sqlite")
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE rating (id INTEGER PRIMARY KEY, user_id INTEGER, movie_id INTEGER, "
+                     "rating FLOAT, created_at DATETIME)")
+        conn.execute("CREATE TABLE trending_score (movie_id INTEGER)")
+        conn.executemany("INSERT INTO rating (user_id, movie_id, rating, created_at) VALUES (?, ?, ?, ?)", [
+            (1, 10, 5.0, "2026-01-01 00:00:00"),
+            (2, 10, 4.0, "2026-01-02 00:00:00"),
+            (1, 11, 3.0, "2026-01-03 00:00:00"),
+            (1, 12, 5.0, "2026-01-04 00:00:00"),
+            (2, 13, 2.0, "2026-01-05 00:00:00"),
+        ])
+        conn.execute("INSERT INTO trending_score VALUES (10)")
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_newest_ratings_are_held_out(self):
+        cutoff, relevant = time_split(self.path, 0.4, 4.0)
+        self.assertEqual(cutoff, "2026-01-04 00:00:00")
+        # Only the held-out rating above the threshold counts as relevant
+        self.assertEqual(relevant, {1: {12}})
+        conn = sqlite3.connect(self.path)
+        remaining = conn.execute("SELECT movie_id FROM rating ORDER BY id").fetchall()
+        trending = conn.execute("SELECT COUNT(*) FROM trending_score").fetchone()[0]
+        conn.close()
+        self.assertEqual(remaining, [(10,), (10,), (11,)])
+        self.assertEqual(trending, 0)
+
+    def test_nothing_to_hold_out(self):
+        with self.assertRaises(ValueError):
+            time_split(self.path, 0.0, 4.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
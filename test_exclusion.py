@@ -0,0 +1,110 @@
+import unittest
+
+from sqlalchemy import event
+
+from app_testing import m
+
+
+POWER_USER_RATINGS = 50000
+
+
+class TestPowerUserExclusion(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.ctx = m.app.app_context()
+        cls.ctx.push()
+        db = m.db
+        seeded_ids = [movie_id for (movie_id,) in db.session.query(m.Movie.id)]
+        first_id = max(seeded_ids) + 1
+        db.session.execute(m.Movie.__table__.insert(), [
+            {"id": movie_id, "title": f"Catalog {movie_id}", "genre": "Drama", "year": 2000 + movie_id % 20,
+             "director": "Someone", "age_rating": "PG"}
+            for movie_id in range(first_id, first_id + POWER_USER_RATINGS)
+        ])
+
+        power = m.User(username="power", email="power@x.com", password_hash="x", age=25)
+        others = [m.User(username=f"u{i}", email=f"u{i}@x.com", password_hash="x", age=15 + i) for i in range(4)]
+        db.session.add_all([power] + others)
+        db.session.flush()
+        cls.power_id = power.id
+        cls.user_ids = [user.id for user in [power] + others]
+        cls.new_movie_ids = (first_id, first_id + POWER_USER_RATINGS)
+        cls.rated = set(range(first_id, first_id + POWER_USER_RATINGS))
+        db.session.execute(m.Rating.__table__.insert(), [
+            {"user_id": power.id, "movie_id": movie_id, "rating": 1.0 + movie_id % 5}
+            for movie_id in sorted(cls.rated)
+        ])
+        db.session.execute(m.Rating.__table__.insert(), [
+            {"user_id": user.id, "movie_id": movie_id, "rating": 4.0}
+            for user in others for movie_id in seeded_ids[:6] + [first_id, first_id + 1]
+        ])
+        db.session.commit()
+        cls.unrated = set(seeded_ids)
+        m.rebuild_rating_store()
+        m.refresh_trending()  # Requests only refresh once per TRENDING_REFRESH_SECONDS
+
+    @classmethod
+    def tearDownClass(cls):
+        # The database is shared with the other app tests: drop the power user and the bulk catalog
+        db = m.db
+        db.session.rollback()
+        m.Rating.query.filter(m.Rating.user_id.in_(cls.user_ids)).delete(synchronize_session=False)
+        m.User.query.filter(m.User.id.in_(cls.user_ids)).delete(synchronize_session=False)
+        m.Movie.query.filter(m.Movie.id >= cls.new_movie_ids[0], m.Movie.id < cls.new_movie_ids[1]).delete(
+            synchronize_session=False)
+        m.bump_catalog_version()  # Bulk deletes bypass the Movie mapper events
+        db.session.commit()
+        for user_id in cls.user_ids:
+            m.invalidate_user_context(user_id)
+        m.rebuild_rating_store()
+        db.session.remove()
+        cls.ctx.pop()
+
+    def setUp(self):
+        m.invalidate_user_context(self.power_id)
+
+    def capture_statements(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        event.listen(m.db.engine, "before_cursor_execute", before_cursor_execute)
+        self.addCleanup(event.remove, m.db.engine, "before_cursor_execute", before_cursor_execute)
+        return statements
+
+    def test_recommendations_skip_rated_movies(self):
+        recommendations = m.get_recommendations(self.power_id, num_recommendations=10)
+        self.assertEqual(len(recommendations), 10)
+        self.assertFalse({movie.id for movie, _score in recommendations} & self.rated)
+
+    def test_statement_size_does_not_grow_with_rated_movies(self):
+        statements = self.capture_statements()
+        m.get_recommendations(self.power_id, num_recommendations=10)
+        self.assertTrue(statements)
+        self.assertLess(max(len(parameters) for _statement, parameters in statements), 200)
+        self.assertLess(max(len(statement) for statement, _parameters in statements), 5000)
+
+    def test_exclude_movies_is_an_anti_join(self):
+        extra = sorted(self.unrated)[:2]
+        ids = {movie_id for (movie_id,) in m.db.session.query(m.Movie.id).filter(
+            m.exclude_movies(self.power_id, extra))}
+        self.assertEqual(ids, self.unrated - set(extra))
+        self.assertEqual(m.Movie.query.filter(m.exclude_movies()).count(), len(self.rated | self.unrated))
+
+    def test_fallback_stages_exclude_rated_movies(self):
+        age_based = m.get_age_based_recommendations(25, [], 10, rated_by=self.power_id)
+        trending = m.get_trending_movies(25, [], 10, rated_by=self.power_id)
+        self.assertTrue(age_based)
+        self.assertTrue(trending)
+        self.assertFalse({movie.id for movie in age_based + trending} & self.rated)
+
+    def test_similarity_stage_is_bounded(self):
+        context = m.get_user_context(self.power_id)
+        recommendations = m.get_similarity_based_recommendations(context, 10)
+        self.assertTrue(recommendations)
+        self.assertFalse({movie.id for movie, _score in recommendations} & self.rated)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import gzip
+import json
+import logging
+import unittest
+from datetime import datetime
+
+from app_testing import client_for, m, make_user
+from export import ThroughputMeter, gzip_chunks, ndjson_chunks
+
+
+ROWS = [
+    {"id": 1, "rating": 4.5, "created_at": datetime(2024, 1, 2, 3, 4, 5)},
+    {"id": 2, "rating": 3.0, "created_at": None},
+    {"id": 3, "rating": 5.0, "created_at": datetime(2024, 2, 1)},
+]
+
+
+class TestNdjsonChunks(unittest.TestCase):
+    def test_one_json_object_per_line(self):
+        body = b"".join(ndjson_chunks(ROWS, chunk_rows=2))
+        lines = body.decode("utf-8").splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], [1, 2, 3])
+        self.assertEqual(json.loads(lines[0])["created_at"], "2024-01-02T03:04:05")
+        self.assertTrue(body.endswith(b"\n"))
+
+    def test_chunking(self):
+        chunks = list(ndjson_chunks(ROWS, chunk_rows=2))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(list(ndjson_chunks([], chunk_rows=2)), [])
+
+    def test_is_lazy(self):
+        def rows():
+            yield {"id": 1}
+            raise AssertionError("consumed more rows than needed")
+
+        chunks = ndjson_chunks(rows(), chunk_rows=1)
+        self.assertEqual(next(chunks), b'{"id":1}\n')
+
+    def test_meter_counts_rows(self):
+        meter = ThroughputMeter()
+        list(ndjson_chunks(ROWS, meter))
+        self.assertEqual(meter.rows, 3)
+        self.assertIsNotNone(meter.finished)
+        self.assertGreater(meter.rows_per_sec, 0)
+        self.assertIn("3 ratings", meter.summary("ratings"))
+
+
+class TestGzipChunks(unittest.TestCase):
+    def test_round_trip(self):
+        plain = b"".join(ndjson_chunks(ROWS, chunk_rows=1))
+        compressed = b"".join(gzip_chunks(ndjson_chunks(ROWS, chunk_rows=1)))
+        self.assertEqual(gzip.decompress(compressed), plain)
+
+    def test_empty_stream_is_valid_gzip(self):
+        self.assertEqual(gzip.decompress(b"".join(gzip_chunks([]))), b"")
+
+
+class TestExportEndpoints(unittest.TestCase):
+    TOKEN = "test-export-token"
+
+    @classmethod
+    def setUpClass(cls):
+        with m.app.app_context():
+            user = make_user("exporter", age=30)
+            cls.user_id = user.id
+            movie_ids = [movie_id for (movie_id,) in m.db.session.query(m.Movie.id).order_by(m.Movie.id).limit(2)]
+            m.db.session.add_all([
+                m.Rating(user_id=user.id, movie_id=movie_ids[0], rating=4.0, review="private note"),
+                m.Rating(user_id=user.id, movie_id=movie_ids[1], rating=2.0),
+            ])
+            m.db.session.commit()
+            cls.rating_ids = [rating_id for (rating_id,) in m.db.session.query(m.Rating.id).filter_by(user_id=user.id)]
+
+    @classmethod
+    def tearDownClass(cls):
+        with m.app.app_context():
+            m.Rating.query.filter_by(user_id=cls.user_id).delete()
+            m.User.query.filter_by(id=cls.user_id).delete()
+            m.db.session.commit()
+
+    def setUp(self):
+        self.previous_token = m.app.config["EXPORT_TOKEN"]
+        m.app.config["EXPORT_TOKEN"] = self.TOKEN
+        self.addCleanup(m.app.config.__setitem__, "EXPORT_TOKEN", self.previous_token)
+        self.client = client_for(self.user_id)
+
+    def get(self, path, token=TOKEN):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        return self.client.get(path, headers=headers)
+
+    def test_logged_in_user_without_token_is_forbidden(self):
+        for path in ("/api/export/ratings", "/api/export/movies"):
+            with self.subTest(path=path):
+                self.assertEqual(self.get(path, token=None).status_code, 403)
+                self.assertEqual(self.get(path, token="wrong").status_code, 403)
+
+    def test_disabled_without_configured_token(self):
+        m.app.config["EXPORT_TOKEN"] = None
+        self.assertEqual(self.get("/api/export/ratings").status_code, 403)
+
+    def test_streams_ratings(self):
+        response = self.get(f"/api/export/ratings?since_id={self.rating_ids[0] - 1}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        mine = [row for row in rows if row["user_id"] == self.user_id]
+        self.assertEqual([row["id"] for row in mine], self.rating_ids)
+        self.assertEqual(mine[0]["review"], "private note")
+
+    def test_streams_movies_gzipped(self):
+        response = self.get("/api/export/movies?gzip=1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        rows = [json.loads(line) for line in gzip.decompress(response.get_data()).decode("utf-8").splitlines()]
+        with m.app.app_context():
+            self.assertEqual(len(rows), m.Movie.query.count())
+        self.assertEqual([row["id"] for row in rows], sorted(row["id"] for row in rows))
+
+    def test_logs_throughput(self):
+        # Emitted with the default configuration, not only under assertLogs
+        self.assertTrue(m.export_logger.isEnabledFor(logging.INFO))
+        with self.assertLogs(m.export_logger, logging.INFO) as logs:
+            self.get("/api/export/ratings").get_data()
+        self.assertEqual(len(logs.records), 1)
+        self.assertRegex(logs.output[0], r"Exported \d+ ratings in .* rows/sec")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from unittest import mock
+
+from sqlalchemy import text
+
+from app_testing import client_for, m, make_user
+
+
+class TestConditionalRequests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with m.app.app_context():
+            cls.user_id = make_user("etag", age=30).id
+            cls.movie_id = m.db.session.query(m.db.func.min(m.Movie.id)).scalar()
+
+    @classmethod
+    def tearDownClass(cls):
+        with m.app.app_context():
+            m.Rating.query.filter_by(user_id=cls.user_id).delete()
+            m.Preference.query.filter_by(user_id=cls.user_id).delete()
+            m.UserDataVersion.query.filter_by(user_id=cls.user_id).delete()
+            m.User.query.filter_by(id=cls.user_id).delete()
+            m.db.session.commit()
+            m.invalidate_user_context(cls.user_id)
+
+    def setUp(self):
+        # Keep the whole test inside one recommendation time bucket
+        patcher = mock.patch.object(m, "RECOMMENDATION_ETAG_SECONDS", 10 ** 9)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = client_for(self.user_id)
+
+    def get(self, path, etag=None):
+        headers = {"If-None-Match": f'"{etag}"'} if etag else {}
+        return self.client.get(path, headers=headers)
+
+    def get_page(self, path, etag=None):
+        # The HTML templates are not part of these tests
+        with mock.patch.object(m, "render_template", return_value="page"):
+            return self.get(path, etag)
+
+    def assert_modified(self, response, old_etag):
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], old_etag)
+
+    def test_matching_etag_returns_304(self):
+        first = self.get("/api/recommendations")
+        self.assertEqual(first.status_code, 200)
+        etag = first.get_etag()[0]
+        with mock.patch.object(m, "get_recommendations") as get_recommendations:
+            second = self.get("/api/recommendations", etag)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.data, b"")
+        self.assertEqual(second.get_etag()[0], etag)
+        get_recommendations.assert_not_called()
+        # A different ETag is a full response
+        self.assertEqual(self.get("/api/recommendations", "stale").status_code, 200)
+
+    def test_cache_headers(self):
+        for response, cache_control in (
+            (self.get("/api/recommendations"), "private, no-cache"),
+            (self.get_page("/movies"), f"private, max-age={m.CATALOG_MAX_AGE_SECONDS}"),
+        ):
+            with self.subTest(path=response.request.path):
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.headers["Cache-Control"], cache_control)
+                self.assertIn("Cookie", response.vary)
+                not_modified = self.get(response.request.path, response.get_etag()[0])
+                self.assertEqual(not_modified.status_code, 304)
+                self.assertEqual(not_modified.headers["Cache-Control"], cache_control)
+                self.assertIn("Cookie", not_modified.vary)
+
+    def test_rating_changes_etag(self):
+        etag = self.get("/api/recommendations").get_etag()[0]
+        response = self.client.post("/rate_movie", data={"movie_id": self.movie_id, "rating": "4"})
+        self.assertEqual(response.status_code, 302)
+        self.assert_modified(self.get("/api/recommendations", etag), etag)
+
+    def test_preferences_change_etag(self):
+        etag = self.get("/api/recommendations").get_etag()[0]
+        response = self.client.post("/preferences", data={"genres": ["Drama"]})
+        self.assertEqual(response.status_code, 302)
+        self.assert_modified(self.get("/api/recommendations", etag), etag)
+
+    def test_movie_edit_changes_catalog_etag(self):
+        etag = self.get_page("/movies").get_etag()[0]
+        self.assertEqual(self.get("/movies", etag).status_code, 304)
+        with m.app.app_context():
+            movie = m.Movie.query.get(self.movie_id)
+            description = movie.description
+            movie.description = "Edited"
+            m.db.session.commit()
+        try:
+            # Neither the movie count nor the highest id changed
+            self.assert_modified(self.get_page("/movies", etag), etag)
+        finally:
+            with m.app.app_context():
+                m.Movie.query.get(self.movie_id).description = description
+                m.db.session.commit()
+
+    def test_change_from_another_worker_changes_etag(self):
+        etag = self.get_page("/movies").get_etag()[0]
+        # Another worker's movie change only reaches this one through the database
+        with m.app.app_context():
+            m.db.session.execute(text("UPDATE catalog_version SET version = version + 1"))
+            m.db.session.commit()
+        self.assert_modified(self.get_page("/movies", etag), etag)
+
+
+if __name__ == "__main__":
+    unittest.main()
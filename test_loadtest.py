@@ -0,0 +1,73 @@
+import unittest
+
+from loadtest import classify_exception, format_comparison, parse_mix, summarize, summarize_server_log
+
+
+GUNICORN_LOG = """\
+[2026-01-01 10:00:00 +0000] [12] [ERROR] Exception on /rate_movie [POST]
+Traceback (most recent call last):
+  File "sqlalchemy/engine/base.py", line 1967, in _exec_single_context
+    self.dialect.do_execute(
+sqlite3.OperationalError: database is locked
+
+The above exception was the direct cause of the following exception:
+
+Traceback (most recent call last):
+  File "flask/app.py", line 917, in full_dispatch_request
+sqlalchemy.exc.OperationalError: (sqlite3.OperationalError) database is locked
+[SQL: INSERT INTO rating (user_id, movie_id) VALUES (?, ?)]
+[2026-01-01 10:00:01 +0000] [13] [ERROR] Exception on /dashboard [GET]
+Traceback (most recent call last):
+  File "jinja2/loaders.py", line 126, in load
+jinja2.exceptions.TemplateNotFound: dashboard.html
+"""
+
+
+class TestParseMix(unittest.TestCase):
+    def test_weights(self):
+        self.assertEqual(parse_mix("movies=3, dashboard=1"), {"movies": 3.0, "dashboard": 1.0})
+
+    def test_unknown_route(self):
+        with self.assertRaises(ValueError):
+            parse_mix("movies=1,admin=2")
+
+    def test_needs_a_positive_weight(self):
+        with self.assertRaises(ValueError):
+            parse_mix("movies=0")
+
+
+class TestServerErrors(unittest.TestCase):
+    def test_classify(self):
+        self.assertEqual(classify_exception("sqlite3.OperationalError: database is locked"),
+                         "sqlite: database is locked")
+        self.assertEqual(classify_exception("jinja2.exceptions.TemplateNotFound: x.html"),
+                         "jinja2.exceptions.TemplateNotFound")
+
+    def test_log_counts_each_failed_request_once(self):
+        counts = summarize_server_log(GUNICORN_LOG)
+        self.assertEqual(counts, {"sqlite: database is locked": 1, "jinja2.exceptions.TemplateNotFound": 1})
+
+
+class TestSummary(unittest.TestCase):
+    def setUp(self):
+        samples = [{"route": "movies", "latency": i / 1000.0, "status": 200, "error": None} for i in range(1, 101)]
+        samples.append({"route": "rate_movie", "latency": 0.5, "status": 500, "error": "http_500"})
+        self.summary = summarize(samples, elapsed=10.0)
+
+    def test_percentiles_and_rates(self):
+        movies = self.summary["routes"]["movies"]
+        self.assertAlmostEqual(movies["p50_ms"], 50.5)
+        self.assertAlmostEqual(movies["p99_ms"], 99.01)
+        self.assertEqual(movies["errors"], 0)
+        self.assertAlmostEqual(self.summary["throughput"], 10.1)
+        self.assertEqual(self.summary["routes"]["rate_movie"]["error_kinds"], {"http_500": 1})
+        self.assertAlmostEqual(self.summary["error_rate"], 1 / 101)
+
+    def test_comparison_lists_shared_routes(self):
+        report = format_comparison(self.summary, self.summary)
+        self.assertIn("movies", report)
+        self.assertIn("+0.0%", report)
+
+
+if __name__ == "__main__":
+    unittest.main()
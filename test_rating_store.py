@@ -0,0 +1,298 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from app_testing import m, make_user
+import rating_store
+from rating_store import RatingArrays, RatingStore
+
+
+def sample_arrays():
+    # (user, movie, rating, ts); user 1 rates movie 10 twice, the later record wins
+    records = [
+        (2, 30, 4.0, 100),
+        (1, 10, 1.0, 101),
+        (1, 20, 5.0, 102),
+        (3, 10, 3.5, 103),
+        (1, 10, 2.0, 104),
+    ]
+    return RatingArrays.from_records(*zip(*records), meta={"source": "test"})
+
+
+class TestRatingArrays(unittest.TestCase):
+    def test_sorted_by_user_with_last_write_winning(self):
+        arrays = sample_arrays()
+        self.assertEqual(len(arrays), 4)
+        self.assertEqual(arrays.users.tolist(), [1, 1, 2, 3])
+        self.assertEqual(arrays.user_ids.tolist(), [1, 2, 3])
+        self.assertEqual(arrays.user_offsets.tolist(), [0, 2, 3, 4])
+        movies, ratings = arrays.user_ratings(1)
+        self.assertEqual(dict(zip(movies.tolist(), ratings.tolist())), {10: 2.0, 20: 5.0})
+
+    def test_dtypes_are_compact(self):
+        arrays = sample_arrays()
+        self.assertEqual(arrays.users.dtype, np.int32)
+        self.assertEqual(arrays.movies.dtype, np.int32)
+        self.assertEqual(arrays.ratings.dtype, np.float32)
+        self.assertEqual(arrays.timestamps.dtype, np.uint32)
+
+    def test_by_movie_permutation(self):
+        users, ratings = sample_arrays().movie_ratings(10)
+        self.assertEqual(users.tolist(), [1, 3])
+        self.assertEqual(ratings.tolist(), [2.0, 3.5])
+        self.assertEqual(len(sample_arrays().movie_ratings(999)[0]), 0)
+
+    def test_unknown_user(self):
+        self.assertEqual(len(sample_arrays().user_ratings(42)[0]), 0)
+
+    def test_to_csr(self):
+        matrix, user_ids, movie_ids = sample_arrays().to_csr()
+        self.assertEqual(matrix.shape, (3, 3))
+        self.assertEqual(movie_ids.tolist(), [10, 20, 30])
+        self.assertEqual(matrix[0].toarray().tolist(), [[2.0, 5.0, 0.0]])
+
+    def test_csr_of_snapshot_shares_the_mapping(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "snapshot.bin")
+            sample_arrays().save(path)
+            loaded = RatingArrays.open(path)
+            matrix, _user_ids, _movie_ids = loaded.to_csr()
+            self.assertTrue(np.shares_memory(matrix.data, loaded.ratings))
+            self.assertTrue(np.shares_memory(matrix.indices, loaded.columns))
+            del loaded, matrix
+
+    def test_snapshot_round_trip_is_memory_mapped(self):
+        arrays = sample_arrays()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "snapshot.bin")
+            arrays.save(path)
+            loaded = RatingArrays.open(path)
+            self.assertEqual(loaded.meta, {"source": "test"})
+            self.assertFalse(loaded.users.flags.writeable)
+            for name in ("users", "movies", "ratings", "timestamps", "movie_perm", "movie_offsets"):
+                np.testing.assert_array_equal(getattr(loaded, name), getattr(arrays, name))
+            del loaded
+
+    def test_empty_arrays(self):
+        matrix, user_ids, _movie_ids = RatingArrays.empty().to_csr()
+        self.assertEqual(matrix.shape, (0, 0))
+        self.assertEqual(len(user_ids), 0)
+
+    def test_empty_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "snapshot.bin")
+            RatingArrays.empty().save(path)
+            self.assertEqual(len(RatingArrays.open(path)), 0)
+
+
+class TestRatingStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = RatingStore(self.tmp.name)
+        self.store.write_snapshot(sample_arrays())
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_append_is_visible_after_refresh(self):
+        self.store.append(1, 20, 3.0, 200)
+        self.store.append(4, 40, 4.5, 201)
+        self.assertEqual(self.store.user_ratings(4), {})
+        self.store.refresh()
+        self.assertEqual(self.store.pending, 2)
+        self.assertEqual(self.store.user_ratings(1), {10: 2.0, 20: 3.0})
+        self.assertEqual(self.store.user_ratings(4), {40: 4.5})
+        self.assertEqual(len(self.store), 5)
+        self.assertEqual(self.store.movie_ratings(40)[0].tolist(), [4])
+
+    def test_other_reader_sees_writes(self):
+        reader = RatingStore(self.tmp.name)
+        reader.refresh()
+        self.store.append(5, 50, 5.0, 300)
+        reader.refresh()
+        self.assertEqual(reader.user_ratings(5), {50: 5.0})
+
+    def test_compaction_folds_log_into_snapshot(self):
+        reader = RatingStore(self.tmp.name)
+        self.store.append(1, 20, 3.0, 200)
+        self.store.append(4, 40, 4.5, 201)
+        self.store.refresh()
+        self.assertEqual(self.store.compact(), 2)
+        self.assertEqual(self.store.pending, 0)
+        self.assertFalse(os.path.exists(self.store.log_path))
+
+        reader.refresh()
+        self.assertEqual(reader.pending, 0)
+        self.assertEqual(len(reader.snapshot), 5)
+        self.assertEqual(reader.user_ratings(1), {10: 2.0, 20: 3.0})
+
+    def test_appends_during_compaction_are_kept(self):
+        self.store.append(1, 20, 3.0, 200)
+        os.replace(self.store.log_path, self.store.compacting_log_path)  # compaction started
+        self.store.append(6, 60, 1.0, 202)
+        self.store.refresh()
+        self.assertEqual(self.store.user_ratings(1)[20], 3.0)
+        self.store.compact()
+        self.assertEqual(self.store.user_ratings(6), {60: 1.0})
+        self.assertEqual(self.store.user_ratings(1)[20], 3.0)
+
+    def test_user_similarities_match_cosine_of_merged_ratings(self):
+        self.store.append(1, 20, 3.0, 200)
+        self.store.append(4, 10, 4.5, 201)
+        self.store.append(4, 40, 2.0, 202)
+        self.store.refresh()
+        user_ids, similarities = self.store.user_similarities(1)
+
+        matrix, expected_ids, _movie_ids = self.store.arrays().to_csr()
+        dense = matrix.toarray().astype(np.float64)
+        dense /= np.linalg.norm(dense, axis=1, keepdims=True)
+        expected = dense @ dense[0]
+        order = np.argsort(user_ids)
+        self.assertEqual(user_ids[order].tolist(), expected_ids.tolist())
+        np.testing.assert_allclose(similarities[order], expected)
+
+    def test_user_similarities_of_unknown_user(self):
+        user_ids, similarities = self.store.user_similarities(42)
+        self.assertEqual(len(user_ids), 0)
+        self.assertEqual(len(similarities), 0)
+
+    def test_compact_if_needed(self):
+        self.store.append(1, 20, 3.0, 200)
+        self.store.refresh()
+        self.assertEqual(self.store.compact_if_needed(max_pending=10), 0)
+        self.assertEqual(self.store.compact_if_needed(max_pending=1), 1)
+
+    def test_compaction_lock_dies_with_its_holder(self):
+        # A marker left behind by a crashed compaction does not block later ones
+        open(self.store.compact_lock_path, "w").close()
+        self.store.append(1, 20, 3.0, 200)
+        self.store.refresh()
+        self.assertEqual(self.store.compact_if_needed(max_pending=1), 1)
+
+    @unittest.skipIf(rating_store.fcntl is None, "no flock on this platform")
+    def test_compaction_skipped_while_another_holds_the_lock(self):
+        self.store.append(1, 20, 3.0, 200)
+        self.store.refresh()
+        fd = rating_store._lock(self.store.compact_lock_path)
+        try:
+            self.assertEqual(self.store.compact_if_needed(max_pending=1), 0)
+        finally:
+            os.close(fd)
+        self.assertEqual(self.store.compact_if_needed(max_pending=1), 1)
+
+    @unittest.skipIf(rating_store.fcntl is None, "no flock on this platform")
+    def test_append_waits_while_the_log_is_swapped_out(self):
+        fd = rating_store._lock(self.store.log_lock_path)
+        writer = threading.Thread(target=self.store.append, args=(5, 50, 4.0, 300))
+        writer.start()
+        writer.join(0.2)
+        self.assertTrue(writer.is_alive())
+        os.close(fd)
+        writer.join()
+        self.store.refresh()
+        self.assertEqual(self.store.user_ratings(5), {50: 4.0})
+
+    def test_rebuild_waits_for_a_running_compaction(self):
+        self.store.append(1, 10, 3.0, 100)
+        fd = rating_store._lock(self.store.compact_lock_path)
+        rebuild = threading.Thread(target=self.store.write_snapshot, args=(RatingArrays.empty(),))
+        rebuild.start()
+        rebuild.join(0.2)
+        self.assertTrue(rebuild.is_alive())
+        # The compaction that held the lock finishes (and removes its log) before the rebuild deletes the logs
+        self.store._compact()
+        os.close(fd)
+        rebuild.join()
+        self.assertFalse(os.path.exists(self.store.log_path))
+        self.assertEqual(len(self.store), 0)
+
+    def test_appends_made_while_rebuilding_are_kept(self):
+        self.store.append(1, 10, 3.0, 100)
+        writer = threading.Thread(target=self.store.append, args=(5, 50, 4.0, 300))
+
+        def load():
+            # A rating committed after the source was read is appended while the rebuild runs
+            writer.start()
+            writer.join(0.2)
+            self.assertTrue(writer.is_alive())
+            return RatingArrays.from_records([1], [10], [3.0], [100])
+
+        self.store.rebuild(load)
+        writer.join()
+        self.store.refresh()
+        self.assertEqual(self.store.user_ratings(5), {50: 4.0})
+        self.assertEqual(self.store.user_ratings(1), {10: 3.0})
+        self.assertEqual(len(self.store), 2)
+
+
+class TestStoreMatchesDatabase(unittest.TestCase):
+    """The startup check that rebuilds a snapshot which no longer describes the Rating table."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.ctx = m.app.app_context()
+        self.ctx.push()
+        self.addCleanup(self.ctx.pop)
+        for patcher in (mock.patch.object(m, "RATING_STORE_DIR", self.tmp.name), mock.patch.object(m, "_rating_store", None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = make_user("store-check")
+        self.addCleanup(self.remove_user)
+        self.movie_ids = [movie_id for (movie_id,) in m.db.session.query(m.Movie.id).order_by(m.Movie.id).limit(3)]
+        self.rate(self.movie_ids[0], 4.0)
+        self.store = m.get_rating_store()
+
+    def remove_user(self):
+        m.db.session.rollback()
+        m.Rating.query.filter_by(user_id=self.user.id).delete()
+        m.User.query.filter_by(id=self.user.id).delete()
+        m.db.session.commit()
+
+    def rate(self, movie_id, value):
+        m.db.session.add(m.Rating(user_id=self.user.id, movie_id=movie_id, rating=value))
+        m.db.session.commit()
+
+    def restart(self):
+        """What a freshly started worker sees"""
+        m._rating_store = None
+        return m.get_rating_store()
+
+    def test_fresh_snapshot_matches(self):
+        self.assertTrue(m.rating_store_matches_db(self.store))
+        self.assertEqual(self.store.meta["rating_count"], m.Rating.query.count())
+
+    def test_logged_and_compacted_writes_still_match(self):
+        self.rate(self.movie_ids[1], 5.0)
+        m.record_rating(self.user.id, self.movie_ids[1], 5.0)
+        self.assertTrue(m.rating_store_matches_db(self.store))
+        self.store.compact()
+        self.assertTrue(m.rating_store_matches_db(self.store))
+
+    def test_rating_written_outside_the_app_triggers_a_rebuild(self):
+        self.rate(self.movie_ids[1], 5.0)  # Committed, but never recorded in the store
+        self.assertFalse(m.rating_store_matches_db(self.store))
+        store = self.restart()
+        self.assertEqual(store.user_ratings(self.user.id), {self.movie_ids[0]: 4.0, self.movie_ids[1]: 5.0})
+        self.assertTrue(m.rating_store_matches_db(store))
+
+    def test_replaced_rows_trigger_a_rebuild(self):
+        self.rate(self.movie_ids[1], 5.0)
+        store = self.restart()
+        # Same row count, but a rating the snapshot never saw replaced an older one it did
+        m.Rating.query.filter_by(user_id=self.user.id, movie_id=self.movie_ids[0]).delete()
+        self.rate(self.movie_ids[2], 1.0)
+        self.assertFalse(m.rating_store_matches_db(store))
+        self.assertEqual(self.restart().user_ratings(self.user.id), {self.movie_ids[1]: 5.0, self.movie_ids[2]: 1.0})
+
+    def test_snapshot_without_recorded_ids_is_rebuilt(self):
+        self.store.write_snapshot(RatingArrays.empty({"source": m.app.config["SQLALCHEMY_DATABASE_URI"]}))
+        self.assertFalse(m.rating_store_matches_db(self.store))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+import random
+import unittest
+
+import numpy as np
+from sqlalchemy import text
+
+from app_testing import m, make_user
+from score_fusion import (
+    DEFAULT_PROFILES,
+    CatalogIndex,
+    StageScores,
+    StageWeights,
+    fuse,
+    load_profiles,
+    profile_for,
+    top_k,
+)
+
+
+def reference_merge(stage_outputs, profile, allowed_ids, k):
+    """The dict-based merge get_recommendations used before fusion was vectorized."""
+    movie_scores = {}
+    for name, scored, age_filtered in stage_outputs:
+        weights = profile[name]
+        for movie_id, score in scored:
+            if age_filtered and movie_id not in allowed_ids:
+                continue
+            if movie_id not in movie_scores:
+                movie_scores[movie_id] = score * weights.first
+            else:
+                movie_scores[movie_id] += score * weights.boost
+    sorted_movies = sorted(movie_scores.items(), key=lambda x: x[1], reverse=True)
+    return [(movie_id, min(score, 1.0)) for movie_id, score in sorted_movies[:k * 2] if movie_id in allowed_ids][:k]
+
+
+def vectorized_merge(catalog, stage_outputs, profile, allowed, k):
+    stages = [
+        StageScores(name, catalog.positions([movie_id for movie_id, _s in scored]),
+                    np.array([score for _m, score in scored], dtype=np.float64), age_filtered)
+        for name, scored, age_filtered in stage_outputs
+    ]
+    fused = fuse(stages, profile, allowed)
+    return [(int(catalog.movie_ids[fused.positions[i]]), min(float(fused.scores[i]), 1.0))
+            for i in top_k(fused, k, window=k * 2, allowed=allowed)]
+
+
+class TestCatalogIndex(unittest.TestCase):
+    def test_positions(self):
+        catalog = CatalogIndex([30, 10, 20], {"kid": [False, True, True]})
+        self.assertEqual(catalog.movie_ids.tolist(), [10, 20, 30])
+        self.assertEqual(catalog.positions([20, 99, 10, 5]).tolist(), [1, -1, 0, -1])
+        # Masks follow the id order
+        self.assertEqual(catalog.age_mask("kid").tolist(), [True, True, False])
+        self.assertIsNone(catalog.age_mask("adult"))
+        self.assertEqual(CatalogIndex([]).positions([1]).tolist(), [-1])
+
+
+class TestFusion(unittest.TestCase):
+    def test_first_hit_and_boost_weights(self):
+        catalog = CatalogIndex(range(1, 6))
+        profile = DEFAULT_PROFILES["default"]
+        fused = fuse([
+            StageScores("similarity", catalog.positions([2, 3]), np.array([0.5, 0.4])),
+            StageScores("collaborative", catalog.positions([3, 4]), np.array([0.5, 1.0])),
+            StageScores("content", catalog.positions([4]), np.array([1.0])),
+        ], profile)
+        scores = dict(zip(catalog.movie_ids[fused.positions].tolist(), fused.scores.tolist()))
+        self.assertAlmostEqual(scores[2], 0.5)
+        self.assertAlmostEqual(scores[3], 0.4 + 0.5 * 0.3)
+        self.assertAlmostEqual(scores[4], 1.0 * 0.4 + 0.2)
+
+    def test_ties_keep_insertion_order(self):
+        catalog = CatalogIndex(range(10))
+        fused = fuse([StageScores("content", catalog.positions([7, 2, 9, 4]), np.ones(4))], DEFAULT_PROFILES["default"])
+        ranked = top_k(fused, 3)
+        self.assertEqual(catalog.movie_ids[fused.positions[ranked]].tolist(), [7, 2, 9])
+
+    def test_empty(self):
+        fused = fuse([], DEFAULT_PROFILES["default"])
+        self.assertEqual(len(top_k(fused, 5)), 0)
+
+    def test_matches_dict_merge(self):
+        rng = random.Random(3)
+        catalog_ids = rng.sample(range(1, 5000), 400)
+        allowed_ids = {movie_id for movie_id in catalog_ids if rng.random() < 0.7}
+        catalog = CatalogIndex(catalog_ids, {"kid": [movie_id in allowed_ids for movie_id in catalog_ids]})
+        allowed = catalog.age_mask("kid")
+        for trial in range(200):
+            profile = profile_for(DEFAULT_PROFILES, rng.choice(["kid", "adult", None]))
+            k = rng.randint(1, 15)
+            pool = rng.sample(catalog_ids, rng.randint(1, 60))
+            stage_outputs = []
+            for name in ("age", "similarity", "collaborative", "content", "text"):
+                if rng.random() < 0.2:
+                    continue
+                movie_ids = rng.sample(pool, rng.randint(0, len(pool)))
+                if name in ("age", "content"):
+                    scored = [(movie_id, 1.0) for movie_id in movie_ids]
+                else:
+                    # Coarse scores so ties are common
+                    scored = [(movie_id, rng.choice([0.2, 0.4, 0.5, rng.random()])) for movie_id in movie_ids]
+                stage_outputs.append((name, scored, name != "age"))
+            with self.subTest(trial=trial):
+                self.assertEqual(vectorized_merge(catalog, stage_outputs, profile, allowed, k),
+                                 reference_merge(stage_outputs, profile, allowed_ids, k))
+
+
+class TestProfiles(unittest.TestCase):
+    def test_defaults(self):
+        profiles = load_profiles(None)
+        self.assertEqual(profile_for(profiles, "kid")["age"], StageWeights(0.8, 0.8))
+        self.assertEqual(profile_for(profiles, "youth")["age"], StageWeights(0.6, 0.6))
+        self.assertEqual(profile_for(profiles, None)["similarity"], StageWeights(1.0, 0.5))
+
+    def test_overrides(self):
+        profiles = load_profiles('{"youth": {"text": [0.6, 0.3]}, "default": {"content": [0.1, 0.1]}}')
+        self.assertEqual(profiles["youth"]["text"], StageWeights(0.6, 0.3))
+        self.assertEqual(profiles["default"]["content"], StageWeights(0.1, 0.1))
+        # Default overrides reach every group, group defaults are kept
+        self.assertEqual(profiles["youth"]["content"], StageWeights(0.1, 0.1))
+        self.assertEqual(profiles["kid"]["content"], StageWeights(0.1, 0.1))
+        self.assertEqual(profiles["kid"]["age"], StageWeights(0.8, 0.8))
+        self.assertEqual(profiles["kid"]["text"], StageWeights(0.4, 0.2))
+
+    def test_unknown_stage(self):
+        with self.assertRaises(ValueError):
+            load_profiles('{"kid": {"popularity": [1, 1]}}')
+
+
+class TestFusionCatalog(unittest.TestCase):
+    """The cached catalog index against age_rating edits made by another worker."""
+
+    def setUp(self):
+        self.ctx = m.app.app_context()
+        self.ctx.push()
+        user = make_user("fusion-kid", age=6)
+        self.user_id = user.id
+        # A preference keeps the viewer out of the cold-start cache
+        m.db.session.add(m.Preference(user_id=user.id, genre="Animation"))
+        m.db.session.commit()
+        self.rerated = {movie_id for (movie_id,) in m.db.session.query(m.Movie.id).filter_by(age_rating="G")}
+
+    def tearDown(self):
+        self.rerate("PG", "G")
+        m.Preference.query.filter_by(user_id=self.user_id).delete()
+        m.User.query.filter_by(id=self.user_id).delete()
+        m.db.session.commit()
+        m.invalidate_user_context(self.user_id)
+        m.db.session.remove()
+        self.ctx.pop()
+
+    def rerate(self, old, new):
+        # Raw SQL, as another worker's change would arrive: only the shared catalog version moves here
+        ids = ", ".join(str(movie_id) for movie_id in self.rerated)
+        m.db.session.execute(text(f"UPDATE movie SET age_rating = :new WHERE age_rating = :old AND id IN ({ids})"),
+                             {"old": old, "new": new})
+        m.db.session.execute(text("UPDATE catalog_version SET version = version + 1"))
+        m.db.session.commit()
+
+    def test_age_masks_follow_another_workers_changes(self):
+        self.assertTrue(self.rerated)
+        before = [(movie.id, score) for movie, score in m.get_recommendations(self.user_id, num_recommendations=8)]
+        self.assertTrue({movie_id for movie_id, score in before if score > 0.3} & self.rerated)
+        self.rerate("G", "PG")
+        catalog = m.get_fusion_catalog()
+        self.assertFalse(catalog.age_mask("g_only")[catalog.positions(sorted(self.rerated))].any())
+        after = m.get_recommendations(self.user_id, num_recommendations=8)
+        # Only the 0.3 fallback fill may still use them (it allows PG up to age 12)
+        self.assertFalse({movie.id for movie, score in after if score > 0.3} & self.rerated)
+
+
+if __name__ == "__main__":
+    unittest.main()
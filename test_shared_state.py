@@ -0,0 +1,90 @@
+import glob
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from shared_state import SharedArtifact, map_arrays, memory_usage, write_arrays
+
+
+class TestArrayFile(unittest.TestCase):
+    def test_round_trip_is_read_only_mapping(self):
+        arrays = {
+            "ids": np.arange(5, dtype=np.int32),
+            "scores": np.linspace(0, 1, 6, dtype=np.float32).reshape(2, 3),
+            "empty": np.zeros(0, dtype=np.int64),
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "arrays.bin")
+            write_arrays(path, arrays, {"source": "test"})
+            loaded, meta = map_arrays(path)
+            self.assertEqual(meta, {"source": "test"})
+            for name, array in arrays.items():
+                self.assertEqual(loaded[name].dtype, array.dtype)
+                np.testing.assert_array_equal(loaded[name], array)
+            self.assertFalse(loaded["ids"].flags.writeable)
+            self.assertEqual(os.listdir(tmp), ["arrays.bin"])
+            del loaded
+
+    def test_rejects_foreign_files(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "other.bin")
+            with open(path, "wb") as fh:
+                fh.write(b"not an array file")
+            with self.assertRaises(ValueError):
+                map_arrays(path)
+
+
+class TestSharedArtifact(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_nothing_published(self):
+        self.assertIsNone(SharedArtifact(self.tmp.name, "model").current())
+
+    def test_generation_swap(self):
+        writer = SharedArtifact(self.tmp.name, "model")
+        reader = SharedArtifact(self.tmp.name, "model")
+        self.assertEqual(writer.publish({"values": np.array([1, 2, 3])}, {"version": "a"}), 1)
+
+        old = reader.current()
+        self.assertEqual(old.number, 1)
+        self.assertIs(reader.current(), old)  # Unchanged pointer -> same mapping
+
+        self.assertEqual(writer.publish({"values": np.array([4, 5])}, {"version": "b"}), 2)
+        new = reader.current()
+        self.assertEqual(new.number, 2)
+        self.assertEqual(new.meta, {"version": "b"})
+        self.assertEqual(new["values"].tolist(), [4, 5])
+        # A request still holding the previous generation reads it consistently
+        self.assertEqual(old["values"].tolist(), [1, 2, 3])
+        del old, new
+
+    def test_old_generations_are_removed(self):
+        artifact = SharedArtifact(self.tmp.name, "model")
+        held = None
+        for i in range(4):
+            artifact.publish({"values": np.full(3, i)})
+            if i == 0:
+                held = artifact.current()
+        files = sorted(os.path.basename(p) for p in glob.glob(os.path.join(self.tmp.name, "model.*.bin")))
+        self.assertEqual([f.split(".")[1] for f in files], ["3", "4"])
+        # The mapping of a removed generation stays readable
+        self.assertEqual(held["values"].tolist(), [0, 0, 0])
+        del held
+
+
+class TestMemoryUsage(unittest.TestCase):
+    @unittest.skipUnless(os.path.exists("/proc/self/status"), "needs /proc")
+    def test_reports_resident_memory(self):
+        usage = memory_usage()
+        self.assertGreater(usage["rss"], 0)
+        self.assertIn("anon", usage)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import tempfile
+import unittest
+from unittest import mock
+
+from app_testing import m
+from shared_state import SharedArtifact
+from text_similarity import TextNeighborIndex, build_index
+
+
+SAMPLE_ROWS = [
+    (1, "Space Odyssey", "Astronauts travel through a wormhole in deep space."),
+    (2, "Wormhole", "A crew of astronauts explores space beyond a wormhole."),
+    (3, "Ocean Tale", "A clownfish crosses the ocean to find his son."),
+    (4, "Reef", "A young fish lost in the ocean reef searches for home."),
+    (5, "Empty", None),
+]
+
+
+class TestBuildIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = build_index(SAMPLE_ROWS, top_n=3)
+
+    def test_nearest_neighbor_shares_vocabulary(self):
+        self.assertEqual(self.index.neighbors(1)[0][0], 2)
+        self.assertEqual(self.index.neighbors(3)[0][0], 4)
+
+    def test_scores_sorted_descending_and_exclude_self(self):
+        for movie_id, *_ in SAMPLE_ROWS:
+            neighbors = self.index.neighbors(movie_id)
+            self.assertNotIn(movie_id, [n for n, _ in neighbors])
+            scores = [s for _, s in neighbors]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+            self.assertTrue(all(s > 0 for s in scores))
+
+    def test_movie_without_text_has_no_neighbors(self):
+        self.assertEqual(self.index.neighbors(5), [])
+
+    def test_unknown_movie_and_limit(self):
+        self.assertEqual(self.index.neighbors(999), [])
+        self.assertEqual(len(self.index.neighbors(1, limit=1)), 1)
+
+    def test_tiny_catalog(self):
+        index = build_index([(1, "Solo", "Only one movie.")], top_n=5)
+        self.assertEqual(index.neighbors(1), [])
+
+
+class TestPersistence(unittest.TestCase):
+    def test_publish_generation(self):
+        index = build_index(SAMPLE_ROWS, top_n=3, fingerprint="5:5")
+        with tempfile.TemporaryDirectory() as tmp:
+            artifact = SharedArtifact(tmp, "text_neighbors")
+            self.assertEqual(index.publish(artifact), 1)
+            loaded = TextNeighborIndex.from_generation(artifact.current())
+            self.assertEqual(loaded.fingerprint, "5:5")
+            self.assertEqual(len(loaded), len(SAMPLE_ROWS))
+            self.assertFalse(loaded.neighbor_ids.flags.writeable)
+            for movie_id, *_ in SAMPLE_ROWS:
+                self.assertEqual(loaded.neighbors(movie_id), index.neighbors(movie_id))
+            del loaded
+
+    def test_unsorted_rows_are_looked_up_by_id(self):
+        index = build_index(list(reversed(SAMPLE_ROWS)), top_n=3)
+        self.assertEqual(index.movie_ids.tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(index.neighbors(1)[0][0], 2)
+
+
+class TestIndexFreshness(unittest.TestCase):
+    """The app's published index against movie edits made while workers run."""
+
+    def setUp(self):
+        self.ctx = m.app.app_context()
+        self.ctx.push()
+        self.addCleanup(self.ctx.pop)
+        patcher = mock.patch.object(m, "TEXT_INDEX_REBUILD_IN_BACKGROUND", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        m.ensure_text_index()
+
+    def get_text_index(self):
+        with mock.patch.object(m.threading, "Thread") as thread:
+            index = m.get_text_index()
+        return index, thread
+
+    def test_fresh_index_is_used_as_is(self):
+        index, thread = self.get_text_index()
+        self.assertEqual(index.fingerprint, m.get_catalog_fingerprint())
+        thread.assert_not_called()
+
+    def test_description_edit_is_picked_up_in_the_background(self):
+        source, target = m.Movie.query.order_by(m.Movie.id).limit(2).all()
+        original = (target.title, target.description)
+        self.addCleanup(self.restore, target.id, original)
+        self.assertNotEqual(m.get_text_index().neighbors(source.id)[0][0], target.id)
+        # Neither the movie count nor the highest id changes
+        target.title, target.description = source.title, source.description
+        m.db.session.commit()
+
+        stale, thread = self.get_text_index()
+        self.assertNotEqual(stale.fingerprint, m.get_catalog_fingerprint())
+        thread.assert_called_once_with(target=m._rebuild_text_index_in_background, name="text-index-rebuild", daemon=True)
+        # One rebuild per worker at a time
+        _index, second = self.get_text_index()
+        second.assert_not_called()
+
+        m._rebuild_text_index_in_background()
+        fresh, thread = self.get_text_index()
+        thread.assert_not_called()
+        self.assertEqual(fresh.fingerprint, m.get_catalog_fingerprint())
+        self.assertEqual(fresh.neighbors(source.id)[0][0], target.id)
+
+    def restore(self, movie_id, original):
+        movie = m.db.session.get(m.Movie, movie_id)
+        movie.title, movie.description = original
+        m.db.session.commit()
+        m.ensure_text_index()
+        if m._text_index_rebuilding.locked():
+            m._text_index_rebuilding.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,239 @@
+import threading
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy import event, inspect
+
+from app_testing import m, make_user
+from trending import ALL_GROUP, aggregate_ratings, decay_factor, rating_weight
+
+
+NOW = datetime(2024, 1, 31)
+
+
+def group_for_age(age):
+    if age is None:
+        return None
+    return "kid" if age <= 12 else "adult"
+
+
+class TestDecay(unittest.TestCase):
+    def test_half_life(self):
+        self.assertAlmostEqual(decay_factor(14 * 86400, half_life_days=14), 0.5)
+        self.assertAlmostEqual(decay_factor(28 * 86400, half_life_days=14), 0.25)
+
+    def test_future_or_zero_elapsed_does_not_decay(self):
+        self.assertEqual(decay_factor(0), 1.0)
+        self.assertEqual(decay_factor(-100), 1.0)
+
+    def test_decay_composes_for_incremental_refresh(self):
+        # Decaying a stored score twice equals decaying it once over the whole span
+        split = decay_factor(3 * 86400) * decay_factor(4 * 86400)
+        self.assertAlmostEqual(split, decay_factor(7 * 86400))
+
+    def test_rating_weight(self):
+        self.assertEqual(rating_weight(5), 1.0)
+        self.assertEqual(rating_weight(None), 0.0)
+
+
+class TestAggregateRatings(unittest.TestCase):
+    def test_partitions_by_age_group_and_all(self):
+        rows = [
+            (1, 5.0, NOW, 8),
+            (1, 5.0, NOW, 30),
+            (2, 5.0, NOW, None),
+        ]
+        scores = aggregate_ratings(rows, NOW, group_for_age)
+        self.assertAlmostEqual(scores[(ALL_GROUP, 1)], 2.0)
+        self.assertAlmostEqual(scores[("kid", 1)], 1.0)
+        self.assertAlmostEqual(scores[("adult", 1)], 1.0)
+        self.assertAlmostEqual(scores[(ALL_GROUP, 2)], 1.0)
+        self.assertNotIn(("kid", 2), scores)
+
+    def test_recent_ratings_outweigh_old_ones(self):
+        rows = [
+            (1, 5.0, NOW - timedelta(days=60), 30),
+            (1, 5.0, NOW - timedelta(days=60), 30),
+            (2, 5.0, NOW - timedelta(days=1), 30),
+        ]
+        scores = aggregate_ratings(rows, NOW, group_for_age, half_life_days=14)
+        self.assertGreater(scores[("adult", 2)], scores[("adult", 1)])
+
+
+class TestRefreshTrending(unittest.TestCase):
+    """refresh_trending against the app database, starting from an empty table at T0."""
+
+    T0 = datetime(2024, 1, 1)
+
+    def setUp(self):
+        self.ctx = m.app.app_context()
+        self.ctx.push()
+        db = m.db
+        self.user_id = make_user("trender", age=30).id
+        self.other_id = make_user("trender2", age=30).id
+        self.movie_ids = [movie_id for (movie_id,) in db.session.query(m.Movie.id).order_by(m.Movie.id).limit(2)]
+        m.TrendingScore.query.delete()
+        m.TrendingState.query.delete()
+        max_rating_id = db.session.query(db.func.max(m.Rating.id)).scalar() or 0
+        db.session.add(m.TrendingState(id=1, last_rating_id=max_rating_id, refreshed_at=self.T0))
+        db.session.commit()
+
+    def tearDown(self):
+        db = m.db
+        db.session.rollback()
+        m.Rating.query.filter(m.Rating.user_id.in_([self.user_id, self.other_id])).delete()
+        m.User.query.filter(m.User.id.in_([self.user_id, self.other_id])).delete()
+        m.TrendingScore.query.delete()
+        m.TrendingState.query.delete()
+        db.session.commit()
+        db.session.remove()
+        self.ctx.pop()
+
+    def rate(self, movie_id, rating, created_at, user_id=None):
+        rating = m.Rating(user_id=user_id or self.user_id, movie_id=movie_id, rating=rating, created_at=created_at)
+        m.db.session.add(rating)
+        m.db.session.commit()
+        return rating.id
+
+    def scores(self):
+        return {(row.age_group, row.movie_id): row.score for row in m.TrendingScore.query}
+
+    def state(self):
+        return m.db.session.query(m.TrendingState.last_rating_id, m.TrendingState.refreshed_at).one()
+
+    def test_only_ratings_past_the_watermark_are_added(self):
+        rating_id = self.rate(self.movie_ids[0], 5.0, self.T0)
+        self.assertEqual(m.refresh_trending(now=self.T0), 2)  # "all" and "adult"
+        self.assertEqual(self.state(), (rating_id, self.T0))
+        self.assertAlmostEqual(self.scores()[(ALL_GROUP, self.movie_ids[0])], 1.0)
+        self.assertAlmostEqual(self.scores()[("adult", self.movie_ids[0])], 1.0)
+        # Nothing new: the same rating is not counted twice
+        self.assertEqual(m.refresh_trending(now=self.T0), 0)
+        self.assertAlmostEqual(self.scores()[(ALL_GROUP, self.movie_ids[0])], 1.0)
+
+    def test_stored_scores_decay_and_new_ratings_are_upserted(self):
+        self.rate(self.movie_ids[0], 5.0, self.T0)
+        m.refresh_trending(now=self.T0)
+        later = self.T0 + timedelta(days=m.TRENDING_HALF_LIFE_DAYS)
+        self.rate(self.movie_ids[1], 5.0, later)
+        rating_id = self.rate(self.movie_ids[0], 2.5, later, user_id=self.other_id)
+        m.refresh_trending(now=later)
+        scores = self.scores()
+        # Decayed by one half-life, plus the new rating added to the existing row
+        self.assertAlmostEqual(scores[(ALL_GROUP, self.movie_ids[0])], 0.5 + 0.5)
+        self.assertAlmostEqual(scores[(ALL_GROUP, self.movie_ids[1])], 1.0)
+        self.assertEqual(self.state(), (rating_id, later))
+        self.assertEqual(m.TrendingScore.query.filter_by(movie_id=self.movie_ids[0]).count(), 2)
+
+    def refresh_racing(self, concurrent_update, now):
+        """refresh_trending while another worker's refresh commits between the state read and the claim."""
+        engine = m.db.engine
+        raced = []
+
+        def before_claim(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("UPDATE trending_state") and not raced:
+                raced.append(True)
+                cursor.execute(concurrent_update)
+
+        event.listen(engine, "before_cursor_execute", before_claim)
+        try:
+            updated = m.refresh_trending(now=now)
+        finally:
+            event.remove(engine, "before_cursor_execute", before_claim)
+        self.assertTrue(raced)
+        return updated
+
+    def test_skips_when_another_worker_moved_the_watermark(self):
+        self.rate(self.movie_ids[0], 5.0, self.T0)
+        m.refresh_trending(now=self.T0)
+        before = self.scores()
+        self.rate(self.movie_ids[1], 5.0, self.T0)
+        updated = self.refresh_racing("UPDATE trending_state SET last_rating_id = last_rating_id + 1",
+                                      self.T0 + timedelta(days=1))
+        self.assertEqual(updated, 0)
+        # Neither decayed nor incremented
+        self.assertEqual(self.scores(), before)
+
+    def test_scores_are_not_decayed_twice(self):
+        self.rate(self.movie_ids[0], 5.0, self.T0)
+        m.refresh_trending(now=self.T0)
+        before = self.scores()
+        # The other refresh found no new ratings: only refreshed_at moved (it applied the decay already)
+        updated = self.refresh_racing("UPDATE trending_state SET refreshed_at = '2024-01-08 00:00:00.000000'",
+                                      self.T0 + timedelta(days=14))
+        self.assertEqual(updated, 0)
+        self.assertEqual(self.scores(), before)
+
+    def test_ratings_are_aggregated_before_taking_the_write_lock(self):
+        self.rate(self.movie_ids[0], 5.0, self.T0)
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(m.db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            m.refresh_trending(now=self.T0)
+        finally:
+            event.remove(m.db.engine, "before_cursor_execute", before_cursor_execute)
+        aggregation = next(i for i, statement in enumerate(statements) if "JOIN user" in statement)
+        writes = [i for i, statement in enumerate(statements) if statement.lstrip().startswith(("UPDATE", "INSERT", "DELETE"))]
+        self.assertLess(aggregation, min(writes))
+
+    def test_does_not_touch_the_callers_session(self):
+        # Like a GET request that triggers the refresh with current_user loaded
+        self.rate(self.movie_ids[0], 5.0, self.T0)
+        user = m.db.session.get(m.User, self.user_id)
+        self.assertEqual(user.username, "trender")
+        pending = m.Preference(user_id=self.user_id, genre="Drama")
+        m.db.session.add(pending)
+        self.assertEqual(m.refresh_trending(now=self.T0), 2)
+        self.assertFalse(inspect(user).expired)
+        self.assertIn(pending, m.db.session.new)
+        m.db.session.rollback()
+
+
+class TestRefreshInBackground(unittest.TestCase):
+    """refresh_trending_if_stale hands the refresh to a thread instead of running it in the request."""
+
+    def setUp(self):
+        self.ctx = m.app.app_context()
+        self.ctx.push()
+        self.addCleanup(self.ctx.pop)
+        m.TrendingState.query.delete()
+        m.db.session.commit()
+        for patcher in (mock.patch.object(m, "TRENDING_REFRESH_IN_BACKGROUND", True),
+                        mock.patch.object(m, "_trending_checked_at", None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_request_does_not_wait_for_the_refresh(self):
+        release = threading.Event()
+        calls = []
+
+        def slow_refresh():
+            calls.append(threading.current_thread().name)
+            release.wait(5)
+
+        with mock.patch.object(m, "refresh_trending", slow_refresh):
+            m.refresh_trending_if_stale()
+            # Still running: a later stale check in this worker does not start a second one
+            m._trending_checked_at = None
+            m.refresh_trending_if_stale()
+            release.set()
+            for thread in threading.enumerate():
+                if thread.name == "trending-refresh":
+                    thread.join(5)
+        self.assertEqual(calls, ["trending-refresh"])
+        self.assertFalse(m._trending_refresh_running.locked())
+
+    def test_disabled(self):
+        with mock.patch.object(m, "TRENDING_REFRESH_IN_BACKGROUND", False), \
+                mock.patch.object(m, "refresh_trending") as refresh:
+            m.refresh_trending_if_stale()
+        refresh.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+from app_testing import m, make_user
+from user_context import ContextCache, UserContext
+
+
+CREATED = datetime(2024, 1, 1)
+
+ROWS = [
+    ("rating", 3, 4.0, None),
+    ("rating", 1, 2.5, None),
+    ("preference", None, 1.0, "Drama"),
+    ("preference", None, 1.0, "Comedy"),
+]
+
+
+def make_context(user_id=1, version=0, created_at=CREATED):
+    return UserContext.from_rows(
+        user_id, 30, "adult", ROWS, data_version=version, created_at=created_at, user=object()
+    )
+
+
+class TestUserContext(unittest.TestCase):
+    def test_from_rows(self):
+        context = make_context()
+        self.assertEqual(context.ratings, {3: 4.0, 1: 2.5})
+        self.assertEqual(context.rated_movie_ids, [3, 1])
+        self.assertEqual(context.preferred_genres, ("Drama", "Comedy"))
+        self.assertTrue(context.has_ratings)
+        self.assertFalse(context.is_cold_start)
+
+    def test_cold_start(self):
+        context = UserContext.from_rows(2, None, None, [])
+        self.assertTrue(context.is_cold_start)
+        self.assertEqual(context.rated_movie_ids, [])
+
+    def test_detached_drops_orm_row(self):
+        context = make_context()
+        self.assertIsNone(context.detached().user)
+        self.assertEqual(context.detached(), context)
+
+
+class TestContextCache(unittest.TestCase):
+    def test_hit_requires_matching_version(self):
+        cache = ContextCache()
+        cache.put(make_context(version=3))
+        self.assertIsNotNone(cache.get(1, 3, CREATED))
+        self.assertIsNone(cache.get(1, 4, CREATED))
+        # The stale entry was evicted
+        self.assertIsNone(cache.get(1, 3, CREATED))
+
+    def test_recreated_user_with_reused_id_misses(self):
+        cache = ContextCache()
+        cache.put(make_context(version=0))
+        self.assertIsNone(cache.get(1, 0, datetime(2024, 6, 1)))
+
+    def test_stores_detached_copies(self):
+        cache = ContextCache()
+        cache.put(make_context())
+        self.assertIsNone(cache.get(1, 0, CREATED).user)
+
+    def test_lru_eviction_and_discard(self):
+        cache = ContextCache(max_size=2)
+        for user_id in (1, 2):
+            cache.put(make_context(user_id=user_id))
+        cache.get(1, 0, CREATED)
+        cache.put(make_context(user_id=3))
+        self.assertIsNone(cache.get(2, 0, CREATED))
+        self.assertIsNotNone(cache.get(1, 0, CREATED))
+        cache.discard(1)
+        self.assertEqual(len(cache), 1)
+
+    def test_disabled(self):
+        cache = ContextCache(max_size=0)
+        cache.put(make_context())
+        self.assertEqual(len(cache), 0)
+
+
+class TestRatingOrder(unittest.TestCase):
+    """Ratings in the context follow created_at, not the (user_id, movie_id) index order."""
+
+    @classmethod
+    def setUpClass(cls):
+        with m.app.app_context():
+            user = make_user("recency", age=30)
+            cls.user_id = user.id
+            movie_ids = [movie_id for (movie_id,) in m.db.session.query(m.Movie.id).order_by(m.Movie.id).limit(6)]
+            # Lowest movie ids rated most recently, so index order and recency disagree
+            m.db.session.add_all([
+                m.Rating(user_id=user.id, movie_id=movie_id, rating=4.0,
+                         created_at=datetime(2024, 1, 1) - timedelta(days=i))
+                for i, movie_id in enumerate(movie_ids)
+            ])
+            m.db.session.add_all([m.Preference(user_id=user.id, genre=genre) for genre in ("Drama", "Comedy")])
+            m.db.session.commit()
+            cls.oldest_first = movie_ids[::-1]
+
+    @classmethod
+    def tearDownClass(cls):
+        with m.app.app_context():
+            m.Rating.query.filter_by(user_id=cls.user_id).delete()
+            m.Preference.query.filter_by(user_id=cls.user_id).delete()
+            m.User.query.filter_by(id=cls.user_id).delete()
+            m.db.session.commit()
+            m.invalidate_user_context(cls.user_id)
+
+    def test_context_ratings_are_oldest_first(self):
+        with m.app.app_context():
+            m.invalidate_user_context(self.user_id)
+            context = m.get_user_context(self.user_id)
+            self.assertEqual(context.rated_movie_ids, self.oldest_first)
+            self.assertEqual(context.preferred_genres, ("Drama", "Comedy"))
+
+    def test_seed_window_takes_the_most_recent_ratings(self):
+        with m.app.app_context(), mock.patch.object(m, "SIMILARITY_SEED_LIMIT", 2):
+            m.invalidate_user_context(self.user_id)
+            context = m.get_user_context(self.user_id)
+            self.assertEqual(m.get_seed_movie_ids(context), self.oldest_first[-2:])
+            self.assertNotEqual(m.get_seed_movie_ids(context), sorted(self.oldest_first)[-2:])
+
+
+if __name__ == "__main__":
+    unittest.main()
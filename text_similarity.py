@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+from typing import Iterable
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from shared_state import Generation, SharedArtifact
+
+
+DEFAULT_TOP_N = 20
+
+# Rows of the (catalog x catalog) similarity product computed at a time while
+# building the index. Keeps peak memory at O(block * catalog) instead of O(catalog^2).
+_BLOCK_ROWS = 1024
+
+
+def _document(title: str | None, description: str | None, include_titles: bool) -> str:
+    parts = []
+    if include_titles and title:
+        parts.append(title)
+    if description:
+        parts.append(description)
+    return " ".join(parts)
+
+
+class TextNeighborIndex:
+    """
+    Precomputed top-N description neighbors for every movie in the catalog.
+
+    Neighbors are stored as two dense (n_movies x top_n) arrays padded with -1 / 0.0 and
+    rows sorted by movie id, so a lookup is one binary search plus a row slice. The arrays
+    can be read-only views of a shared memory-mapped generation.
+    """
+
+    def __init__(
+        self,
+        movie_ids: Iterable[int],
+        neighbor_ids: np.ndarray,
+        neighbor_scores: np.ndarray,
+        fingerprint: str = "",
+    ):
+        movie_ids = np.asarray(movie_ids if isinstance(movie_ids, np.ndarray) else list(movie_ids), dtype=np.int32)
+        neighbor_ids = np.asarray(neighbor_ids, dtype=np.int32)
+        neighbor_scores = np.asarray(neighbor_scores, dtype=np.float32)
+        if len(movie_ids) > 1 and not np.all(movie_ids[1:] > movie_ids[:-1]):
+            order = np.argsort(movie_ids, kind="stable")
+            movie_ids, neighbor_ids, neighbor_scores = movie_ids[order], neighbor_ids[order], neighbor_scores[order]
+        self.movie_ids = movie_ids
+        self.neighbor_ids = neighbor_ids
+        self.neighbor_scores = neighbor_scores
+        self.fingerprint = fingerprint
+
+    def __len__(self) -> int:
+        return len(self.movie_ids)
+
+    @property
+    def top_n(self) -> int:
+        return self.neighbor_ids.shape[1] if self.neighbor_ids.ndim == 2 else 0
+
+    def neighbors(self, movie_id: int, limit: int | None = None) -> list[tuple[int, float]]:
+        """Return [(movie_id, score), ...] most similar first; empty for unknown movies."""
+        row = int(np.searchsorted(self.movie_ids, movie_id))
+        if row >= len(self.movie_ids) or self.movie_ids[row] != movie_id:
+            return []
+        ids = self.neighbor_ids[row]
+        scores = self.neighbor_scores[row]
+        valid = ids >= 0
+        ids, scores = ids[valid], scores[valid]
+        if limit is not None:
+            ids, scores = ids[:limit], scores[:limit]
+        return [(int(i), float(s)) for i, s in zip(ids, scores)]
+
+    def _arrays(self) -> dict[str, np.ndarray]:
+        return {
+            "movie_ids": self.movie_ids,
+            "neighbor_ids": self.neighbor_ids,
+            "neighbor_scores": self.neighbor_scores,
+        }
+
+    def publish(self, artifact: SharedArtifact) -> int:
+        """Publish the index as the artifact's next generation; returns the generation number."""
+        return artifact.publish(self._arrays(), {"fingerprint": self.fingerprint})
+
+    @classmethod
+    def from_generation(cls, generation: Generation) -> "TextNeighborIndex":
+        return cls._from_arrays(generation.arrays, generation.meta)
+
+    @classmethod
+    def _from_arrays(cls, arrays: dict[str, np.ndarray], meta: dict) -> "TextNeighborIndex":
+        return cls(
+            arrays["movie_ids"],
+            arrays["neighbor_ids"],
+            arrays["neighbor_scores"],
+            fingerprint=meta.get("fingerprint", ""),
+        )
+
+
+def build_index(
+    rows: Iterable[tuple[int, str | None, str | None]],
+    top_n: int = DEFAULT_TOP_N,
+    include_titles: bool = True,
+    fingerprint: str = "",
+) -> TextNeighborIndex:
+    """
+    Build a TextNeighborIndex from (movie_id, title, description) rows.
+
+    Documents are TF-IDF vectorized (L2-normalized, so the sparse dot product is the
+    cosine similarity) and only neighbors with a positive similarity are kept.
+    """
+    rows = list(rows)
+    movie_ids = [int(r[0]) for r in rows]
+    n = len(rows)
+    neighbor_ids = np.full((n, top_n), -1, dtype=np.int32)
+    neighbor_scores = np.zeros((n, top_n), dtype=np.float32)
+
+    docs = [_document(title, description, include_titles) for _mid, title, description in rows]
+    if n < 2 or not any(d.strip() for d in docs):
+        return TextNeighborIndex(movie_ids, neighbor_ids, neighbor_scores, fingerprint)
+
+    vectorizer = TfidfVectorizer(stop_words="english", sublinear_tf=True)
+    try:
+        matrix = vectorizer.fit_transform(docs).tocsr()
+    except ValueError:
+        # Every document consisted only of stop words
+        return TextNeighborIndex(movie_ids, neighbor_ids, neighbor_scores, fingerprint)
+
+    ids_array = np.asarray(movie_ids, dtype=np.int64)
+    k = min(top_n, n - 1)
+    matrix_t = matrix.T.tocsc()
+    for start in range(0, n, _BLOCK_ROWS):
+        stop = min(start + _BLOCK_ROWS, n)
+        block = (matrix[start:stop] @ matrix_t).toarray()
+        # A movie is never its own neighbor
+        block[np.arange(stop - start), np.arange(start, stop)] = -1.0
+
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        keep = top_scores > 0
+        neighbor_ids[start:stop, :k] = np.where(keep, ids_array[top], -1)
+        neighbor_scores[start:stop, :k] = np.where(keep, top_scores, 0.0)
+
+    return TextNeighborIndex(movie_ids, neighbor_ids, neighbor_scores, fingerprint)
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Callable, Iterable
+
+
+DEFAULT_HALF_LIFE_DAYS = 14.0
+
+# Partition that aggregates ratings from every user (used when the viewer's age is unknown)
+ALL_GROUP = "all"
+
+# Scores that decayed below this are dropped from the materialized table
+MIN_SCORE = 1e-4
+
+
+def decay_factor(elapsed_seconds: float, half_life_days: float = DEFAULT_HALF_LIFE_DAYS) -> float:
+    """Exponential decay multiplier for an event that happened `elapsed_seconds` ago."""
+    if elapsed_seconds <= 0:
+        return 1.0
+    return 0.5 ** (elapsed_seconds / (half_life_days * 86400.0))
+
+
+def rating_weight(rating: float | None) -> float:
+    """Contribution of a single rating before decay (a 5-star rating counts fully)."""
+    if rating is None:
+        return 0.0
+    return max(float(rating), 0.0) / 5.0
+
+
+def aggregate_ratings(
+    rows: Iterable[tuple[int, float, datetime | None, int | None]],
+    now: datetime,
+    group_for_age: Callable[[int | None], str | None],
+    half_life_days: float = DEFAULT_HALF_LIFE_DAYS,
+) -> dict[tuple[str, int], float]:
+    """
+    Single pass over (movie_id, rating, created_at, rater_age) rows.
+
+    Returns {(age_group, movie_id): decayed score as of `now`}. Every rating counts
+    towards ALL_GROUP and, when the rater's age is known, towards their own group.
+    """
+    scores: dict[tuple[str, int], float] = {}
+    for movie_id, rating, created_at, age in rows:
+        elapsed = (now - created_at).total_seconds() if created_at else 0.0
+        value = rating_weight(rating) * decay_factor(elapsed, half_life_days)
+        if value <= 0:
+            continue
+        key = (ALL_GROUP, movie_id)
+        scores[key] = scores.get(key, 0.0) + value
+        group = group_for_age(age)
+        if group:
+            key = (group, movie_id)
+            scores[key] = scores.get(key, 0.0) + value
+    return scores
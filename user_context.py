@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import Any, Hashable, Iterable
+
+
+@dataclass(frozen=True)
+class UserContext:
+    """
+    Everything the recommendation stages need to know about one user.
+
+    Built once per request (one database round-trip) and passed to every stage instead of
+    each stage re-querying the user, their ratings and their preferences.
+    """
+
+    user_id: int
+    age: int | None
+    age_group: str | None
+    ratings: dict[int, float] = field(default_factory=dict)  # movie_id -> rating, oldest first (created_at, id)
+    preferred_genres: tuple[str, ...] = ()
+    data_version: int = 0
+    created_at: datetime | None = None
+    user: Any = field(default=None, compare=False, repr=False)  # ORM row of the current session
+
+    @property
+    def rated_movie_ids(self) -> list[int]:
+        return list(self.ratings)
+
+    @property
+    def has_ratings(self) -> bool:
+        return bool(self.ratings)
+
+    @property
+    def is_cold_start(self) -> bool:
+        return not self.ratings and not self.preferred_genres
+
+    def cache_key(self) -> tuple[Hashable, ...]:
+        # created_at guards against a recreated user inheriting a reused id
+        return (self.user_id, self.data_version, self.created_at)
+
+    def detached(self) -> "UserContext":
+        """Copy without the ORM row, safe to share across sessions and threads."""
+        return replace(self, user=None)
+
+    @classmethod
+    def from_rows(
+        cls,
+        user_id: int,
+        age: int | None,
+        age_group: str | None,
+        rows: Iterable[tuple[str, int | None, float | None, str | None]],
+        **kwargs: Any,
+    ) -> "UserContext":
+        """
+        Build a context from ('rating', movie_id, rating, None) and
+        ('preference', None, weight, genre) rows of a single combined query.
+        """
+        ratings: dict[int, float] = {}
+        genres: list[str] = []
+        for kind, movie_id, value, genre in rows:
+            if kind == "rating":
+                ratings[int(movie_id)] = float(value)
+            elif genre:
+                genres.append(genre)
+        return cls(user_id, age, age_group, ratings, tuple(genres), **kwargs)
+
+
+class ContextCache:
+    """Small LRU of detached UserContexts, valid only while the user's data version matches."""
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._entries: OrderedDict[int, UserContext] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: int, data_version: int, created_at: datetime | None) -> UserContext | None:
+        with self._lock:
+            context = self._entries.get(user_id)
+            if context is None:
+                return None
+            if context.cache_key() != (user_id, data_version, created_at):
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return context
+
+    def put(self, context: UserContext) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[context.user_id] = context.detached()
+            self._entries.move_to_end(context.user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()